@@ -0,0 +1,274 @@
+"""
+Benchmark how much data :meth:`.Subject.data_thread` can store on a given disk.
+
+Synthetic data shaped like a task's ``TrialData`` and ``ContinuousData`` (from :data:`~.tasks.TASK_LIST`)
+are fed through :meth:`.Subject.save_data` for a temporary subject, the same way a running task's data
+arrive: each trial is sent as several partial updates followed by a ``TRIAL_END``, with continuous samples
+interleaved between them.
+
+For each combination of settings, the benchmark measures
+
+* sustained throughput - items and trials stored per second, from the first item sent until the queue is drained,
+* queue lag - the longest time between an item being sent and being stored, and the longest the queue got,
+* file size growth - bytes added to the .h5 file per trial.
+
+Settings that can be compared are the compression of continuous data (:attr:`.Subject.continuous_filter`),
+the number of continuous samples buffered per write (:attr:`.Subject.continuous_block`),
+and how often the journal is flushed to disk (:attr:`.Journal.fsync_every`).
+
+Called as a module::
+
+    python -m autopilot.core.benchmark -t Parallax -n 1000 -s 50
+
+"""
+
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import itertools
+
+import numpy as np
+import tables
+
+from autopilot.tasks import TASK_LIST
+from autopilot.core.subject import Subject
+
+
+DEFAULT_SETTINGS = {
+    'complib': ['blosc'],
+    'complevel': [0, 6],
+    'continuous_block': [64, 1024],
+    'fsync_every': [1, 50]
+}
+"""
+dict: settings compared by :func:`.benchmark` by default, every combination is run.
+"""
+
+
+def fake_value(col, rng):
+    """
+    Make a random value for a column of a task's data descriptor
+
+    Args:
+        col (:class:`tables.Col`): column description
+        rng (:class:`numpy.random.Generator`): random number generator
+
+    Returns:
+        a value that can be stored in the column
+    """
+    if col.kind == 'string':
+        return b'x' * col.itemsize
+    elif col.kind == 'bool':
+        value = rng.integers(0, 2, size=col.shape).astype(bool)
+    elif col.kind in ('int', 'uint'):
+        value = rng.integers(0, 2, size=col.shape).astype(col.dtype.base)
+    else:
+        value = rng.random(size=col.shape).astype(col.dtype.base)
+
+    if col.shape == ():
+        return value.item() if hasattr(value, 'item') else value
+    return value
+
+
+def fake_trials(task_class, n_trials, n_partial=3, n_samples=0, seed=0):
+    """
+    Generate data like a task sends while running
+
+    Args:
+        task_class (:class:`~.tasks.Task`): task class with a ``TrialData`` and/or ``ContinuousData`` descriptor
+        n_trials (int): number of trials
+        n_partial (int): number of partial updates to split each trial's data into, before the ``TRIAL_END``
+        n_samples (int): number of samples of each continuous data stream sent per trial.
+            streams whose type is ``'infer'`` (eg. video) are skipped.
+        seed (int): random seed
+
+    Yields:
+        dict: data to pass to :meth:`.Subject.save_data`
+    """
+    rng = np.random.default_rng(seed)
+
+    trial_cols = {}
+    if getattr(task_class, 'TrialData', None) is not None:
+        trial_cols = {name: col for name, col in task_class.TrialData.columns.items()
+                      if name not in ('trial_num', 'session')}
+    trial_cols = list(trial_cols.items())
+
+    cont_cols = {}
+    if n_samples > 0 and hasattr(task_class, 'ContinuousData'):
+        cont_cols = {name: col for name, col in task_class.ContinuousData.items()
+                     if isinstance(col, tables.Col)}
+
+    # split the trial's columns into partial updates
+    chunks = [trial_cols[i::n_partial] for i in range(n_partial)]
+    sample_t = time.time()
+
+    for trial_num in range(n_trials):
+        for i, chunk in enumerate(chunks):
+            data = {name: fake_value(col, rng) for name, col in chunk}
+            data['trial_num'] = trial_num
+            yield data
+
+            # spread continuous samples across the trial
+            for _ in range(n_samples // n_partial + (1 if i < n_samples % n_partial else 0)):
+                sample_t += 0.001
+                sample = {name: fake_value(col, rng) for name, col in cont_cols.items()}
+                sample['continuous'] = True
+                sample['timestamp'] = sample_t
+                yield sample
+
+        yield {'trial_num': trial_num, 'TRIAL_END': True}
+
+
+def run(task, n_trials=1000, n_partial=3, n_samples=0, complib='blosc', complevel=6,
+        continuous_block=1024, fsync_every=50, rate=None, dir=None):
+    """
+    Run one benchmark with a temporary subject.
+
+    Args:
+        task (str): name of a task in :data:`~.tasks.TASK_LIST`
+        n_trials (int): number of trials to send
+        n_partial (int): partial updates per trial, see :func:`.fake_trials`
+        n_samples (int): continuous samples of each stream per trial, see :func:`.fake_trials`
+        complib (str): compression library for continuous data
+        complevel (int): compression level for continuous data
+        continuous_block (int): :attr:`.Subject.continuous_block`
+        fsync_every (int): :attr:`.Journal.fsync_every`
+        rate (float): trials per second to send data at. if None (default), send as fast as possible.
+        dir (str): directory to make the temporary subject in. if None, the system's temporary directory.
+            should be on the disk being benchmarked.
+
+    Returns:
+        dict: with keys
+
+            * items (int) - number of items sent
+            * trials (int) - number of trials sent
+            * seconds (float) - time from sending the first item until all were stored
+            * items_per_s (float) - sustained throughput
+            * trials_per_s (float)
+            * max_lag (float) - longest time (s) from an item being sent to being stored
+            * max_queue (int) - longest the queue got
+            * bytes_per_trial (float) - growth of the .h5 file per trial
+    """
+    task_class = TASK_LIST[task]
+    tmp_dir = tempfile.mkdtemp(prefix='autopilot_benchmark_', dir=dir)
+    try:
+        protocol_file = os.path.join(tmp_dir, 'benchmark.json')
+        with open(protocol_file, 'w') as f:
+            json.dump([{'task_type': task, 'step_name': 'benchmark'}], f)
+
+        subject = Subject('benchmark', dir=tmp_dir, new=True)
+        subject.assign_protocol(protocol_file, 0)
+        subject.continuous_filter = tables.Filters(complib=complib, complevel=complevel)
+        subject.continuous_block = continuous_block
+        size_before = os.path.getsize(subject.file)
+
+        subject.prepare_run()
+        subject.journal.fsync_every = fsync_every
+
+        n_items = 0
+        max_queue = 0
+        start = time.perf_counter()
+        for data in fake_trials(task_class, n_trials, n_partial, n_samples):
+            subject.save_data(data)
+            n_items += 1
+
+            if 'TRIAL_END' in data.keys():
+                max_queue = max(max_queue, subject.data_queue.qsize())
+                if rate is not None:
+                    wait = start + (data['trial_num'] + 1) / rate - time.perf_counter()
+                    if wait > 0:
+                        time.sleep(wait)
+
+        # wait for the data thread to catch up
+        while subject.journal_stats.get('compacted', 0) < n_items:
+            time.sleep(0.001)
+        seconds = time.perf_counter() - start
+        stats = subject.get_journal_stats()
+        subject.stop_run()
+
+        size_after = os.path.getsize(subject.file)
+
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return {
+        'items': n_items,
+        'trials': n_trials,
+        'seconds': seconds,
+        'items_per_s': n_items / seconds,
+        'trials_per_s': n_trials / seconds,
+        'max_lag': stats.get('max_lag', 0.0),
+        'max_queue': max_queue,
+        'bytes_per_trial': (size_after - size_before) / n_trials
+    }
+
+
+def benchmark(task, settings=None, **kwargs):
+    """
+    Run :func:`.run` for every combination of settings
+
+    Args:
+        task (str): name of a task in :data:`~.tasks.TASK_LIST`
+        settings (dict): setting name: list of values to compare, for any of
+            `complib`, `complevel`, `continuous_block`, and `fsync_every`.
+            if None, :data:`.DEFAULT_SETTINGS`
+        **kwargs: passed to :func:`.run`
+
+    Returns:
+        list: of (settings dict, results dict) tuples
+    """
+    if settings is None:
+        settings = DEFAULT_SETTINGS
+
+    names = list(settings.keys())
+    results = []
+    for values in itertools.product(*[settings[name] for name in names]):
+        run_settings = dict(zip(names, values))
+        run_kwargs = kwargs.copy()
+        run_kwargs.update(run_settings)
+        results.append((run_settings, run(task, **run_kwargs)))
+    return results
+
+
+def format_results(results):
+    """
+    Format the results of :func:`.benchmark` as a table for printing
+
+    Args:
+        results (list): results of :func:`.benchmark`
+
+    Returns:
+        str
+    """
+    if len(results) == 0:
+        return ''
+    names = list(results[0][0].keys())
+    header = ['{:>16}'.format(name) for name in names] + \
+             ['{:>10}'.format(col) for col in ('items/s', 'trials/s', 'max lag', 'max queue', 'bytes/trial')]
+    lines = [' '.join(header)]
+    for run_settings, result in results:
+        line = ['{:>16}'.format(str(run_settings[name])) for name in names]
+        line += ['{:>10.0f}'.format(result['items_per_s']),
+                 '{:>10.1f}'.format(result['trials_per_s']),
+                 '{:>10.4f}'.format(result['max_lag']),
+                 '{:>10}'.format(result['max_queue']),
+                 '{:>10.1f}'.format(result['bytes_per_trial'])]
+        lines.append(' '.join(line))
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark subject data storage")
+    parser.add_argument('-t', '--task', default='2AFC', help="Task whose data descriptors to use (default 2AFC)")
+    parser.add_argument('-n', '--n_trials', default=1000, type=int, help="Number of trials (default 1000)")
+    parser.add_argument('-p', '--n_partial', default=3, type=int, help="Partial updates per trial (default 3)")
+    parser.add_argument('-s', '--n_samples', default=0, type=int, help="Continuous samples per stream per trial (default 0)")
+    parser.add_argument('-r', '--rate', type=float, help="Trials per second to send at (default as fast as possible)")
+    parser.add_argument('-d', '--dir', help="Directory on the disk to benchmark (default the system temporary directory)")
+    args = parser.parse_args()
+
+    print(format_results(benchmark(args.task, n_trials=args.n_trials, n_partial=args.n_partial,
+                                   n_samples=args.n_samples, rate=args.rate, dir=args.dir)))
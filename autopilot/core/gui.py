@@ -36,7 +36,7 @@ import pdb
 
 # adding autopilot parent directory to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from autopilot.core.subject import Subject
+from autopilot.core.subject import Subject, set_weights
 from autopilot import tasks, prefs
 from autopilot.stim.sound import sounds
 from autopilot.core.networking import Net_Node
@@ -2508,6 +2508,7 @@ class Weights(QtWidgets.QTableWidget):
             subject_weights (list): a list of weights of the format returned by
                 :py:meth:`.Subject.get_weight(baseline=True)`.
             subjects (dict): the Terminal's :py:attr:`.Terminal.subjects` dictionary of :class:`.Subject` objects.
+                Weights of subjects that aren't open are set directly in their files with :func:`.subject.set_weights`
         """
         super(Weights, self).__init__()
 
@@ -2591,8 +2592,11 @@ class Weights(QtWidgets.QTableWidget):
             # get subject, date and column name
             subject_name = self.item(row, 0).text()
             date = self.subject_weights[row]['date']
-            column_name = self.colnames.keys()[column] # recall colnames is an ordered dictionary
-            self.subjects[subject_name].set_weight(date, column_name, new_val)
+            column_name = list(self.colnames.keys())[column] # recall colnames is an ordered dictionary
+            if subject_name in self.subjects.keys():
+                self.subjects[subject_name].set_weight(date, column_name, new_val)
+            else:
+                set_weights({subject_name: [{'date': date, column_name: new_val}]}, create=False, n_procs=1)
 
 
 #####################################################
@@ -2719,7 +2723,7 @@ class Psychometric(QtGui.QDialog):
             step_box.removeItem(0)
 
         # open the subject file and use 'current' to get step names
-        asub = Subject(subject)
+        asub = Subject(subject, mode='r')
 
         step_list = []
         for s in asub.current:
@@ -2742,7 +2746,7 @@ class Psychometric(QtGui.QDialog):
             var_box.removeItem(0)
 
         # open the subjet's file and get a description of the data for this
-        this_subject = Subject(subject)
+        this_subject = Subject(subject, mode='r')
         step_data = this_subject.get_trial_data(step=step_ind, what="variables")
         # should only have one step, so denest
         step_data = step_data[step_data.keys()[0]]
@@ -705,27 +705,29 @@ class Terminal_Station(Station):
 
     **Listens**
 
-    +-------------+-------------------------------------------+-----------------------------------------------+
-    | Key         | Method                                    | Description                                   |
-    +=============+===========================================+===============================================+
-    | 'PING'      | :meth:`~.Terminal_Station.l_ping`         | We are asked to confirm that we are alive     |
-    +-------------+-------------------------------------------+-----------------------------------------------+
-    | 'INIT'      | :meth:`~.Terminal_Station.l_init`         | Ask all pilots to confirm that they are alive |
-    +-------------+-------------------------------------------+-----------------------------------------------+
-    | 'CHANGE'    | :meth:`~.Terminal_Station.l_change`       | Change a parameter on the Pi                  |
-    +-------------+-------------------------------------------+-----------------------------------------------+
-    | 'STOPALL'   | :meth:`~.Terminal_Station.l_stopall`      | Stop all pilots and plots                     |
-    +-------------+-------------------------------------------+-----------------------------------------------+
-    | 'KILL'      | :meth:`~.Terminal_Station.l_kill`         | Terminal wants us to die :(                   |
-    +-------------+-------------------------------------------+-----------------------------------------------+
-    | 'DATA'      | :meth:`~.Terminal_Station.l_data`         | Stash incoming data from a Pilot              |
-    +-------------+-------------------------------------------+-----------------------------------------------+
-    | 'STATE'     | :meth:`~.Terminal_Station.l_state`        | A Pilot has changed state                     |
-    +-------------+-------------------------------------------+-----------------------------------------------+
-    | 'HANDSHAKE' | :meth:`~.Terminal_Station.l_handshake`    | A Pi is telling us it's alive and its IP      |
-    +-------------+-------------------------------------------+-----------------------------------------------+
-    | 'FILE'      | :meth:`~.Terminal_Station.l_file`         | The pi needs some file from us                |
-    +-------------+-------------------------------------------+-----------------------------------------------+
+    +---------------+-------------------------------------------+-----------------------------------------------+
+    | Key           | Method                                    | Description                                   |
+    +===============+===========================================+===============================================+
+    | 'PING'        | :meth:`~.Terminal_Station.l_ping`         | We are asked to confirm that we are alive     |
+    +---------------+-------------------------------------------+-----------------------------------------------+
+    | 'INIT'        | :meth:`~.Terminal_Station.l_init`         | Ask all pilots to confirm that they are alive |
+    +---------------+-------------------------------------------+-----------------------------------------------+
+    | 'CHANGE'      | :meth:`~.Terminal_Station.l_change`       | Change a parameter on the Pi                  |
+    +---------------+-------------------------------------------+-----------------------------------------------+
+    | 'STOPALL'     | :meth:`~.Terminal_Station.l_stopall`      | Stop all pilots and plots                     |
+    +---------------+-------------------------------------------+-----------------------------------------------+
+    | 'KILL'        | :meth:`~.Terminal_Station.l_kill`         | Terminal wants us to die :(                   |
+    +---------------+-------------------------------------------+-----------------------------------------------+
+    | 'DATA'        | :meth:`~.Terminal_Station.l_data`         | Stash incoming data from a Pilot              |
+    +---------------+-------------------------------------------+-----------------------------------------------+
+    | 'STATE'       | :meth:`~.Terminal_Station.l_state`        | A Pilot has changed state                     |
+    +---------------+-------------------------------------------+-----------------------------------------------+
+    | 'HANDSHAKE'   | :meth:`~.Terminal_Station.l_handshake`    | A Pi is telling us it's alive and its IP      |
+    +---------------+-------------------------------------------+-----------------------------------------------+
+    | 'FILE'        | :meth:`~.Terminal_Station.l_file`         | The pi needs some file from us                |
+    +---------------+-------------------------------------------+-----------------------------------------------+
+    | 'COHERE_DATA' | :meth:`~.Terminal_Station.l_cohere_data`  | A Pi is sending trials we were missing        |
+    +---------------+-------------------------------------------+-----------------------------------------------+
 
     """
 
@@ -761,6 +763,7 @@ class Terminal_Station(Station):
             'STATE':     self.l_state,  # The Pi is confirming/notifying us that it has changed state
             'HANDSHAKE': self.l_handshake, # initial connection with some initial info
             'FILE':      self.l_file,  # The pi needs some file from us
+            'COHERE_DATA': self.l_cohere_data, # The pi is sending trials we didn't get during the run
         })
 
         # dictionary that keeps track of our pilots
@@ -993,6 +996,17 @@ class Terminal_Station(Station):
 
         self.send(msg.sender, 'FILE', file_message)
 
+    def l_cohere_data(self, msg):
+        """
+        A Pilot is sending the trials that we didn't receive while it was running.
+
+        Forward to the internal terminal object ('_T'), see :meth:`.Terminal.l_cohere`
+
+        Args:
+            msg (:class:`.Message`):
+        """
+        self.send(to='_T', msg=msg)
+
 class Pilot_Station(Station):
     """
     :class:`~.networking.Station` object used by :class:`~.Pilot`
@@ -1084,16 +1098,15 @@ class Pilot_Station(Station):
 
     def l_cohere(self, msg):
         """
-        Send our local version of the data table so the terminal can double check
+        The Terminal is telling us which trials it has, so we can send back the ones it's missing.
 
-        Warning:
-            Not Implemented
+        Send along to the pilot, see :meth:`.Pilot.l_cohere`
 
         Args:
-            msg (:class:`.Message`):
+            msg (:class:`.Message`): value has the 'subject', 'session' and a list of
+                trial number 'ranges' the Terminal has.
         """
-
-        pass
+        self.send(self.pi_id, 'COHERE', msg.value)
 
     def l_ping(self, msg):
         """
@@ -1716,11 +1729,18 @@ class Net_Node(object):
 
         return msg
 
-    def get_stream(self, id, key, min_size=5, upstream=None, port = None, ip=None, subject=None):
+    def get_stream(self, id, key, min_size=5, upstream=None, port = None, ip=None, subject=None, ack=None):
         """
 
         Make a queue that another object can dump data into that sends on its own socket.
         Smarter handling of continuous data than just hitting 'send' a shitload of times.
+
+        Args:
+            ack (callable): if given, called with a number of items once the stream is done with them --
+                they have been serialized and sent, or dropped because the socket was busy. Items are
+                acknowledged in the order they were put in the queue, so the object putting them can
+                release memory they refer to (eg. :meth:`.Camera._stream_ack`)
+
         Returns:
             Queue: Place to dump ur data
 
@@ -1744,7 +1764,7 @@ class Net_Node(object):
         q = queue.Queue()
 
         stream_thread = threading.Thread(target=self._stream,
-                                         args=(id, key, min_size, upstream, port, ip, subject, q))
+                                         args=(id, key, min_size, upstream, port, ip, subject, q, ack))
         stream_thread.setDaemon(True)
         stream_thread.start()
         self.streams[id] = stream_thread
@@ -1765,7 +1785,7 @@ class Net_Node(object):
         return q
 
 
-    def _stream(self, id, msg_key, min_size, upstream, port, ip, subject, q):
+    def _stream(self, id, msg_key, min_size, upstream, port, ip, subject, q, ack=None):
 
 
 
@@ -1824,6 +1844,8 @@ class Net_Node(object):
                                                      track=True, copy=True)
 
                     self.logger.debug("STREAM {}: Sent {} items".format(self.id+'_'+id, len(pending_data)))
+                    if ack is not None:
+                        ack(len(pending_data))
                     pending_data = []
         else:
             # just send like normal messags
@@ -1845,6 +1867,8 @@ class Net_Node(object):
                                                      track=True, copy=True)
 
                 self.logger.debug("STREAM {}: Sent 1 item".format(self.id + '_' + id))
+                if ack is not None:
+                    ack(1)
 
 
 
@@ -53,6 +53,7 @@ if __name__ == '__main__':
             from autopilot.stim.sound import jackclient
 
 from autopilot.core.networking import Pilot_Station, Net_Node, Message
+from autopilot.core.utils import in_ranges, Row_Writer
 from autopilot import external
 from autopilot import tasks
 from autopilot.hardware import gpio
@@ -112,6 +113,8 @@ class Pilot:
         running (:class:`threading.Event`): Flag used to control task running state
         stage_block (:class:`threading.Event`): Flag given to a task to signal when task stages finish
         file_block (:class:`threading.Event`): Flag used to wait for file transfers
+        task_thread (:class:`threading.Thread`): Thread running :meth:`.Pilot.run_task`
+        local_table (str): path within `local.h5` of the table for the current or most recent run
         state (str): 'RUNNING', 'STOPPING', 'IDLE' - signals what this pilot is up to
         pulls (list): list of :class:`~.hardware.Pull` objects to keep pins pulled up or down
         server: Either a :func:`~.sound.pyoserver.pyo_server` or :class:`~.jackclient.JackClient` , sound server.
@@ -139,6 +142,10 @@ class Pilot:
     node = None
     networking = None
 
+    # local data
+    task_thread = None
+    local_table = None
+
     # audio server
     server = None
 
@@ -180,6 +187,7 @@ class Pilot:
         self.listens = {
             'START': self.l_start, # We are being passed a task and asked to start it
             'STOP' : self.l_stop, # We are being asked to stop running our task
+            'COHERE': self.l_cohere, # The terminal is telling us which trials it got
             'PARAM': self.l_param, # A parameter is being changed
             'CALIBRATE_PORT': self.l_cal_port, # Calibrate a water port
             'CALIBRATE_RESULT': self.l_cal_result, # Compute curve and store result
@@ -318,7 +326,8 @@ class Pilot:
 
             # Run the task and tell the terminal we have
             # self.running.set()
-            threading.Thread(target=self.run_task, args=(task_class, value)).start()
+            self.task_thread = threading.Thread(target=self.run_task, args=(task_class, value))
+            self.task_thread.start()
 
 
             self.update_state()
@@ -334,8 +343,8 @@ class Pilot:
 
         Clear the running event, set the stage block.
 
-        TODO:
-            Do a coherence check between our local file and the Terminal's data.
+        The Terminal follows up with a ``COHERE`` message to check that its data matches ours,
+        see :meth:`.Pilot.l_cohere`
 
         Args:
             value: ignored
@@ -359,6 +368,74 @@ class Pilot:
         self.state = 'IDLE'
         self.update_state()
 
+    def l_cohere(self, value):
+        """
+        Send the Terminal whichever trials from the last run it didn't receive.
+
+        Waiting for the task to finish can take a while, so this is done by
+        :meth:`.Pilot.cohere` in its own thread rather than in the networking thread.
+
+        Args:
+            value (dict): 'subject', 'session', and 'ranges' - list of inclusive [start, stop]
+                ranges of trial numbers that the Terminal has, see :func:`.utils.to_ranges`
+        """
+        cohere_thread = threading.Thread(target=self.cohere, args=(value,))
+        cohere_thread.setDaemon(True)
+        cohere_thread.start()
+
+    def cohere(self, value):
+        """
+        Waits for :meth:`.Pilot.run_task` to finish writing the local table, then
+        sends every completed trial from the session whose `trial_num` is not in the Terminal's ranges
+        in a single ``COHERE_DATA`` message, as one (blosc compressed) structured array.
+
+        Args:
+            value (dict): see :meth:`.Pilot.l_cohere`
+        """
+        if self.task_thread is not None:
+            self.task_thread.join(10)
+            if self.task_thread.is_alive():
+                self.logger.warning('Task is still stopping, waiting for it before cohering')
+                self.task_thread.join(30)
+            if self.task_thread.is_alive():
+                # the task still has the local table open, we can't read it
+                self.logger.error('Task did not stop, not cohering {} session {}'.format(
+                    value['subject'], value['session']))
+                return
+
+        if self.local_table is None:
+            self.logger.warning('Asked to cohere, but no local data table was written')
+            return
+
+        local_file = os.path.join(prefs.DATADIR, 'local.h5')
+        try:
+            with tables.open_file(local_file, mode='r') as h5f:
+                table = h5f.get_node(self.local_table)
+                trials = table.read()
+                # the step the trials were run on, which the subject may have graduated from since
+                step = int(table.attrs['step']) if 'step' in table.attrs else None
+        except Exception as e:
+            self.logger.exception('Could not read local data table {} to cohere: {}'.format(self.local_table, e))
+            return
+
+        # only completed trials have their session set, see run_task
+        trials = trials[trials['session'] == value['session']]
+        # drop anything the terminal already has, and keep the last copy of any repeated trial
+        missing = trials[~in_ranges(trials['trial_num'], value['ranges'])]
+        _, last_unique = np.unique(missing['trial_num'][::-1], return_index=True)
+        missing = missing[np.sort(len(missing) - 1 - last_unique)]
+
+        self.logger.info('Coherence check for {} session {}: sending {} missing trials'.format(
+            value['subject'], value['session'], len(missing)))
+
+        self.node.send(self.parentid, 'COHERE_DATA', {
+            'pilot': self.name,
+            'subject': value['subject'],
+            'session': value['session'],
+            'step': step,
+            'trials': missing
+        })
+
     def l_param(self, value):
         """
         Change a task parameter mid-run
@@ -625,6 +702,9 @@ class Pilot:
         Opens `prefs.DATADIR/local.h5`, creates a group for the current subject,
         a new table for the current day.
 
+        The table has a `session` column in addition to those in the task's `TrialData`,
+        and the session and step are stored as attributes of the table.
+
         Returns:
             (:class:`tables.File`, :class:`tables.Table`,
             :class:`tables.tableextension.Row`): The file, table, and row for the local data table
@@ -657,12 +737,15 @@ class Pilot:
 
         # Get data table descriptor
         if hasattr(self.task, 'TrialData'):
-            table_descriptor = self.task.TrialData
-
-
+            table_descriptor = dict(self.task.TrialData.columns)
+            table_descriptor.setdefault('session', tables.Int32Col())
+            table_descriptor.setdefault('trial_num', tables.Int32Col())
 
             table = h5f.create_table(subject_group, datestring, table_descriptor,
                                                "Subject {} on {}".format(self.subject, datestring))
+            table.attrs['session'] = self.session
+            table.attrs['step'] = self.step
+            self.local_table = table._v_pathname
 
             # The Row object is what we write data into as it comes in
             row = table.row
@@ -685,6 +768,8 @@ class Pilot:
         # TODO: give a net node to the Task class and let the task run itself.
         # Run as a separate thread, just keeps calling next() and shoveling data
         self.task = task_class(stage_block=self.stage_block, **task_params)
+        self.session = task_params.get('session', 0)
+        self.step = task_params.get('step', 0)
 
         # do we expect TrialData?
         trial_data = False
@@ -693,6 +778,9 @@ class Pilot:
 
         # Open local file for saving
         h5f, table, row = self.open_file()
+        # each trial is written as soon as it ends, so the local copy is complete for cohere
+        if table is not None:
+            row = Row_Writer(table, buffer_size=1)
 
         # TODO: Init sending continuous data here
 
@@ -708,16 +796,14 @@ class Pilot:
                 self.node.send('T', 'DATA', data)
 
                 # Store a local copy
-                # the task class has a class variable DATA that lets us know which data the row is expecting
-                if trial_data:
-                    for k, v in data.items():
-                        if k in self.task.TrialData.columns.keys():
-                            row[k] = v
+                # the row writer only stores keys that are in the task's TrialData
+                if trial_data and row is not None:
+                    row.update(data)
 
-                # If the trial is over (either completed or bailed), flush the row
-                if 'TRIAL_END' in data.keys():
-                    row.append()
-                    table.flush()
+                    # If the trial is over (either completed or bailed), write the row
+                    if 'TRIAL_END' in data.keys():
+                        row['session'] = self.session
+                        row.append()
 
             # Wait on the stage lock to clear
             self.stage_block.wait()
@@ -726,8 +812,9 @@ class Pilot:
             if not self.running.is_set():
                 self.task.end()
                 self.task = None
-                row.append()
-                table.flush()
+                # an unfinished trial is left out of the local table
+                if row is not None:
+                    row.flush()
                 break
 
         h5f.flush()
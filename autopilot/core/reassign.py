@@ -0,0 +1,240 @@
+"""
+Assign protocols and steps to many :class:`~.subject.Subject` s at once.
+
+Each protocol file is loaded once, and subjects are updated in parallel
+worker processes that each open a subject, compare its protocol and step to the
+requested ones, and only change what is different with a single call to
+:meth:`.Subject.assign_protocol` or :meth:`.Subject.update_history`.
+
+With ``dry_run=True`` subjects are opened read-only and the changes that would be made
+are returned without making them.
+
+Called as a module to update every subject whose protocol file has changed::
+
+    python -m autopilot.core.reassign -d /usr/autopilot/data -p /usr/autopilot/protocols --dry-run
+
+"""
+
+import os
+import json
+import argparse
+import multiprocessing as mp
+
+
+def load_protocols(protocol_dir, names=None):
+    """
+    Load protocol files
+
+    Args:
+        protocol_dir (str): directory of protocol .json files, usually ``prefs.PROTOCOLDIR``
+        names (list): names of protocols to load (their filenames without .json).
+            if None (default), all protocols in the directory.
+
+    Returns:
+        dict: protocol name: list of step dictionaries
+    """
+    if names is None:
+        names = [os.path.splitext(p)[0] for p in os.listdir(protocol_dir) if p.endswith('.json')]
+
+    protocols = {}
+    for name in set(names):
+        with open(os.path.join(protocol_dir, name + '.json')) as protocol_file:
+            protocols[name] = json.load(protocol_file)
+    return protocols
+
+
+def protocol_changes(protocol_name, step, current, new_name, new_step, new_protocol):
+    """
+    Compare a subject's protocol and step to the ones it should have.
+
+    Args:
+        protocol_name (str): the subject's current protocol name
+        step (int): the subject's current step
+        current (list): the subject's current protocol, as :attr:`.Subject.current`
+        new_name (str): the protocol the subject should have
+        new_step (int): the step the subject should be on
+        new_protocol (list): the steps of the protocol the subject should have
+
+    Returns:
+        dict: empty if nothing would change, otherwise with any of the keys
+
+            * ``'protocol'`` - (old name, new name) if the protocol is being changed
+            * ``'params'`` - {step number: [changed parameter names]} if the protocol is the same but its file has been edited
+            * ``'step'`` - (old step, new step) if the step is being changed
+    """
+    changes = {}
+    if protocol_name != new_name:
+        changes['protocol'] = (protocol_name, new_name)
+    elif current != new_protocol:
+        params = {}
+        for i, new_params in enumerate(new_protocol):
+            old_params = current[i] if current is not None and i < len(current) else {}
+            changed = sorted(k for k in set(old_params) | set(new_params) if old_params.get(k) != new_params.get(k))
+            if changed:
+                params[i] = changed
+        changes['params'] = params
+
+    if step != new_step:
+        changes['step'] = (step, new_step)
+    return changes
+
+
+def _reassign_worker(args):
+    """
+    Open one subject and apply the changes from :func:`.protocol_changes` to it
+
+    Args:
+        args (tuple): (subject ID, data directory, protocol name, step, loaded protocols, dry run)
+            protocol name and step can be None to keep the subject's current one.
+
+    Returns:
+        tuple: (subject ID, changes or the exception raised)
+    """
+    # import here so workers don't need a display or the rest of the terminal
+    from autopilot.core.subject import Subject
+
+    name, data_dir, new_name, new_step, protocols, dry_run = args
+    try:
+        # don't make new subjects by accident
+        if not os.path.isfile(os.path.join(data_dir, name + '.h5')):
+            raise FileNotFoundError('No subject file for {} in {}'.format(name, data_dir))
+        subject = Subject(name, dir=data_dir, mode='r' if dry_run else 'r+')
+
+        if new_name is None:
+            new_name = subject.protocol_name
+        if new_step is None:
+            new_step = subject.step
+        new_protocol = protocols.get(new_name)
+        if new_protocol is None:
+            raise KeyError('Protocol {} was not found'.format(new_name))
+        new_step = int(new_step)
+        if new_step >= len(new_protocol):
+            raise ValueError('Step {} is past the end of protocol {}, which has {} steps'.format(
+                new_step, new_name, len(new_protocol)))
+
+        changes = protocol_changes(subject.protocol_name, subject.step, subject.current,
+                                   new_name, new_step, new_protocol)
+
+        if not dry_run and changes:
+            if 'protocol' in changes:
+                # assign_protocol sets the step too
+                subject.assign_protocol(new_name, new_step, protocol_dict=new_protocol)
+            else:
+                if 'params' in changes:
+                    # reassign the edited protocol on the current step so the session isn't reset,
+                    # then change the step like a graduation would
+                    subject.assign_protocol(new_name, subject.step, protocol_dict=new_protocol)
+                if 'step' in changes:
+                    step_name = subject.current[new_step]['step_name']
+                    subject.update_history('step', step_name, new_step)
+
+        return name, changes
+
+    except Exception as e:
+        return name, e
+
+
+def reassign(assignments, data_dir=None, protocol_dir=None, dry_run=False, n_procs=None):
+    """
+    Assign protocols and steps to many subjects in parallel
+
+    Subjects must not be running, and any other :class:`.Subject` objects
+    open for them should be reloaded afterwards.
+
+    Args:
+        assignments (dict): subject ID: (protocol name, step). Either can be None to keep the
+            subject's current protocol or step, eg. ``(None, None)`` to reload a subject's protocol
+            from its file if it has been edited.
+        data_dir (str): directory of subject files, if None, ``prefs.DATADIR``
+        protocol_dir (str): directory of protocol files, if None, ``prefs.PROTOCOLDIR``
+        dry_run (bool): if True, open subjects read-only and only return what would change.
+        n_procs (int): number of worker processes, if None, the number of cpus. Workers are
+            started with the ``spawn`` method, so it is safe to call from the Terminal, but for a
+            handful of subjects ``n_procs=1`` (update them in this process) is faster.
+
+    Returns:
+        dict: subject ID: changes (see :func:`.protocol_changes`), or the exception raised
+        if the subject couldn't be updated.
+    """
+    if data_dir is None or protocol_dir is None:
+        from autopilot import prefs
+        if data_dir is None:
+            data_dir = prefs.DATADIR
+        if protocol_dir is None:
+            protocol_dir = prefs.PROTOCOLDIR
+
+    # every subject whose protocol isn't given might need any of them
+    if any(protocol is None for protocol, _ in assignments.values()):
+        protocols = load_protocols(protocol_dir)
+    else:
+        protocols = load_protocols(protocol_dir, [protocol for protocol, _ in assignments.values()])
+
+    jobs = [(name, data_dir, protocol, step, protocols, dry_run)
+            for name, (protocol, step) in assignments.items()]
+
+    if n_procs is None:
+        n_procs = mp.cpu_count()
+    n_procs = max(min(n_procs, len(jobs)), 1)
+
+    results = {}
+    if n_procs == 1:
+        for job in jobs:
+            name, result = _reassign_worker(job)
+            results[name] = result
+    else:
+        # don't fork a process that might have a GUI and threads running
+        with mp.get_context('spawn').Pool(n_procs) as pool:
+            for name, result in pool.imap_unordered(_reassign_worker, jobs):
+                results[name] = result
+    return results
+
+
+def format_results(results):
+    """
+    Format the results of :func:`.reassign` for printing
+
+    Args:
+        results (dict): results of :func:`.reassign`
+
+    Returns:
+        str
+    """
+    lines = []
+    for name in sorted(results.keys()):
+        changes = results[name]
+        if isinstance(changes, Exception):
+            lines.append('{}: skipped: {}'.format(name, changes))
+        elif not changes:
+            lines.append('{}: no changes'.format(name))
+        else:
+            descriptions = []
+            if 'protocol' in changes:
+                descriptions.append('protocol {} -> {}'.format(*changes['protocol']))
+            if 'params' in changes:
+                descriptions.append('params changed in steps {}'.format(
+                    ', '.join('{} ({})'.format(step, ', '.join(params)) for step, params in sorted(changes['params'].items()))))
+            if 'step' in changes:
+                descriptions.append('step {} -> {}'.format(*changes['step']))
+            lines.append('{}: {}'.format(name, '; '.join(descriptions)))
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update subjects' protocols from their protocol files")
+    parser.add_argument('-d', '--dir', required=True, help="Data directory")
+    parser.add_argument('-p', '--protocols', required=True, help="Protocol directory")
+    parser.add_argument('-s', '--subjects', nargs='*', help="Subjects to update (default all subjects in the data directory)")
+    parser.add_argument('--protocol', help="Assign this protocol instead of reloading each subject's current protocol")
+    parser.add_argument('--step', type=int, help="Assign this step instead of keeping each subject's current step")
+    parser.add_argument('-n', '--n_procs', type=int, help="Number of worker processes")
+    parser.add_argument('--dry-run', action='store_true', help="Only print what would change")
+    args = parser.parse_args()
+
+    subjects = args.subjects
+    if not subjects:
+        subjects = sorted(os.path.splitext(fn)[0] for fn in os.listdir(args.dir) if fn.endswith('.h5'))
+
+    results = reassign({subject: (args.protocol, args.step) for subject in subjects},
+                       data_dir=args.dir, protocol_dir=args.protocols,
+                       dry_run=args.dry_run, n_procs=args.n_procs)
+    print(format_results(results))
@@ -0,0 +1,411 @@
+"""
+Maintenance tools to compact and repack :class:`~.subject.Subject` files.
+
+Subject files grow by appending one row at a time, so over months of training
+their tables end up fragmented into many small chunks, and continuous data is
+split into a separate tiny table for every session. Repacking:
+
+* copies the file with chunk sizes computed from the final size of each table and a chosen compression,
+* merges each step's per-session continuous data tables into a single table per data stream with a `session` column,
+* builds completely sorted indexes on `trial_num` and `session` for trial data, and
+* reports the size of the file and the time it takes to read all its data before and after.
+
+The repacked file is written next to the original and checked before it replaces it,
+and files that are currently in use are skipped, so this can be run over a whole data directory.
+An exclusive :class:`~.subject.File_Lock` is held on each file from when it is copied until it is replaced,
+so subjects can't write to it in the meantime, and the file is left as it is if it changed anyway.
+The session files of :attr:`~.subject.Subject.sharded` subjects are repacked along with the subject's file.
+
+Called as a module::
+
+    python -m autopilot.core.repack -d /usr/autopilot/data
+
+"""
+
+import os
+import time
+import argparse
+import warnings
+
+import numpy as np
+import tables
+
+from autopilot.core.subject import shard_files, File_Lock
+
+
+def read_time(h5f):
+    """
+    Time how long it takes to read every table and array under ``/data``
+
+    Args:
+        h5f (:class:`tables.File`): an open subject file
+
+    Returns:
+        float: seconds
+    """
+    start = time.perf_counter()
+    for leaf in h5f.walk_nodes('/data', classname='Leaf'):
+        _ = leaf.read()
+    return time.perf_counter() - start
+
+
+def count_rows(h5f):
+    """
+    Count the rows of trial and continuous data in a subject file.
+
+    Args:
+        h5f (:class:`tables.File`): an open subject file
+
+    Returns:
+        tuple: (n trial rows, n continuous rows)
+    """
+    n_trial = 0
+    n_continuous = 0
+    for leaf in h5f.walk_nodes('/data', classname='Leaf'):
+        if leaf.name == 'trial_data':
+            n_trial += leaf.nrows
+        else:
+            n_continuous += leaf.nrows
+    return n_trial, n_continuous
+
+
+def file_state(file):
+    """
+    Get the modification time, size, and row counts of a file, to check that it hasn't changed.
+
+    Args:
+        file (str): path to a subject's .h5 file
+
+    Returns:
+        tuple: (mtime (ns), size (bytes), :func:`.count_rows`)
+    """
+    stat = os.stat(file)
+    with tables.open_file(file, mode='r') as h5f:
+        rows = count_rows(h5f)
+    return stat.st_mtime_ns, stat.st_size, rows
+
+
+def merge_continuous(h5f, filters=None):
+    """
+    Merge the ``continuous_data/session_N/<key>`` tables of every step into
+    a single ``continuous_data/<key>`` table with a `session` column, and remove the merged session groups.
+
+    Tables whose columns don't match the merged table's (eg. if the shape of the data changed
+    between sessions) are left in place.
+
+    Args:
+        h5f (:class:`tables.File`): a subject file opened for writing
+        filters (:class:`tables.Filters`): filters for the merged tables
+
+    Returns:
+        int: number of session tables merged
+    """
+    n_merged = 0
+    # get paths first, since we'll be modifying the tree as we go
+    cont_paths = [g._v_pathname for g in h5f.walk_groups('/data') if g._v_name == 'continuous_data']
+    for cont_path in cont_paths:
+        cont_group = h5f.get_node(cont_path)
+        session_names = [name for name in cont_group._v_groups.keys() if name.startswith('session_')]
+        session_names = sorted(session_names, key=lambda name: int(name.split('_')[-1]))
+
+        for session_name in session_names:
+            session = int(session_name.split('_')[-1])
+            session_group = cont_group._f_get_child(session_name)
+
+            for key in sorted(session_group._v_leaves.keys()):
+                table = session_group._f_get_child(key)
+                if not isinstance(table, tables.Table):
+                    continue
+                if key not in cont_group:
+                    description = table.description._v_colobjects.copy()
+                    description['session'] = tables.Int32Col()
+                    merged = h5f.create_table(cont_group, key, description=description,
+                                              filters=filters, expectedrows=table.nrows)
+                else:
+                    merged = cont_group._f_get_child(key)
+
+                rows = table.read()
+                if any(name not in merged.colnames for name in rows.dtype.names):
+                    warnings.warn('Columns of {} do not match merged table, not merging'.format(table._v_pathname))
+                    continue
+
+                merged_rows = np.zeros(len(rows), dtype=merged.dtype)
+                for name in rows.dtype.names:
+                    merged_rows[name] = rows[name]
+                merged_rows['session'] = session
+                merged.append(merged_rows)
+                merged.flush()
+
+                table._f_remove()
+                n_merged += 1
+
+            if len(session_group._v_children) == 0:
+                session_group._f_remove()
+
+    return n_merged
+
+
+def index_tables(h5f):
+    """
+    Make completely sorted indexes for the `trial_num` and `session` columns of every
+    trial data table, and the `session` column of merged continuous data tables.
+
+    Args:
+        h5f (:class:`tables.File`): a subject file opened for writing
+    """
+    for table in h5f.walk_nodes('/data', classname='Table'):
+        for col in ('trial_num', 'session'):
+            if col not in table.colnames:
+                continue
+            column = table.cols._f_col(col)
+            if column.is_indexed:
+                column.reindex()
+            else:
+                column.create_csindex()
+
+
+def in_use(file):
+    """
+    Check whether a subject file looks like it is being used:
+    if its journal has records that haven't been stored, or it can't be opened for writing.
+
+    Subjects that have the file open are detected by the :class:`~.subject.File_Lock` that
+    :func:`.repack` holds rather than by this.
+
+    Args:
+        file (str): path to a subject's .h5 file
+
+    Returns:
+        bool
+    """
+    journal = os.path.splitext(file)[0] + '.journal'
+    if os.path.exists(journal) and os.path.getsize(journal) > 0:
+        return True
+
+    try:
+        h5f = tables.open_file(file, mode='r+')
+        h5f.close()
+    except (IOError, OSError, ValueError):
+        return True
+    return False
+
+
+def repack(file, complib='blosc', complevel=6, merge=True, index=True, replace=True):
+    """
+    Repack a single subject file, and the session files listed in its manifest if it has any.
+
+    Session files that are missing, in use, or fail to repack are skipped and left as they are.
+
+    Args:
+        file (str): path to a subject's .h5 file
+        complib (str): compression library, see :class:`tables.Filters`
+        complevel (int): compression level 0-9
+        merge (bool): merge per-session continuous data tables, see :func:`.merge_continuous`
+        index (bool): index trial numbers and sessions, see :func:`.index_tables`
+        replace (bool): if True (default), replace the original file with the repacked file.
+            if False, the repacked file is left next to it with the extension ``.repacked.h5``
+
+    Returns:
+        dict: with the size (bytes) and read time (s) of the file and its session files ``'before'`` and ``'after'``,
+        ``'merged'`` - the number of continuous tables merged, the ``'file'`` that was written,
+        and ``'shards'`` - the results of :func:`._repack_file` for each session file, or the exception
+        raised for those that were skipped.
+
+    Raises:
+        RuntimeError: if the file is in use or changed while it was being repacked,
+            or the repacked file doesn't have the same number of rows as the original.
+    """
+    filters = tables.Filters(complib=complib, complevel=complevel)
+
+    result = _repack_file(file, filters, merge, index, replace)
+    result['shards'] = {}
+
+    # once the subject's file has been locked, so it isn't open for writing here
+    with tables.open_file(file, mode='r') as h5f:
+        shards = [shard for _, shard in shard_files(h5f)]
+
+    for shard in shards:
+        if not os.path.exists(shard):
+            warnings.warn('Session file {} is missing, it may have been archived'.format(shard))
+            continue
+        try:
+            shard_result = _repack_file(shard, filters, merge, index, replace)
+        except Exception as e:
+            result['shards'][shard] = e
+            continue
+
+        result['shards'][shard] = shard_result
+        for when in ('before', 'after'):
+            for key in ('size', 'read_time'):
+                result[when][key] += shard_result[when][key]
+        result['merged'] += shard_result['merged']
+
+    return result
+
+
+def _repack_file(file, filters, merge=True, index=True, replace=True):
+    """
+    Repack one .h5 file, either a subject's file or one of its session files. See :func:`.repack`
+
+    The file is locked with an exclusive :class:`~.subject.File_Lock` until it has been replaced,
+    and just before it is replaced its :func:`.file_state` is checked against the one it was copied with.
+
+    Args:
+        file (str): path to the .h5 file
+        filters (:class:`tables.Filters`): filters for the repacked file
+        merge (bool): merge per-session continuous data tables, see :func:`.merge_continuous`
+        index (bool): index trial numbers and sessions, see :func:`.index_tables`
+        replace (bool): replace the original file with the repacked file
+
+    Returns:
+        dict: with the size (bytes) and read time (s) of the file ``'before'`` and ``'after'``,
+        ``'merged'`` - the number of continuous tables merged, and the ``'file'`` that was written.
+
+    Raises:
+        RuntimeError: if the file is in use or changed while it was being repacked,
+            or the repacked file doesn't have the same number of rows as the original.
+    """
+    file_lock = File_Lock(file, exclusive=True, blocking=False)
+    try:
+        file_lock.acquire()
+    except BlockingIOError:
+        raise RuntimeError('{} is in use, not repacking'.format(file))
+
+    try:
+        return _repack_locked(file, filters, merge, index, replace)
+    finally:
+        file_lock.release()
+
+
+def _repack_locked(file, filters, merge, index, replace):
+    """
+    Repack one .h5 file while :func:`._repack_file` holds its lock
+
+    Args:
+        file (str): path to the .h5 file
+        filters (:class:`tables.Filters`): filters for the repacked file
+        merge (bool): merge per-session continuous data tables
+        index (bool): index trial numbers and sessions
+        replace (bool): replace the original file with the repacked file
+
+    Returns:
+        dict: see :func:`._repack_file`
+    """
+    if in_use(file):
+        raise RuntimeError('{} is in use, not repacking'.format(file))
+
+    out_file = os.path.splitext(file)[0] + '.repacked.h5'
+    state = file_state(file)
+
+    with tables.open_file(file, mode='r') as h5f:
+        before = {'size': os.path.getsize(file), 'read_time': read_time(h5f)}
+        rows_before = count_rows(h5f)
+        h5f.copy_file(out_file, overwrite=True, filters=filters, chunkshape='auto')
+
+    try:
+        with tables.open_file(out_file, mode='r+') as h5f:
+            n_merged = merge_continuous(h5f, filters) if merge else 0
+            if index:
+                index_tables(h5f)
+
+            rows_after = count_rows(h5f)
+            if rows_after != rows_before:
+                raise RuntimeError('Repacked file has {} rows, but the original has {}'.format(rows_after, rows_before))
+
+        with tables.open_file(out_file, mode='r') as h5f:
+            after = {'size': os.path.getsize(out_file), 'read_time': read_time(h5f)}
+
+        if replace and file_state(file) != state:
+            raise RuntimeError('{} changed while it was being repacked, not replacing it'.format(file))
+
+    except Exception:
+        os.remove(out_file)
+        raise
+
+    if replace:
+        os.replace(out_file, file)
+        out_file = file
+
+    return {'before': before, 'after': after, 'merged': n_merged, 'file': out_file}
+
+
+def repack_dir(data_dir, **kwargs):
+    """
+    Repack every subject file in a directory with :func:`.repack`
+
+    Files that are in use or fail to repack are skipped and left as they are.
+
+    Args:
+        data_dir (str): directory of subject files, usually ``prefs.DATADIR``
+        **kwargs: passed to :func:`.repack`
+
+    Returns:
+        dict: results of :func:`.repack` for each file, or the exception raised for files that were skipped.
+    """
+    results = {}
+    for fn in sorted(os.listdir(data_dir)):
+        if not fn.endswith('.h5') or fn.endswith('.repacked.h5'):
+            continue
+        file = os.path.join(data_dir, fn)
+        try:
+            results[file] = repack(file, **kwargs)
+        except Exception as e:
+            results[file] = e
+    return results
+
+
+def format_results(results):
+    """
+    Format the results of :func:`.repack_dir` as a table for printing
+
+    Args:
+        results (dict): results of :func:`.repack_dir`
+
+    Returns:
+        str
+    """
+    lines = ['{:<30} {:>12} {:>12} {:>11} {:>11} {:>7}'.format(
+        'file', 'size before', 'size after', 'read before', 'read after', 'merged')]
+    for file, result in results.items():
+        name = os.path.basename(file)
+        if isinstance(result, Exception):
+            lines.append('{:<30} skipped: {}'.format(name, result))
+            continue
+        lines.append('{:<30} {:>12} {:>12} {:>11.3f} {:>11.3f} {:>7}'.format(
+            name,
+            result['before']['size'], result['after']['size'],
+            result['before']['read_time'], result['after']['read_time'],
+            result['merged']))
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Repack subject files")
+    parser.add_argument('-d', '--dir', help="Data directory, repack all subject files in it")
+    parser.add_argument('-f', '--file', help="Repack a single subject file")
+    parser.add_argument('-c', '--complib', default='blosc', help="Compression library (default blosc)")
+    parser.add_argument('-l', '--complevel', default=6, type=int, help="Compression level 0-9 (default 6)")
+    parser.add_argument('--no-merge', action='store_true', help="Don't merge per-session continuous data tables")
+    parser.add_argument('--no-index', action='store_true', help="Don't index trial numbers and sessions")
+    parser.add_argument('--keep', action='store_true', help="Keep the original file, write the repacked file next to it")
+    args = parser.parse_args()
+
+    repack_kwargs = {
+        'complib': args.complib,
+        'complevel': args.complevel,
+        'merge': not args.no_merge,
+        'index': not args.no_index,
+        'replace': not args.keep
+    }
+
+    if args.file:
+        try:
+            results = {args.file: repack(args.file, **repack_kwargs)}
+        except Exception as e:
+            results = {args.file: e}
+    elif args.dir:
+        results = repack_dir(args.dir, **repack_kwargs)
+    else:
+        raise Exception('Need either a directory (-d) or a file (-f) to repack')
+
+    print(format_results(results))
@@ -10,7 +10,13 @@ models should the need arise.
 # TODO: store pilot in biography
 import os
 import sys
+import shutil
 import threading
+import multiprocessing as mp
+import itertools
+import time
+import struct
+import pickle
 import tables
 from tables.nodes import filenode
 import datetime
@@ -18,10 +24,12 @@ import json
 import pandas as pd
 import warnings
 import typing
+import contextlib
 from copy import copy
 # sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from autopilot.tasks import GRAD_LIST, TASK_LIST
 from autopilot import prefs
+from autopilot.core.utils import to_ranges, Row_Writer
 from autopilot.stim.sound.sounds import STRING_PARAMS
 
 if sys.version_info >= (3,0):
@@ -29,6 +37,13 @@ if sys.version_info >= (3,0):
 else:
     import Queue as queue
 
+try:
+    import fcntl
+    FCNTL = True
+except ImportError:
+    # eg. on windows, where files aren't locked
+    FCNTL = False
+
 import pdb
 import numpy as np
 
@@ -46,19 +61,24 @@ class Subject(object):
         |         |--- S##_step_name
         |         |    |--- trial_data
         |         |    |--- continuous_data
+        |         |         |--- session_#/data_name - chunked arrays and a time index, see :meth:`~.Subject.get_continuous`
         |         |--- ...
         |--- history (group)
         |    |--- hashes - history of git commit hashes
         |    |--- history - history of changes: protocols assigned, params changed, etc.
         |    |--- weights - history of pre and post-task weights
+        |    |--- sessions - manifest of session files, if the subject is :attr:`~.Subject.sharded`
         |    |--- past_protocols (group) - stash past protocol params on reassign
         |         |--- date_protocol_name - tables.filenode of a previous protocol's params.
         |         |--- ...
         |--- info - group with biographical information as attributes
+        |--- summary - group with running summary statistics as attributes, see :meth:`~.Subject.get_summary`
 
     Attributes:
         lock (:class:`threading.Lock`): manages access to the hdf5 file
         name (str): Subject ID
+        mode (str): file access mode used by default in :meth:`~.Subject.open_hdf`. If 'r',
+            the subject is read-only and the file is never modified.
         file (str): Path to hdf5 file - usually `{prefs.DATADIR}/{self.name}.h5`
         current (dict): current task parameters. loaded from
             the 'current' :mod:`~tables.filenode` of the h5 file
@@ -68,7 +88,13 @@ class Subject(object):
         running (bool): Flag that signals whether the subject is currently running a task or not.
         data_queue (:class:`queue.Queue`): Queue to dump data while running task
         thread (:class:`threading.Thread`): thread used to keep file open while running task
+        journal (:class:`.Journal`): write-ahead journal that data is written to before it is queued, see :meth:`~.Subject.save_data`
+        journal_stats (dict): throughput and lag of the :meth:`~.Subject.data_thread`, see :meth:`~.Subject.get_journal_stats`
         did_graduate (:class:`threading.Event`): Event used to signal if the subject has graduated the current step
+        continuous_block (int): number of samples of continuous data in each chunk and in each
+            entry of its sparse time index, see :meth:`~.Subject.get_continuous`
+        trial_batch (int): maximum number of trials buffered before they are written, see :meth:`~.Subject.data_thread`
+        sharded (bool): if True, each session's data is written to its own file, see :meth:`~.Subject.new_shard`
         STRUCTURE (list): list of tuples with order:
 
             * full path, eg. '/history/weights'
@@ -83,7 +109,7 @@ class Subject(object):
 
 
     def __init__(self, name: str=None, dir: str=None, file: str=None,
-                 new: bool=False, biography: dict=None):
+                 new: bool=False, biography: dict=None, mode: str='r+', sharded: bool=None):
         """
         Args:
             name (str): subject ID
@@ -91,7 +117,18 @@ class Subject(object):
             file (str): load a subject from a filename. if `None`, ignored.
             new (bool): if True, a new file is made (a new file is made if one does not exist anyway)
             biography (dict): If making a new subject file, a dictionary with biographical data can be passed
+            mode (str): 'r+' (default) to open the subject for reading and writing, or 'r' for
+                a read-only subject that skips :meth:`~.Subject.ensure_structure` and the hash history.
+                Read-only subjects never write to the file, so many processes can open the same
+                subject at once (eg. for analysis while it is running).
+            sharded (bool): if True, store each new session in its own file, see :meth:`~.Subject.new_shard`.
+                if None (default), use the setting stored in the subject's file.
+                Data from sessions before sharding was turned on stay in the main file.
         """
+        if mode not in ('r', 'r+'):
+            raise ValueError("mode must be either 'r' or 'r+', got {}".format(mode))
+        self.mode = mode
+
         self.STRUCTURE = [
             ('/data', '/', 'data', 'group'),
             ('/history', '/', 'history' 'group'),
@@ -99,11 +136,17 @@ class Subject(object):
             ('/history/history', '/history', 'history', self.History_Table),
             ('/history/weights', '/history', 'weights', self.Weight_Table),
             ('/history/past_protocols', '/history', 'past_protocols', 'group'),
-            ('/info', '/', 'info', 'group')
+            ('/history/sessions', '/history', 'sessions', self.Session_Table),
+            ('/info', '/', 'info', 'group'),
+            ('/summary', '/', 'summary', 'group')
         ]
 
         # use a filter to compress continuous data
         self.continuous_filter = tables.Filters(complib='blosc', complevel=6)
+        # number of continuous samples in each chunk and each entry of the time index
+        self.continuous_block = 1024
+        # maximum number of trials to store at once when data is coming in quickly
+        self.trial_batch = 64
 
         self.lock = threading.Lock()
 
@@ -125,14 +168,24 @@ class Subject(object):
 
             self.name = str(name)
             self.file = os.path.join(dir, name + '.h5')
-            if new or not os.path.isfile(self.file):
+            if self.mode == 'r':
+                if new or not os.path.isfile(self.file):
+                    raise FileNotFoundError('Cannot make a new subject file in read-only mode: {}'.format(self.file))
+            elif new or not os.path.isfile(self.file):
                 self.new_subject_file(biography)
 
         # before we open, make sure we have the stuff we need
-        self.ensure_structure()
+        if self.mode != 'r':
+            self.ensure_structure()
 
         h5f = self.open_hdf()
 
+        # files made before the summary node existed need to have it computed once
+        if self.mode != 'r' and 'n_trials' not in h5f.root.summary._v_attrs:
+            _ = self.close_hdf(h5f)
+            self.rebuild_summary()
+            h5f = self.open_hdf()
+
         if not name:
             try:
                 self.name = h5f.root.info._v_attrs['name']
@@ -161,6 +214,14 @@ class Subject(object):
         except KeyError:
             self.session = None
 
+        # should sessions be stored in their own files?
+        if sharded is not None and self.mode != 'r':
+            h5f.root.info._v_attrs['sharded'] = bool(sharded)
+        try:
+            self.sharded = bool(h5f.root.info._v_attrs['sharded'])
+        except KeyError:
+            self.sharded = False
+
         # We will get handles to trial and continuous data when we start running
         self.current_trial  = None
 
@@ -172,20 +233,27 @@ class Subject(object):
         self.data_queue = None
         self.thread = None
         self.did_graduate = threading.Event()
+        self.graduation = None
+
+        # data is journaled before it is queued, so a slow disk or crash doesn't lose it
+        self.journal = None
+        self.journal_stats = {}
 
         # Every time we are initialized we stash the git hash
-        history_row = h5f.root.history.hashes.row
-        history_row['time'] = self.get_timestamp()
-        try:
-            history_row['hash'] = prefs.HASH
-        except AttributeError:
-            history_row['hash'] = ''
-        history_row.append()
+        # (unless we're just reading)
+        if self.mode != 'r':
+            history_row = h5f.root.history.hashes.row
+            history_row['time'] = self.get_timestamp()
+            try:
+                history_row['hash'] = prefs.HASH
+            except AttributeError:
+                history_row['hash'] = ''
+            history_row.append()
 
         # we have to always open and close the h5f
         _ = self.close_hdf(h5f)
 
-    def open_hdf(self, mode='r+'):
+    def open_hdf(self, mode=None):
         """
         Opens the hdf5 file.
 
@@ -203,14 +271,59 @@ class Subject(object):
                 * 'r': Read-only - no data can be modified.
                 * 'w': Write - a new file is created (an existing file with the same name would be deleted).
                 * 'a' Append - an existing file is opened for reading and writing, and if the file does not exist it is created.
-                * 'r+' (default) - Similar to 'a', but file must already exist.
+                * 'r+' - Similar to 'a', but file must already exist.
+                * None (default) - use :attr:`~.Subject.mode`, 'r+' unless the subject is read-only.
 
         Returns:
             :class:`tables.File`: Opened hdf file.
+
+        Raises:
+            PermissionError: if the subject is read-only and a writing mode is requested.
         """
+        if mode is None:
+            mode = self.mode
+        elif self.mode == 'r' and mode != 'r':
+            raise PermissionError('Subject {} is read-only, cannot open with mode {}'.format(self.file, mode))
+
         # TODO: Use a decorator around methods instead of explicitly calling
-        with self.lock:
-            return tables.open_file(self.file, mode=mode)
+        return self._open_file(self.file, mode)
+
+    def _open_file(self, file, mode):
+        """
+        Open a subject or session file, holding a shared :class:`.File_Lock` on it until it's
+        closed by :meth:`~.Subject.close_hdf`
+
+        Args:
+            file (str): path to the file
+            mode (str): file access mode
+
+        Returns:
+            :class:`tables.File`
+        """
+        file_lock = File_Lock(file)
+        file_lock.acquire()
+        try:
+            with self.lock:
+                h5f = tables.open_file(file, mode=mode)
+        except Exception:
+            file_lock.release()
+            raise
+        h5f._file_lock = file_lock
+        return h5f
+
+    def _check_writable(self, action='be changed'):
+        """
+        Check that the subject can be written to before trying, so a read-only subject fails
+        before it has opened its file or changed anything.
+
+        Args:
+            action (str): what was being attempted, for the error message
+
+        Raises:
+            PermissionError: if the subject is read-only
+        """
+        if self.mode == 'r':
+            raise PermissionError('Subject {} is read-only and cannot {}'.format(self.name, action))
 
     def close_hdf(self, h5f):
         # type: (tables.file.File) -> None
@@ -221,9 +334,15 @@ class Subject(object):
         Args:
             h5f (:class:`tables.File`): the hdf file opened by :meth:`~.Subject.open_hdf`
         """
-        with self.lock:
-            h5f.flush()
-            return h5f.close()
+        try:
+            with self.lock:
+                if h5f.mode != 'r':
+                    h5f.flush()
+                return h5f.close()
+        finally:
+            file_lock = getattr(h5f, '_file_lock', None)
+            if file_lock is not None:
+                file_lock.release()
 
     def new_subject_file(self, biography):
         """
@@ -265,6 +384,10 @@ class Subject(object):
             # And another table to stash the git hash every time we're open.
             h5f.create_table(history_group, 'hashes', self.Hash_Table, "Git commit hash history")
 
+            # Summary statistics are kept as attributes so they can be read without touching the tables
+            h5f.create_group("/", "summary", "Summary Statistics")
+            self._init_summary(h5f)
+
         # Save biographical information as node attributes
         if biography:
             for k, v in biography.items():
@@ -306,6 +429,13 @@ class Subject(object):
                     elif issubclass(node[3], tables.IsDescription):
                         h5f.create_table(node[1], node[2], description=node[3])
 
+        # weights are looked up by session and date, see get_weight
+        weight_table = h5f.root.history.weights
+        for col in ('session', 'date'):
+            column = weight_table.cols._f_col(col)
+            if not column.is_indexed:
+                column.create_index()
+
         self.close_hdf(h5f)
 
 
@@ -317,12 +447,131 @@ class Subject(object):
         Args:
             params (dict): biographical attributes to be updated.
         """
+        self._check_writable()
+        h5f = self.open_hdf()
+        try:
+            for k, v in params.items():
+                h5f.root.info._v_attrs[k] = v
+        finally:
+            _ = self.close_hdf(h5f)
+
+    def _init_summary(self, h5f):
+        """
+        Set default values for the attributes of the summary node.
+
+        Args:
+            h5f (:class:`tables.File`): an hdf file opened by :meth:`~.Subject.open_hdf` for writing
+        """
+        summary = h5f.root.summary._v_attrs
+        summary['protocol_name'] = ''
+        summary['step'] = -1
+        summary['step_history'] = []
+        summary['session'] = 0
+        summary['n_sessions'] = 0
+        summary['n_trials'] = 0
+        summary['session_trials'] = 0
+        summary['session_correct'] = 0
+        summary['accuracy'] = np.nan
+        summary['last_trial'] = ''
+        summary['weight_date'] = ''
+        summary['weight_start'] = np.nan
+        summary['weight_stop'] = np.nan
+
+    def rebuild_summary(self):
+        """
+        Recompute the summary node from the trial, history, and weight tables.
+
+        The summary is otherwise kept up to date incrementally by :meth:`~.Subject.data_thread`,
+        :meth:`~.Subject.update_history` and :meth:`~.Subject.update_weights`, so this only
+        needs to be called for files made before it existed, or if it is suspected to be out of sync.
+        """
+        self._check_writable()
+        h5f = self.open_hdf()
+        self._init_summary(h5f)
+        summary = h5f.root.summary._v_attrs
+
+        # protocol and step from current node, if we have one
+        current_group = None
+        if '/current' in h5f:
+            current_node = filenode.open_node(h5f.root.current)
+            current = json.loads(current_node.readall())
+            protocol_name = current_node.attrs['protocol_name']
+            step = int(current_node.attrs['step'])
+            summary['protocol_name'] = protocol_name
+            summary['step'] = step
+            current_group = "/data/{}/S{:02d}_{}".format(protocol_name, step, current[step]['step_name'])
+
+        history = h5f.root.history.history.read()
+        history = history[history['type'] == b'step']
+        summary['step_history'] = [(row['time'].decode('utf-8'), int(row['value']), row['name'].decode('utf-8'))
+                                   for row in history]
+
+        # trial counts across all steps of all protocols, including their session files
+        n_trials = 0
+        sessions = set()
+        last_session_trials = None
+        for trial_table in h5f.walk_nodes('/data', classname='Table'):
+            if trial_table.name != 'trial_data':
+                continue
+            trials = read_trials(h5f, trial_table, lock=self.lock)
+            if len(trials) == 0:
+                continue
+            n_trials += len(trials)
+            session_col = trials['session']
+            sessions.update(np.unique(session_col).tolist())
+
+            # the step we're currently on has the most recent session
+            if trial_table._v_parent._v_pathname == current_group:
+                last_session_trials = trials[session_col == session_col[-1]]
+
+        summary['n_trials'] = n_trials
+        summary['n_sessions'] = len(sessions)
+        try:
+            summary['session'] = int(h5f.root.info._v_attrs['session'])
+        except KeyError:
+            pass
+
+        if last_session_trials is not None:
+            summary['session_trials'] = len(last_session_trials)
+            if 'correct' in last_session_trials.dtype.names:
+                summary['session_correct'] = int(np.sum(last_session_trials['correct']))
+                summary['accuracy'] = summary['session_correct'] / summary['session_trials']
+
+        _update_weight_summary(h5f)
+
+        _ = self.close_hdf(h5f)
+
+    def get_summary(self):
+        """
+        Get summary statistics without reading any of the data tables.
+
+        Returns:
+            dict: with keys
+
+                * protocol_name (str) - currently assigned protocol
+                * step (int) - current step
+                * step_history (list) - list of (timestamp, step number, step name) tuples
+                * session (int) - current session number
+                * n_sessions (int) - number of sessions that have stored at least one trial
+                * n_trials (int) - total number of trials
+                * session_trials (int) - number of trials in the current or most recent session
+                * session_correct (int) - number of correct trials in the session, if the task has a `correct` column
+                * accuracy (float) - session_correct / session_trials, or nan.
+                * last_trial (str) - isoformat timestamp of the last completed trial
+                * weight_date (str) - date of the last weight in 'simple' format
+                * weight_start (float) - last pre-task mass
+                * weight_stop (float) - last post-task mass
+        """
         h5f = self.open_hdf()
-        for k, v in params.items():
-            h5f.root.info._v_attrs[k] = v
+        try:
+            summary = h5f.root.summary._v_attrs
+            summary = {k: summary[k] for k in summary._v_attrnamesuser}
+        except tables.exceptions.NoSuchNodeError:
+            summary = {}
         _ = self.close_hdf(h5f)
+        return summary
 
-    def update_history(self, type, name, value, step=None):
+    def update_history(self, type, name, value, step=None, h5f=None):
         """
         Update the history table when changes are made to the subject's protocol.
 
@@ -344,40 +593,55 @@ class Subject(object):
                 or the protocol dictionary flattened to a string.
             step (int): When type is 'param', changes the parameter at a particular step,
                 otherwise the current step is used.
+            h5f (:class:`tables.File`): if given, an already open file to use rather than opening
+                and closing it here.
         """
-        # Make sure the updates are written to the subject file
-        if type == 'param':
-            if not step:
-                self.current[self.step][name] = value
-            else:
-                self.current[step][name] = value
-            self.flush_current()
-        elif type == 'step':
-            self.step = int(value)
-            self.flush_current()
-        elif type == 'protocol':
-            self.flush_current()
-
-
-        # Check that we're all strings in here
-        if not isinstance(type, str):
-            type = str(type)
-        if not isinstance(name, str):
-            name = str(name)
-        if not isinstance(value, str):
-            value = str(value)
-
-        # log the change
-        h5f = self.open_hdf()
-        history_row = h5f.root.history.history.row
-
-        history_row['time'] = self.get_timestamp(simple=True)
-        history_row['type'] = type
-        history_row['name'] = name
-        history_row['value'] = value
-        history_row.append()
-
-        _ = self.close_hdf(h5f)
+        self._check_writable()
+        close = h5f is None
+        if close:
+            h5f = self.open_hdf()
+        try:
+            # Make sure the updates are written to the subject file
+            if type == 'param':
+                if not step:
+                    self.current[self.step][name] = value
+                else:
+                    self.current[step][name] = value
+                self.flush_current(h5f)
+            elif type == 'step':
+                self.step = int(value)
+                self.flush_current(h5f)
+            elif type == 'protocol':
+                self.flush_current(h5f)
+
+
+            # Check that we're all strings in here
+            if not isinstance(type, str):
+                type = str(type)
+            if not isinstance(name, str):
+                name = str(name)
+            if not isinstance(value, str):
+                value = str(value)
+
+            # log the change
+            history_row = h5f.root.history.history.row
+
+            timestamp = self.get_timestamp(simple=True)
+            history_row['time'] = timestamp
+            history_row['type'] = type
+            history_row['name'] = name
+            history_row['value'] = value
+            history_row.append()
+
+            # keep the summary in step
+            summary = h5f.root.summary._v_attrs
+            summary['protocol_name'] = self.protocol_name
+            summary['step'] = self.step
+            if type == 'step':
+                summary['step_history'] = list(summary['step_history']) + [(timestamp, int(value), name)]
+        finally:
+            if close:
+                self.close_hdf(h5f)
 
 
     # def update_params(self, param, value):
@@ -389,7 +653,7 @@ class Subject(object):
     #     # TODO: this
     #     pass
 
-    def assign_protocol(self, protocol, step_n=0):
+    def assign_protocol(self, protocol, step_n=0, protocol_dict=None):
         """
         Assign a protocol to the subject.
 
@@ -400,6 +664,9 @@ class Subject(object):
 
         Updates the history table.
 
+        The file is opened once for the whole assignment, see :mod:`~.core.reassign`
+        to assign protocols to many subjects at once.
+
         Args:
             protocol (str): the protocol to be assigned. Can be one of
 
@@ -408,17 +675,18 @@ class Subject(object):
                 * the full path and filename of the protocol.
 
             step_n (int): Which step is being assigned?
+            protocol_dict (list): the protocol's steps, if they have already been loaded from the file.
+                if given, `protocol` is only used for the name of the protocol.
         """
+        self._check_writable()
         # Protocol will be passed as a .json filename in prefs.PROTOCOLDIR
 
-        h5f = self.open_hdf()
-
         ## Assign new protocol
         if not protocol.endswith('.json'):
             protocol = protocol + '.json'
 
         # try prepending the protocoldir if we were passed just the name
-        if not os.path.exists(protocol):
+        if protocol_dict is None and not os.path.exists(protocol):
             fullpath = os.path.join(prefs.PROTOCOLDIR, protocol)
             if not os.path.exists(fullpath):
                 Exception('Could not find either {} or {}'.format(protocol, fullpath))
@@ -434,169 +702,184 @@ class Subject(object):
             same_protocol = True
 
         # Load protocol to dict
-        with open(protocol) as protocol_file:
-            prot_dict = json.load(protocol_file)
-
-        # Check if there is an existing protocol, archive it if there is.
-        if "/current" in h5f:
-            _ = self.close_hdf(h5f)
-            self.update_history(type='protocol', name=protocol_name, value = prot_dict)
-            self.stash_current()
-            h5f = self.open_hdf()
-
-        # Make filenode and save as serialized json
-        current_node = filenode.new_node(h5f, where='/', name='current')
-        current_node.write(json.dumps(prot_dict).encode('utf-8'))
-        h5f.flush()
-
-        # save some protocol attributes
-        self.current = prot_dict
-
-        current_node.attrs['protocol_name'] = protocol_name
-        self.protocol_name = protocol_name
-
-        current_node.attrs['step'] = step_n
-        self.step = int(step_n)
+        if protocol_dict is None:
+            with open(protocol) as protocol_file:
+                prot_dict = json.load(protocol_file)
+        else:
+            prot_dict = copy(protocol_dict)
 
-        # always start out on session 0 on a new task
-        # unless this is the same task as was already assigned
-        if not same_protocol:
-            h5f.root.info._v_attrs['session'] = 0
-            self.session = 0
+        h5f = self.open_hdf()
+        try:
+            # Check if there is an existing protocol, archive it if there is.
+            if "/current" in h5f:
+                self.stash_current(h5f)
+
+            # save some protocol attributes,
+            # the current filenode is written by update_history below
+            self.current = prot_dict
+            self.protocol_name = protocol_name
+            self.step = int(step_n)
+
+            # always start out on session 0 on a new task
+            # unless this is the same task as was already assigned
+            if not same_protocol:
+                h5f.root.info._v_attrs['session'] = 0
+                self.session = 0
 
-        # Make file group for protocol
-        if "/data/{}".format(protocol_name) not in h5f:
-            current_group = h5f.create_group('/data', protocol_name)
-        else:
-            current_group = h5f.get_node('/data', protocol_name)
-
-
-        # Create groups for each step
-        # There are two types of data - continuous and trialwise.
-        # Each gets a single table within a group: since each step should have
-        # consistent data requirements over time and hdf5 doesn't need to be in
-        # memory, we can just keep appending to keep things simple.
-        for i, step in enumerate(self.current):
-            # First we get the task class for this step
-            task_class = TASK_LIST[step['task_type']]
-            step_name = step['step_name']
-            # group name is S##_'step_name'
-            group_name = "S{:02d}_{}".format(i, step_name)
-
-            if group_name not in current_group:
-                step_group = h5f.create_group(current_group, group_name)
+            # Make file group for protocol
+            if "/data/{}".format(protocol_name) not in h5f:
+                current_group = h5f.create_group('/data', protocol_name)
             else:
-                step_group = current_group._f_get_child(group_name)
+                current_group = h5f.get_node('/data', protocol_name)
+
+
+            # Create groups for each step
+            # There are two types of data - continuous and trialwise.
+            # Each gets a single table within a group: since each step should have
+            # consistent data requirements over time and hdf5 doesn't need to be in
+            # memory, we can just keep appending to keep things simple.
+            for i, step in enumerate(self.current):
+                # First we get the task class for this step
+                task_class = TASK_LIST[step['task_type']]
+                step_name = step['step_name']
+                # group name is S##_'step_name'
+                group_name = "S{:02d}_{}".format(i, step_name)
+
+                if group_name not in current_group:
+                    step_group = h5f.create_group(current_group, group_name)
+                else:
+                    step_group = current_group._f_get_child(group_name)
 
-            # The task class *should* have at least one PyTables DataTypes descriptor
-            try:
-                if task_class.TrialData is not None:
-                    trial_descriptor = task_class.TrialData
-                    # add a session column, everyone needs a session column
-                    if 'session' not in trial_descriptor.columns.keys():
-                        trial_descriptor.columns.update({'session': tables.Int32Col()})
-                    # same thing with trial_num
-                    if 'trial_num' not in trial_descriptor.columns.keys():
-                        trial_descriptor.columns.update({'trial_num': tables.Int32Col()})
-                    # if this task has sounds, make columns for them
-                    # TODO: Make stim managers return a list of properties for their sounds
-                    if 'stim' in step.keys():
-                        if 'manager' in step['stim'].keys():
-                            # managers have stim nested within groups, but this is still really ugly
-                            sound_params = {}
-                            for g in step['stim']['groups']:
-                                for side, sounds in g['sounds'].items():
+                # The task class *should* have at least one PyTables DataTypes descriptor
+                try:
+                    if task_class.TrialData is not None:
+                        trial_descriptor = task_class.TrialData
+                        # add a session column, everyone needs a session column
+                        if 'session' not in trial_descriptor.columns.keys():
+                            trial_descriptor.columns.update({'session': tables.Int32Col()})
+                        # same thing with trial_num
+                        if 'trial_num' not in trial_descriptor.columns.keys():
+                            trial_descriptor.columns.update({'trial_num': tables.Int32Col()})
+                        # if this task has sounds, make columns for them
+                        # TODO: Make stim managers return a list of properties for their sounds
+                        if 'stim' in step.keys():
+                            if 'manager' in step['stim'].keys():
+                                # managers have stim nested within groups, but this is still really ugly
+                                sound_params = {}
+                                for g in step['stim']['groups']:
+                                    for side, sounds in g['sounds'].items():
+                                        for sound in sounds:
+                                            for k, v in sound.items():
+                                                if k in STRING_PARAMS:
+                                                    sound_params[k] = tables.StringCol(1024)
+                                                else:
+                                                    sound_params[k] = tables.Float64Col()
+                                trial_descriptor.columns.update(sound_params)
+
+                            elif 'sounds' in step['stim'].keys():
+                                # for now we just assume they're floats
+                                sound_params = {}
+                                for side, sounds in step['stim']['sounds'].items():
+                                    # each side has a list of sounds
                                     for sound in sounds:
                                         for k, v in sound.items():
                                             if k in STRING_PARAMS:
                                                 sound_params[k] = tables.StringCol(1024)
                                             else:
                                                 sound_params[k] = tables.Float64Col()
-                            trial_descriptor.columns.update(sound_params)
-
-                        elif 'sounds' in step['stim'].keys():
-                            # for now we just assume they're floats
-                            sound_params = {}
-                            for side, sounds in step['stim']['sounds'].items():
-                                # each side has a list of sounds
-                                for sound in sounds:
-                                    for k, v in sound.items():
-                                        if k in STRING_PARAMS:
-                                            sound_params[k] = tables.StringCol(1024)
-                                        else:
-                                            sound_params[k] = tables.Float64Col()
-                            trial_descriptor.columns.update(sound_params)
-
-                    h5f.create_table(step_group, "trial_data", trial_descriptor)
-                else:
-                    h5f.create_table(step_group, "trial_data", {'session': tables.Int32Col(), 'trial_num': tables.Int32Col()})
-            except tables.NodeError:
-                # we already have made this table, that's fine
-                pass
-            try:
-                # if we have continuous data, make a folder for each data stream.
-                # each session will make its own subfolder,
-                # which contains tables for each of the streams for that session
-                if hasattr(task_class, "ContinuousData"):
-                    cont_group = h5f.create_group(step_group, "continuous_data")
-
-                    # save data names as attributes
-                    data_names = tuple(task_class.ContinuousData.keys())
-
-                    cont_group._v_attrs['data'] = data_names
-                    #cont_descriptor = task_class.ContinuousData
-                    #cont_descriptor.columns.update({'session': tables.Int32Col()})
-                    #h5f.create_table(step_group, "continuous_data", cont_descriptor)
-            except tables.NodeError:
-                # already made it
-                pass
-
-        _ = self.close_hdf(h5f)
-
-        # Update history
-        self.update_history('protocol', protocol_name, self.current)
+                                trial_descriptor.columns.update(sound_params)
+
+                        h5f.create_table(step_group, "trial_data", trial_descriptor)
+                    else:
+                        h5f.create_table(step_group, "trial_data", {'session': tables.Int32Col(), 'trial_num': tables.Int32Col()})
+                except tables.NodeError:
+                    # we already have made this table, that's fine
+                    pass
+                try:
+                    # if we have continuous data, make a folder for each data stream.
+                    # each session will make its own subfolder,
+                    # which contains tables for each of the streams for that session
+                    if hasattr(task_class, "ContinuousData"):
+                        cont_group = h5f.create_group(step_group, "continuous_data")
+
+                        # save data names as attributes
+                        data_names = tuple(task_class.ContinuousData.keys())
+
+                        cont_group._v_attrs['data'] = data_names
+                        #cont_descriptor = task_class.ContinuousData
+                        #cont_descriptor.columns.update({'session': tables.Int32Col()})
+                        #h5f.create_table(step_group, "continuous_data", cont_descriptor)
+                except tables.NodeError:
+                    # already made it
+                    pass
+
+            # Update history
+            self.update_history('protocol', protocol_name, self.current, h5f=h5f)
+        finally:
+            _ = self.close_hdf(h5f)
 
-    def flush_current(self):
+    def flush_current(self, h5f=None):
         """
         Flushes the 'current' attribute in the subject object to the current filenode
         in the .h5
 
         Used to make sure the stored .json representation of the current task stays up to date
         with the params set in the subject object
-        """
-        h5f = self.open_hdf()
-        h5f.remove_node('/current')
-        current_node = filenode.new_node(h5f, where='/', name='current')
-        current_node.write(json.dumps(self.current).encode('utf-8'))
-        current_node.attrs['step'] = self.step
-        current_node.attrs['protocol_name'] = self.protocol_name
-        self.close_hdf(h5f)
 
-    def stash_current(self):
+        Args:
+            h5f (:class:`tables.File`): if given, an already open file to use rather than opening
+                and closing it here.
+        """
+        self._check_writable()
+        close = h5f is None
+        if close:
+            h5f = self.open_hdf()
+        try:
+            if '/current' in h5f:
+                h5f.remove_node('/current')
+            current_node = filenode.new_node(h5f, where='/', name='current')
+            current_node.write(json.dumps(self.current).encode('utf-8'))
+            current_node.attrs['step'] = self.step
+            current_node.attrs['protocol_name'] = self.protocol_name
+        finally:
+            if close:
+                self.close_hdf(h5f)
+
+    def stash_current(self, h5f=None):
         """
         Save the current protocol in the history group and delete the node
 
         Typically this is called when assigning a new protocol.
 
         Stored as the date that it was changed followed by its name if it has one
+
+        Args:
+            h5f (:class:`tables.File`): if given, an already open file to use rather than opening
+                and closing it here.
         """
-        h5f = self.open_hdf()
+        self._check_writable()
+        close = h5f is None
+        if close:
+            h5f = self.open_hdf()
         try:
-            protocol_name = h5f.get_node_attr('/current', 'protocol_name')
-            archive_name = '_'.join([self.get_timestamp(simple=True), protocol_name])
-        except AttributeError:
-            warnings.warn("protocol_name attribute couldn't be accessed, using timestamp to stash protocol")
-            archive_name = self.get_timestamp(simple=True)
+            try:
+                protocol_name = h5f.get_node_attr('/current', 'protocol_name')
+                archive_name = '_'.join([self.get_timestamp(simple=True), protocol_name])
+            except AttributeError:
+                warnings.warn("protocol_name attribute couldn't be accessed, using timestamp to stash protocol")
+                archive_name = self.get_timestamp(simple=True)
 
-        # TODO: When would we want to prefer the .h5f copy over the live one?
-        #current_node = filenode.open_node(h5f.root.current)
-        #old_protocol = current_node.readall()
+            # TODO: When would we want to prefer the .h5f copy over the live one?
+            #current_node = filenode.open_node(h5f.root.current)
+            #old_protocol = current_node.readall()
 
-        archive_node = filenode.new_node(h5f, where='/history/past_protocols', name=archive_name)
-        archive_node.write(json.dumps(self.current).encode('utf-8'))
+            archive_node = filenode.new_node(h5f, where='/history/past_protocols', name=archive_name)
+            archive_node.write(json.dumps(self.current).encode('utf-8'))
 
-        h5f.remove_node('/current')
-        self.close_hdf(h5f)
+            h5f.remove_node('/current')
+        finally:
+            if close:
+                self.close_hdf(h5f)
 
     def prepare_run(self):
         """
@@ -610,6 +893,11 @@ class Subject(object):
             Dict: the parameters for the current step, with subject id, step number,
                 current trial, and session number included.
         """
+        self._check_writable('be run')
+
+        # if we crashed last time, store whatever was journaled but never written
+        # before we start a new session
+        self.replay_journal()
 
         trial_table = None
         cont_table = None
@@ -628,9 +916,11 @@ class Subject(object):
         #self.trial_row = self.trial_table.row
         #self.trial_keys = self.trial_table.colnames
 
-        # get last trial number and session
+        # get last trial number and session,
+        # from the last session file for this step if the subject is sharded
+        last_trial = read_trials(h5f, trial_table, n_rows=1, lock=self.lock)
         try:
-            self.current_trial = trial_table.cols.trial_num[-1]+1
+            self.current_trial = int(last_trial['trial_num'][-1])+1
         except IndexError:
             self.current_trial = 0
 
@@ -638,14 +928,24 @@ class Subject(object):
 
         if not self.session:
             try:
-                self.session = trial_table.cols.session[-1]
+                self.session = int(last_trial['session'][-1])
             except IndexError:
                 self.session = 0
 
         self.session += 1
         h5f.root.info._v_attrs['session'] = self.session
+
+        summary = h5f.root.summary._v_attrs
+        summary['session'] = self.session
+        # n_sessions is only counted once the session stores a trial, see data_thread
+        summary['session_trials'] = 0
+        summary['session_correct'] = 0
+        summary['accuracy'] = np.nan
         h5f.flush()
 
+        if self.sharded:
+            self.new_shard(h5f, task_params)
+
         # try:
         #     self.session = trial_table.cols.session[-1]+1
         # except IndexError:
@@ -654,7 +954,7 @@ class Subject(object):
         # prepare continuous data group and tables
         task_class = TASK_LIST[task_params['task_type']]
         cont_group = None
-        if hasattr(task_class, 'ContinuousData'):
+        if hasattr(task_class, 'ContinuousData') and not self.sharded:
 
             cont_group = h5f.get_node(group_name, 'continuous_data')
             try:
@@ -691,11 +991,14 @@ class Subject(object):
                         grad_params.update({param:getattr(self, param)})
 
             if grad_obj.COLS:
-                # these are columns in our trial table
+                # these are columns in our trial table,
+                # only read as many of the most recent rows as the object needs,
+                # including those in session files
+                seed_trials = read_trials(h5f, trial_table, n_rows=grad_obj.seed_rows(grad_params), lock=self.lock)
                 for col in grad_obj.COLS:
                     try:
-                        grad_params.update({col: trial_table.col(col)})
-                    except KeyError:
+                        grad_params.update({col: seed_trials[col]})
+                    except (KeyError, ValueError):
                         Warning('Graduation object requested column {}, but it was not found in the trial table'.format(col))
 
             #grad_params['value']['current_trial'] = str(self.current_trial) # str so it's json serializable
@@ -707,6 +1010,14 @@ class Subject(object):
         self.close_hdf(h5f)
 
         # spawn thread to accept data
+        self.journal = Journal(self.journal_file)
+        self.journal_stats = {
+            'received': 0,
+            'compacted': 0,
+            'lag': 0.0,
+            'max_lag': 0.0,
+            'start_time': time.time()
+        }
         self.data_queue = queue.Queue()
         self.thread = threading.Thread(target=self.data_thread, args=(self.data_queue,))
         self.thread.start()
@@ -721,6 +1032,178 @@ class Subject(object):
         task['session'] = int(self.session)
         return task
 
+    @property
+    def shard_dir(self):
+        """
+        Directory that session files of a :attr:`~.Subject.sharded` subject are stored in
+
+        Returns:
+            str: ``{prefs.DATADIR}/{self.name}_sessions``
+        """
+        return os.path.splitext(self.file)[0] + '_sessions'
+
+    def get_shards(self, step=None, protocol_name=None, h5f=None):
+        """
+        Get the session files listed in the manifest, in session order.
+
+        Args:
+            step (int): only sessions from this step. if None, all steps.
+            protocol_name (str): only sessions from this protocol. if None, the current protocol.
+            h5f (:class:`tables.File`): if given, an already open file to use rather than opening
+                and closing it here.
+
+        Returns:
+            list: absolute paths of session files
+        """
+        return [file for _, file in self._shard_rows(step=step, protocol_name=protocol_name, h5f=h5f)]
+
+    def _shard_rows(self, step=None, protocol_name=None, session=None, h5f=None):
+        """
+        Get (session, absolute path) of session files in the manifest that match, in session order.
+
+        Args:
+            step (int): only sessions from this step. if None, all steps.
+            protocol_name (str): only sessions from this protocol. if None, the current protocol.
+            session (int): only this session.
+            h5f (:class:`tables.File`): if given, an already open file to use
+
+        Returns:
+            list: of (session, path) tuples, see :func:`.shard_files`
+        """
+        close = h5f is None
+        if close:
+            h5f = self.open_hdf()
+        if protocol_name is None:
+            protocol_name = self.protocol_name
+
+        rows = shard_files(h5f, protocol_name=protocol_name, step=step, session=session)
+
+        if close:
+            self.close_hdf(h5f)
+        return rows
+
+    def new_shard(self, h5f, task_params):
+        """
+        Make a file for the current session of a :attr:`~.Subject.sharded` subject, and add it to the manifest.
+
+        The session file has the same structure as the subject's ``/data`` group, but only the current step,
+        and a ``/summary`` group that :meth:`~.Subject.data_thread` writes to during the session.
+        The main subject file isn't written to again until the session ends, when the summary is copied back
+        and the number of trials is stored in the manifest, so the files of past sessions can be
+        archived or copied on their own.
+
+        Files are stored in :attr:`~.Subject.shard_dir` as ``{protocol}/S##_{step_name}/session_#.h5``
+
+        Args:
+            h5f (:class:`tables.File`): the open subject file, from :meth:`~.Subject.prepare_run`
+            task_params (dict): parameters of the current step
+
+        Returns:
+            str: path to the session's file
+        """
+        step_name = task_params['step_name']
+        step_group = "S{:02d}_{}".format(self.step, step_name)
+        group_name = "/data/{}/{}".format(self.protocol_name, step_group)
+        rel_file = os.path.join(os.path.basename(self.shard_dir), self.protocol_name,
+                                step_group, 'session_{}.h5'.format(self.session))
+        shard_file = os.path.join(os.path.dirname(self.file), rel_file)
+        os.makedirs(os.path.dirname(shard_file), exist_ok=True)
+
+        with self.lock, File_Lock(shard_file):
+            with tables.open_file(shard_file, mode='a') as shard_h5f:
+                shard_group = shard_h5f.create_group(os.path.dirname(group_name), step_group, createparents=True) \
+                    if group_name not in shard_h5f else shard_h5f.get_node(group_name)
+
+                if 'trial_data' not in shard_group:
+                    trial_table = h5f.get_node(group_name, 'trial_data')
+                    shard_h5f.create_table(shard_group, 'trial_data', description=trial_table.description)
+
+                if 'continuous_data' in h5f.get_node(group_name) and 'continuous_data' not in shard_group:
+                    cont_group = shard_h5f.create_group(shard_group, 'continuous_data')
+                    cont_group._v_attrs['data'] = h5f.get_node(group_name, 'continuous_data')._v_attrs['data']
+                    shard_h5f.create_group(cont_group, 'session_{}'.format(self.session))
+
+                if '/summary' not in shard_h5f:
+                    shard_summary = shard_h5f.create_group('/', 'summary')
+                    for attr in h5f.root.summary._v_attrs._f_list():
+                        shard_summary._v_attrs[attr] = h5f.root.summary._v_attrs[attr]
+                shard_h5f.root._v_attrs['journal_offset'] = 0
+
+        manifest_row = h5f.root.history.sessions.row
+        manifest_row['session'] = self.session
+        manifest_row['protocol_name'] = self.protocol_name
+        manifest_row['step'] = self.step
+        manifest_row['step_name'] = step_name
+        manifest_row['file'] = rel_file
+        manifest_row['start'] = self.get_timestamp(simple=True)
+        manifest_row['n_trials'] = 0
+        manifest_row.append()
+        h5f.root.history.sessions.flush()
+
+        return shard_file
+
+    def open_data(self, session, mode=None):
+        """
+        Open the file that a session's data is stored in: its session file if the subject was
+        :attr:`~.Subject.sharded` when it was run, otherwise the subject's file.
+
+        Must be closed with :meth:`~.Subject.close_hdf`
+
+        Args:
+            session (int): session number
+            mode (str): file access mode, see :meth:`~.Subject.open_hdf`
+
+        Returns:
+            :class:`tables.File`
+        """
+        shards = self._shard_rows(session=session) if session is not None else []
+        if len(shards) == 0:
+            return self.open_hdf(mode)
+
+        if mode is None:
+            mode = self.mode
+        elif self.mode == 'r' and mode != 'r':
+            raise PermissionError('Subject {} is read-only, cannot open with mode {}'.format(self.file, mode))
+        return self._open_file(shards[-1][1], mode)
+
+    def _close_shard(self, shard_h5f):
+        """
+        Finish writing a session file: copy its summary back to the subject's file, update
+        the number of trials in the manifest, and close it.
+
+        Args:
+            shard_h5f (:class:`tables.File`): a session file opened by :meth:`~.Subject.open_data`
+        """
+        shard_summary = {attr: shard_h5f.root.summary._v_attrs[attr]
+                         for attr in shard_h5f.root.summary._v_attrs._f_list()}
+        n_trials = sum(table.nrows for table in shard_h5f.walk_nodes('/data', classname='Table')
+                       if table.name == 'trial_data')
+        self.close_hdf(shard_h5f)
+
+        h5f = self.open_hdf()
+        for attr, value in shard_summary.items():
+            h5f.root.summary._v_attrs[attr] = value
+        manifest = h5f.root.history.sessions
+        for row in manifest.where('(session == this_session) & (protocol_name == this_protocol)',
+                                  condvars={'this_session': int(self.session),
+                                            'this_protocol': str(self.protocol_name).encode('utf-8')}):
+            row['n_trials'] = n_trials
+            row.update()
+        self.close_hdf(h5f)
+
+    def _read_shards(self, step_tab, h5f):
+        """
+        Read the trial data of a step from its session files, see :func:`.read_shards`
+
+        Args:
+            step_tab (:class:`tables.Table`): the step's trial data table in the subject's file
+            h5f (:class:`tables.File`): the open subject file
+
+        Returns:
+            list: of :class:`numpy.ndarray` s of trial rows, in session order
+        """
+        return read_shards(h5f, step_tab, lock=self.lock)
+
     def data_thread(self, queue):
         """
         Thread that keeps hdf file open and receives data while task is running.
@@ -732,13 +1215,23 @@ class Subject(object):
         each dict given to the queue should have the `trial_num`, and this method can
         properly store data without passing `TRIAL_END` if so. I recommend being explicit, however.
 
+        Trial data is written with a :class:`~.utils.Row_Writer`. Finished trials are appended to the table
+        as they end, or, if more data is already waiting in the queue, in batches of up to
+        :attr:`~.Subject.trial_batch` trials.
+
+        Items put in the queue by :meth:`~.Subject.save_data` are tuples of
+        (data, journal offset, time received). When trials are stored, the journal offset of the last one is
+        committed to the `journal_offset` attribute of the root node,
+        and once the queue has been drained the journal is truncated.
+
         Checks graduation state at the end of each trial.
 
         Args:
             queue (:class:`queue.Queue`): passed by :meth:`~.Subject.prepare_run` and used by other
                 objects to pass data to be stored.
         """
-        h5f = self.open_hdf()
+        # if the subject is sharded, only the session's file is written to until the end
+        h5f = self.open_data(self.session)
 
         task_params = self.current[self.step]
         step_name = task_params['step_name']
@@ -747,71 +1240,109 @@ class Subject(object):
         group_name = "/data/{}/S{:02d}_{}".format(self.protocol_name, self.step, step_name)
         #try:
         trial_table = h5f.get_node(group_name, 'trial_data')
-        trial_keys = trial_table.colnames
-        trial_row = trial_table.row
-
-        # try to get continuous data table if any
+        trial_writer = Row_Writer(trial_table, buffer_size=self.trial_batch)
+
+        # running counts are kept here and written to the summary node when trials are committed
+        summary = h5f.root.summary._v_attrs
+        n_trials = int(summary['n_trials'])
+        session_trials = int(summary['session_trials'])
+        session_correct = int(summary['session_correct'])
+        has_correct = 'correct' in trial_writer
+        # sessions are counted when their first trial is stored, like rebuild_summary counts them
+        session_counted = session_trials > 0
+
+        # try to get continuous data group if any
+        # continuous data is buffered and appended to its arrays a block at a time
         cont_data = tuple()
-        cont_tables = {}
-        cont_rows = {}
+        cont_arrays = {}
+        cont_buffers = {}
+        # time of the last sample already in each stream's arrays
+        cont_stored = {}
         try:
             continuous_group = h5f.get_node(group_name, 'continuous_data')
             session_group = h5f.get_node(continuous_group, 'session_{}'.format(self.session))
             cont_data = continuous_group._v_attrs['data']
-
-
-            cont_tables = {}
-            cont_rows = {}
-            #continuous_keys  = continuous_table.colnames
-            #continous_row    = continuous_table.row
-        except AttributeError:
-            continuous_table = False
+        except (AttributeError, tables.NoSuchNodeError):
+            session_group = None
+
+        # track how much of the journal has been stored
+        journal_offset = None
+        trial_offset = None
+        stats = self.journal_stats
+
+        def commit():
+            """
+            Store finished trials and buffered continuous data, update the summary, and
+            commit the journal offset of the last finished trial.
+
+            The offset and summary are set before the rows are appended, and the file is flushed after,
+            so they reach the disk together.
+            """
+            nonlocal session_counted, trial_offset
+            for k, buffer in cont_buffers.items():
+                self._append_continuous(cont_arrays[k], buffer)
+            if trial_writer.n == 0 and trial_offset is None:
+                return
+
+            summary['n_trials'] = n_trials
+            summary['session_trials'] = session_trials
+            summary['session_correct'] = session_correct
+            if session_trials > 0 and not session_counted:
+                summary['n_sessions'] = int(summary['n_sessions']) + 1
+                session_counted = True
+            if has_correct and session_trials > 0:
+                summary['accuracy'] = session_correct / session_trials
+            summary['last_trial'] = self.get_timestamp()
+            if trial_offset is not None:
+                h5f.root._v_attrs['journal_offset'] = trial_offset
+                trial_offset = None
+
+            trial_writer.flush()
+            h5f.flush()
 
         # start getting data
         # stop when 'END' gets put in the queue
         for data in iter(queue.get, 'END'):
+            if isinstance(data, tuple):
+                data, offset, received = data
+            else:
+                offset, received = None, None
+
             # wrap everything in try because this thread shouldn't crash
             try:
                 # if we get continuous data, this should be simple because we always get a whole row
                 # there must be a more elegant way to check if something is a key and it is true...
                 # yet here we are
                 if 'continuous' in data.keys():
+                    try:
+                        timestamp = continuous_time(data['timestamp'])
+                    except KeyError:
+                        # TODO: Log if no timestamp is received
+                        warnings.warn('no timestamp sent with continuous data')
+                        continue
+
                     for k, v in data.items():
                         # if this isn't data that we're expecting, ignore it
                         if k not in cont_data:
                             continue
 
-                        # if we haven't made a table yet, do it
-                        if k not in cont_tables.keys():
-                            # make atom for this data
-                            try:
-                                # if it's a numpy array...
-                                col_atom = tables.Atom.from_type(v.dtype.name, v.shape)
-                            except AttributeError:
-                                temp_array = np.array(v)
-                                col_atom = tables.Atom.from_type(temp_array.dtype.name, temp_array.shape)
-                            # should have come in with a timestamp
-                            # TODO: Log if no timestamp is received
-                            try:
-                                temp_timestamp_arr = np.array(data['timestamp'])
-                                timestamp_atom = tables.Atom.from_type(temp_timestamp_arr.dtype.name,
-                                                                       temp_timestamp_arr.shape)
-
-                            except KeyError:
-                                Warning('no timestamp sent with continuous data')
-                                continue
-
-
-                            cont_tables[k] = h5f.create_table(session_group, k, description={
-                                k: tables.Col.from_atom(col_atom),
-                                'timestamp': tables.Col.from_atom(timestamp_atom)
-                            }, filters=self.continuous_filter)
-
-                            cont_rows[k] = cont_tables[k].row
-
-                        cont_rows[k][k] = v
-                        cont_rows[k]['timestamp'] = data['timestamp']
-                        cont_rows[k].append()
+                        # if we haven't made arrays for this stream yet, do it
+                        if k not in cont_arrays.keys():
+                            cont_arrays[k] = self._continuous_arrays(h5f, session_group, k, v)
+                            cont_buffers[k] = ([], [])
+                            stored = cont_arrays[k][1]
+                            cont_stored[k] = stored[-1] if stored.nrows > 0 else None
+
+                        # blocks of continuous data are stored before the journal offset of the
+                        # trial they fall in is committed, so skip samples replayed from the journal
+                        # that were already stored
+                        if cont_stored[k] is not None and timestamp <= cont_stored[k]:
+                            continue
+
+                        cont_buffers[k][0].append(v)
+                        cont_buffers[k][1].append(timestamp)
+                        if len(cont_buffers[k][1]) >= self.continuous_block:
+                            self._append_continuous(cont_arrays[k], cont_buffers[k])
 
                     # continue, the rest is for handling trial data
                     continue
@@ -822,145 +1353,504 @@ class Subject(object):
                 # if we've already recorded a trial number for this row,
                 # and the trial number we just got is not the same,
                 # we edit that row if we already have some data on it or else start a new row
-                if 'trial_num' in data.keys():
-                    if (trial_row['trial_num']) and (trial_row['trial_num'] is None):
-                        trial_row['trial_num'] = data['trial_num']
-
-                    if (trial_row['trial_num']) and (trial_row['trial_num'] != data['trial_num']):
-
-                        # find row with this trial number if it exists
-                        # this will return a list of rows with matching trial_num.
-                        # if it's empty, we didn't receive a TRIAL_END and should create a new row
-                        other_row = [r for r in trial_table.where("trial_num == {}".format(data['trial_num']))]
-
-                        if len(other_row) == 0:
-                            # proceed to fill the row below
-                            trial_row.append()
-
-                        elif len(other_row) == 1:
-                            # update the row and continue so we don't double write
-                            # have to be in the middle of iteration to use update()
-                            for row in trial_table.where("trial_num == {}".format(data['trial_num'])):
-                                for k, v in data.items():
-                                    if k in trial_keys:
-                                        row[k] = v
-                                row.update()
-                            continue
-
-                        else:
-                            # we have more than one row with this trial_num.
-                            # shouldn't happen, but we dont' want to throw any data away
-                            Warning('Found multiple rows with same trial_num: {}'.format(data['trial_num']))
-                            # continue just for data conservancy's sake
-                            trial_row.append()
-
-                for k, v in data.items():
-                    # some bug where some columns are not always detected,
-                    # rather than failing out here, just log error
-                    if k in trial_keys:
-                        try:
-                            trial_row[k] = v
-                        except KeyError:
-                            # TODO: Logging here
-                            Warning("Data dropped: key: {}, value: {}".format(k, v))
+                if 'trial_num' in data.keys() and trial_writer.filled and \
+                        trial_writer['trial_num'] != data['trial_num']:
+                    # rows might still be in the writer's buffer
+                    trial_writer.flush()
+
+                    # find row with this trial number if it exists
+                    # this will return a list of rows with matching trial_num.
+                    # if it's empty, we didn't receive a TRIAL_END and should create a new row
+                    other_row = trial_table.get_where_list("trial_num == {}".format(data['trial_num']))
+
+                    if len(other_row) == 0:
+                        # proceed to fill the row below
+                        trial_writer.append()
+
+                    elif len(other_row) == 1:
+                        # update the row and continue so we don't double write
+                        # have to be in the middle of iteration to use update()
+                        for row in trial_table.where("trial_num == {}".format(data['trial_num'])):
+                            for k, v in data.items():
+                                if k in trial_writer:
+                                    row[k] = v
+                            row.update()
+                        continue
+
+                    else:
+                        # we have more than one row with this trial_num.
+                        # shouldn't happen, but we dont' want to throw any data away
+                        Warning('Found multiple rows with same trial_num: {}'.format(data['trial_num']))
+                        # continue just for data conservancy's sake
+                        trial_writer.append()
+
+                trial_writer.update(data)
 
                 # TODO: Or if all the values have been filled, shouldn't need explicit TRIAL_END flags
                 if 'TRIAL_END' in data.keys():
-                    trial_row['session'] = self.session
-                    trial_row.append()
-                    trial_table.flush()
+                    trial_writer['session'] = self.session
+
+                    n_trials += 1
+                    session_trials += 1
+                    if has_correct:
+                        session_correct += int(trial_writer['correct'])
+
                     if self.graduation:
                         # set our graduation flag, the terminal will get the rest rolling
-                        did_graduate = self.graduation.update(trial_row)
+                        did_graduate = self.graduation.update(trial_writer.as_dict())
                         if did_graduate is True:
                             self.did_graduate.set()
 
-                # always flush so that our row iteration routines above will find what they're looking for
-                trial_table.flush()
+                    trial_writer.append()
+                    if offset is not None:
+                        trial_offset = offset
+
+                    # write the trials in bulk if data is coming in faster than we can store it,
+                    # otherwise store each trial as it ends
+                    if trial_writer.n == 0 or queue.empty():
+                        commit()
+
             except Exception as e:
                 # TODO: Get logger and log this
                 # we shouldn't throw any exception in this thread, just log it and move on
                 print(e)
+            finally:
+                if offset is not None:
+                    journal_offset = offset
+                if received is not None:
+                    lag = time.time() - received
+                    stats['compacted'] = stats.get('compacted', 0) + 1
+                    stats['lag'] = lag
+                    stats['max_lag'] = max(stats.get('max_lag', 0.0), lag)
+
+        commit()
+
+        # everything in the journal has been stored, so we can start it over
+        if self.journal is not None:
+            self.journal.close()
+            self.journal.truncate()
+            h5f.root._v_attrs['journal_offset'] = 0
+        elif journal_offset is not None:
+            h5f.root._v_attrs['journal_offset'] = journal_offset
+
+        if h5f.filename != self.file:
+            self._close_shard(h5f)
+        else:
+            self.close_hdf(h5f)
 
-        self.close_hdf(h5f)
-
-    def save_data(self, data):
+    def _continuous_arrays(self, h5f, session_group, key, value):
         """
-        Alternate and equivalent method of putting data in the queue as `Subject.data_queue.put(data)`
+        Make the arrays to store a stream of continuous data in a session's group::
+
+            continuous_data/session_N/<key> (group)
+            |--- data - chunked EArray of samples, with the shape and type of the first sample
+            |--- timestamp - EArray of sample times as float seconds since the epoch
+            |--- index - sparse time index: time of the first sample in each block of
+                 :attr:`~.Subject.continuous_block` samples
+
+        If the arrays already exist (eg. a session was resumed), they are returned instead.
 
         Args:
-            data (dict): trial data. each should have a 'trial_num', and a dictionary with key
-                'TRIAL_END' should be passed at the end of each trial.
-        """
-        self.data_queue.put(data)
+            h5f (:class:`tables.File`): file opened by :meth:`~.Subject.data_thread`
+            session_group (:class:`tables.Group`): ``continuous_data/session_N``
+            key (str): name of the data stream
+            value: first sample, used to make the array's atom
 
-    def stop_run(self):
-        """
-        puts 'END' in the data_queue, which causes :meth:`~.Subject.data_thread` to end.
+        Returns:
+            tuple: (data, timestamp, index) :class:`tables.EArray` s
         """
-        self.data_queue.put('END')
-        self.thread.join(5)
-        self.running = False
-        if self.thread.is_alive():
-            Warning('Data thread did not exit')
-
-    def to_csv(self, path, task='current', step='all'):
+        if key in session_group:
+            key_group = session_group._f_get_child(key)
+            return key_group.data, key_group.timestamp, key_group.index
+
+        value = np.asarray(value)
+        block = self.continuous_block
+        key_group = h5f.create_group(session_group, key)
+        key_group._v_attrs['block_size'] = block
+
+        data = h5f.create_earray(key_group, 'data', atom=tables.Atom.from_dtype(value.dtype),
+                                 shape=(0,) + value.shape, filters=self.continuous_filter,
+                                 chunkshape=(block,) + value.shape)
+        timestamp = h5f.create_earray(key_group, 'timestamp', atom=tables.Float64Atom(),
+                                      shape=(0,), filters=self.continuous_filter,
+                                      chunkshape=(block,))
+        index = h5f.create_earray(key_group, 'index', atom=tables.Float64Atom(), shape=(0,))
+        return data, timestamp, index
+
+    @staticmethod
+    def _append_continuous(arrays, buffer):
         """
-        Export trial data to .csv
+        Append buffered samples of continuous data and the start times of any new blocks to the time index.
 
         Args:
-            path (str): output path of .csv
-            task (str, int):  not implemented, but in the future pull data from 'current' or other named task
-            step (str, int, list, tuple): Step to select, see :meth:`.Subject.get_trial_data`
+            arrays (tuple): (data, timestamp, index) arrays from :meth:`~.Subject._continuous_arrays`
+            buffer (tuple): lists of (samples, timestamps), which are emptied.
         """
-        # TODO: Jonny just scratching out temporarily, doesn't have all features implemented
-        df = self.get_trial_data(step=step)
-        df['subject'] = self.name
-        df.to_csv(path)
-        print("""Subject {}
-dataframe saved to:\n {}
-========================
-N Trials:   {}
-N Sessions: {}""".format(self.name, path, df.shape[0], len(df.session.unique())))
+        values, timestamps = buffer
+        if len(timestamps) == 0:
+            return
+        data, timestamp, index = arrays
+        block = timestamp._v_parent._v_attrs['block_size']
 
+        start = timestamp.nrows
+        # rows that begin a new block
+        first = -start % block
+        index.append(np.asarray(timestamps[first::block], dtype=np.float64))
 
+        data.append(np.asarray(values, dtype=data.atom.dtype).reshape((-1,) + data.atom.shape))
+        timestamp.append(np.asarray(timestamps, dtype=np.float64))
+        values.clear()
+        timestamps.clear()
 
-    def get_trial_data(self,
-                       step: typing.Union[int, list, str] = -1,
-                       what: str ="data"):
+    def get_continuous(self, key, session=None, t0=None, t1=None, step=None):
         """
-        Get trial data from the current task.
-
-        Args:
-            step (int, list, 'all'): Step that should be returned, can be one of
+        Get a time range of a continuous data stream.
 
-                * -1: most recent step
-                * int: a single step
-                * list of two integers eg. [0, 5], an inclusive range of steps.
-                * string: the name of a step (excluding S##_)
-                * 'all': all steps.
+        The sparse time index is used to find the blocks that contain `t0` and `t1`, so only
+        those blocks are read from the file. Sample times are assumed to increase within a session.
 
-            what (str): What should be returned?
+        Continuous data stored as tables by older versions of autopilot, or merged by
+        :func:`~.repack.merge_continuous`, are read whole and then filtered.
 
-                * 'data' : Dataframe of requested steps' trial data
-                * 'variables': dict of variables *without* loading data into memory
+        Args:
+            key (str): name of the data stream, a key in the task's ``ContinuousData``
+            session (int): session number. if None (default), the most recent session with this stream.
+            t0 (float, str, :class:`datetime.datetime`): start of the range (inclusive), as seconds since the epoch,
+                an isoformatted timestamp, or a datetime. if None, from the start of the session.
+            t1 (float, str, :class:`datetime.datetime`): end of the range (inclusive). if None, to the end of the session.
+            step (int): step number. if None (default), the current step.
 
         Returns:
-            :class:`pandas.DataFrame`: DataFrame of requested steps' trial data.
+            :class:`pandas.DataFrame`: with columns `timestamp` (float seconds since the epoch) and `key`.
+            Multidimensional samples are stored as one array per row.
         """
-        # step= -1 is just most recent step,
-        # step= int is an integer specified step
-        # step= [n1, n2] is from step n1 to n2 inclusive
-        # step= 'all' or anything that isn't an int or a list is all steps
-        h5f = self.open_hdf()
-        group_name = "/data/{}".format(self.protocol_name)
-        group = h5f.get_node(group_name)
-        step_groups = sorted(group._v_children.keys())
-
-        if step == -1:
+        if step is None:
+            step = self.step
+        t0 = -np.inf if t0 is None else continuous_time(t0)
+        t1 = np.inf if t1 is None else continuous_time(t1)
+
+        # sessions of sharded subjects are in their own files
+        if session is None:
+            shard_sessions = [shard_session for shard_session, _ in self._shard_rows(step=step)]
+            if len(shard_sessions) > 0:
+                session = shard_sessions[-1]
+
+        h5f = self.open_data(session)
+        try:
+            step_name = self.current[step]['step_name']
+            cont_group = h5f.get_node("/data/{}/S{:02d}_{}".format(self.protocol_name, step, step_name),
+                                      'continuous_data')
+
+            if session is None:
+                sessions = [int(name.split('_')[-1]) for name, group in cont_group._v_groups.items()
+                            if name.startswith('session_') and key in group]
+                if len(sessions) == 0 and key in cont_group:
+                    sessions = [int(np.max(cont_group._f_get_child(key).col('session')))]
+                if len(sessions) == 0:
+                    raise KeyError('No continuous data {} for step {}'.format(key, step))
+                session = max(sessions)
+
+            session_name = 'session_{}'.format(session)
+            if session_name in cont_group and key in cont_group._f_get_child(session_name):
+                node = cont_group._f_get_child(session_name)._f_get_child(key)
+            elif key in cont_group:
+                node = cont_group._f_get_child(key)
+            else:
+                raise KeyError('No continuous data {} for session {}'.format(key, session))
+
+            if isinstance(node, tables.Group):
+                # find the blocks that could have samples in the range, then the rows within them
+                block = node._v_attrs['block_size']
+                starts = node.index.read()
+                first = max(np.searchsorted(starts, t0, side='right') - 1, 0) * block
+                last = min(np.searchsorted(starts, t1, side='right') * block, node.timestamp.nrows)
+
+                timestamps = node.timestamp.read(first, last)
+                lo = first + np.searchsorted(timestamps, t0, side='left')
+                hi = first + np.searchsorted(timestamps, t1, side='right')
+                timestamps = timestamps[lo - first:hi - first]
+                values = node.data.read(lo, hi)
+            else:
+                rows = node.read()
+                if 'session' in rows.dtype.names:
+                    rows = rows[rows['session'] == session]
+                timestamps = np.array([continuous_time(ts) for ts in rows['timestamp']], dtype=np.float64)
+                mask = (timestamps >= t0) & (timestamps <= t1)
+                timestamps = timestamps[mask]
+                values = rows[key][mask]
+        finally:
+            self.close_hdf(h5f)
+
+        if values.ndim > 1:
+            values = list(values)
+        return pd.DataFrame({'timestamp': timestamps, key: values})
+
+    def save_data(self, data):
+        """
+        Alternate and equivalent method of putting data in the queue as `Subject.data_queue.put(data)`
+
+        Data is first appended to the :attr:`~.Subject.journal` so that it survives a crash
+        before :meth:`~.Subject.data_thread` can write it to the hdf5 file.
+
+        Args:
+            data (dict): trial data. each should have a 'trial_num', and a dictionary with key
+                'TRIAL_END' should be passed at the end of each trial.
+        """
+        offset = None
+        if self.journal is not None:
+            offset = self.journal.append(data)
+        self.journal_stats['received'] = self.journal_stats.get('received', 0) + 1
+        self.data_queue.put((data, offset, time.time()))
+
+    @property
+    def journal_file(self):
+        """
+        Path to the subject's write-ahead journal, next to the .h5 file.
+
+        Returns:
+            str
+        """
+        return os.path.splitext(self.file)[0] + '.journal'
+
+    def replay_journal(self):
+        """
+        Store any data left in the journal that was never written to the hdf5 file,
+        eg. if the Terminal crashed while running.
+
+        Records after the `journal_offset` attribute of the root node are passed through
+        :meth:`~.Subject.data_thread` synchronously, using the session they were received in.
+
+        The offset is committed with the trials it covers, so the records after it belong to trials
+        that weren't stored. The :meth:`~.Subject.data_thread` that replays them starts without any
+        trial in progress, so replayed trials are appended as new rows rather than merged into existing ones.
+        A trial whose ``TRIAL_END`` never made it into the journal is appended as a partial row
+        when data for the next trial is replayed.
+
+        Continuous data is stored a block at a time, so some samples after the offset may already
+        have been stored. Replayed samples that are no later than the last stored sample of their
+        stream are skipped.
+
+        Returns:
+            int: number of records replayed
+        """
+        if not os.path.isfile(self.journal_file):
+            return 0
+
+        h5f = self.open_data(self.session)
+        try:
+            start = int(h5f.root._v_attrs['journal_offset'])
+        except KeyError:
+            start = 0
+        _ = self.close_hdf(h5f)
+
+        replay_queue = queue.Queue()
+        n_records = 0
+        for data, offset in Journal.read(self.journal_file, start):
+            replay_queue.put((data, offset, None))
+            n_records += 1
+        replay_queue.put('END')
+
+        if n_records > 0:
+            warnings.warn('Replaying {} records from the journal of subject {}'.format(n_records, self.name))
+            self.journal = None
+            self.data_thread(replay_queue)
+
+        Journal(self.journal_file).truncate()
+        h5f = self.open_data(self.session)
+        h5f.root._v_attrs['journal_offset'] = 0
+        _ = self.close_hdf(h5f)
+        return n_records
+
+    def get_trial_ranges(self, session=None):
+        """
+        Get the trial numbers stored for a session in the current step as compact ranges.
+
+        Sent to a :class:`.Pilot` when a task is stopped so it can send back any trials we're missing,
+        see :meth:`.Pilot.l_cohere`
+
+        Args:
+            session (int): session number. if None, the current session.
+
+        Returns:
+            list: list of [start, stop] trial number ranges, inclusive, see :func:`.utils.to_ranges`
+        """
+        if session is None:
+            session = self.session
+
+        h5f = self.open_data(session, mode='r')
+        group_name = "/data/{}/S{:02d}_{}".format(self.protocol_name, self.step, self.current[self.step]['step_name'])
+        trial_table = h5f.get_node(group_name, 'trial_data')
+        trial_nums = trial_table.read_where('session == {}'.format(int(session)), field='trial_num')
+        _ = self.close_hdf(h5f)
+
+        return to_ranges(trial_nums)
+
+    def save_missing_trials(self, trials, session=None, step=None):
+        """
+        Store whole trials that were recovered after a run, eg. those sent by :meth:`.Pilot.l_cohere`
+        that were dropped by the network.
+
+        Trials whose `trial_num` is already stored for the session are skipped.
+
+        Args:
+            trials (:class:`numpy.ndarray`): structured array of trial rows
+            session (int): the session these trials belong to. if None, the current session.
+            step (int): the step these trials were run on. if None, the current step.
+
+        Returns:
+            int: number of trials stored
+        """
+        self._check_writable()
+        if session is None:
+            session = self.session
+        if step is None:
+            step = self.step
+        if trials is None or len(trials) == 0:
+            return 0
+
+        h5f = self.open_data(session)
+        try:
+            group_name = "/data/{}/S{:02d}_{}".format(self.protocol_name, step, self.current[step]['step_name'])
+            trial_table = h5f.get_node(group_name, 'trial_data')
+            trial_keys = [k for k in trials.dtype.names if k in trial_table.colnames and k != 'session']
+            have_trials = set(trial_table.read_where('session == {}'.format(int(session)), field='trial_num').tolist())
+
+            n_stored = 0
+            n_correct = 0
+            trial_row = trial_table.row
+            for trial in trials:
+                if int(trial['trial_num']) in have_trials:
+                    continue
+                for k in trial_keys:
+                    trial_row[k] = trial[k]
+                trial_row['session'] = session
+                trial_row.append()
+                n_stored += 1
+                if 'correct' in trial_keys:
+                    n_correct += int(trial['correct'])
+            trial_table.flush()
+
+            # the summary is always in the main file
+            if h5f.filename != self.file:
+                _ = self.close_hdf(h5f)
+                h5f = self.open_hdf()
+
+            summary = h5f.root.summary._v_attrs
+            summary['n_trials'] = int(summary['n_trials']) + n_stored
+            if session == summary['session']:
+                summary['session_trials'] = int(summary['session_trials']) + n_stored
+                summary['session_correct'] = int(summary['session_correct']) + n_correct
+                if 'correct' in trial_keys and summary['session_trials'] > 0:
+                    summary['accuracy'] = summary['session_correct'] / summary['session_trials']
+
+        finally:
+            _ = self.close_hdf(h5f)
+        return n_stored
+
+    def get_journal_stats(self):
+        """
+        Report how well :meth:`~.Subject.data_thread` is keeping up with incoming data.
+
+        Returns:
+            dict: with keys
+
+                * received (int) - number of items passed to :meth:`~.Subject.save_data`
+                * compacted (int) - number of items written to the hdf5 file
+                * queue_length (int) - number of items waiting in the :attr:`~.Subject.data_queue`
+                * lag (float) - seconds between receiving and writing the most recent item
+                * max_lag (float) - longest lag (s) this run
+                * throughput (float) - items written per second this run
+                * journal_bytes (int) - current size of the journal
+                * fsyncs (int) - number of times the journal has been synced to disk
+        """
+        stats = {k: v for k, v in self.journal_stats.items() if k != 'start_time'}
+        stats['queue_length'] = self.data_queue.qsize() if self.data_queue is not None else 0
+
+        if 'start_time' in self.journal_stats.keys():
+            elapsed = time.time() - self.journal_stats['start_time']
+            stats['throughput'] = stats.get('compacted', 0) / elapsed if elapsed > 0 else 0.0
+
+        if self.journal is not None:
+            stats['journal_bytes'] = self.journal.offset
+            stats['fsyncs'] = self.journal.n_fsyncs
+
+        return stats
+
+    def stop_run(self):
+        """
+        puts 'END' in the data_queue, which causes :meth:`~.Subject.data_thread` to end.
+        """
+        self.data_queue.put('END')
+        self.thread.join(5)
+        self.running = False
+        if self.thread.is_alive():
+            Warning('Data thread did not exit')
+
+    def to_csv(self, path, task='current', step='all'):
+        """
+        Export trial data to .csv
+
+        Args:
+            path (str): output path of .csv
+            task (str, int):  not implemented, but in the future pull data from 'current' or other named task
+            step (str, int, list, tuple): Step to select, see :meth:`.Subject.get_trial_data`
+        """
+        # TODO: Jonny just scratching out temporarily, doesn't have all features implemented
+        df = self.get_trial_data(step=step)
+        df['subject'] = self.name
+        df.to_csv(path)
+        print("""Subject {}
+dataframe saved to:\n {}
+========================
+N Trials:   {}
+N Sessions: {}""".format(self.name, path, df.shape[0], len(df.session.unique())))
+
+
+
+    def get_trial_data(self,
+                       step: typing.Union[int, list, str] = -1,
+                       what: str ="data",
+                       cache: bool = False):
+        """
+        Get trial data from the current task.
+
+        With ``cache=True``, each step's trial table is read through a cache of memory-mapped
+        column files, see :meth:`~.Subject.cached_trial_table`.
+
+        Args:
+            step (int, list, 'all'): Step that should be returned, can be one of
+
+                * -1: most recent step
+                * int: a single step
+                * list of two integers eg. [0, 5], an inclusive range of steps.
+                * string: the name of a step (excluding S##_)
+                * 'all': all steps.
+
+            what (str): What should be returned?
+
+                * 'data' : Dataframe of requested steps' trial data
+                * 'variables': dict of variables *without* loading data into memory
+
+            cache (bool): if True, read data from the cache, making or updating it if needed.
+
+        Returns:
+            :class:`pandas.DataFrame`: DataFrame of requested steps' trial data.
+        """
+        # step= -1 is just most recent step,
+        # step= int is an integer specified step
+        # step= [n1, n2] is from step n1 to n2 inclusive
+        # step= 'all' or anything that isn't an int or a list is all steps
+        h5f = self.open_hdf()
+        group_name = "/data/{}".format(self.protocol_name)
+        group = h5f.get_node(group_name)
+        step_groups = sorted(group._v_children.keys())
+
+        if step == -1:
             # find the last trial step with data
+            shard_steps = set(int(step_name[1:3]) for step_name in step_groups
+                              if len(self._shard_rows(step=int(step_name[1:3]), h5f=h5f)) > 0)
             for step_name in reversed(step_groups):
-                if group._v_children[step_name].trial_data.attrs['NROWS']>0:
+                if group._v_children[step_name].trial_data.attrs['NROWS']>0 or int(step_name[1:3]) in shard_steps:
                     step_groups = [step_name]
                     break
         elif isinstance(step, int):
@@ -1000,11 +1890,20 @@ N Sessions: {}""".format(self.name, path, df.shape[0], len(df.session.unique()))
             step_n = int(step_key[1:3]) # beginning of keys will be 'S##'
             step_tab = group._v_children[step_key]._v_children['trial_data']
             if what == "data":
-                step_df = pd.DataFrame(step_tab.read())
+                if cache:
+                    step_df = pd.DataFrame(self.cached_trial_table(step_tab, h5f))
+                else:
+                    step_df = pd.DataFrame(step_tab.read())
+
+                # sessions stored in their own files are small, so they're read directly
+                shard_dfs = [pd.DataFrame(rows) for rows in self._read_shards(step_tab, h5f)]
+                if len(shard_dfs) > 0:
+                    step_df = pd.concat([step_df] + shard_dfs, ignore_index=True)
+
                 step_df['step'] = step_n
                 step_df['step_name'] = step_key
                 try:
-                    return_data = return_data.append(step_df, ignore_index=True)
+                    return_data = pd.concat([return_data, step_df], ignore_index=True)
                 except NameError:
                     return_data = step_df
 
@@ -1016,6 +1915,79 @@ N Sessions: {}""".format(self.name, path, df.shape[0], len(df.session.unique()))
 
         return return_data
 
+    @property
+    def cache_dir(self):
+        """
+        Directory of the trial data cache, next to the .h5 file, see :meth:`~.Subject.cached_trial_table`
+
+        Returns:
+            str: ``{prefs.DATADIR}/{self.name}.cache``
+        """
+        return os.path.splitext(self.file)[0] + '.cache'
+
+    def cached_trial_table(self, table, h5f):
+        """
+        Get the columns of a trial table from the cache, as read-only memory maps.
+
+        Each table is written to ``{cache_dir}/{protocol}/{step}/`` as one ``.npy`` file per column,
+        with a ``meta.json`` file recording the file and path of the table, its columns, and its number of rows
+        when it was made. If any of them have changed since, the table is read again and the
+        cache is replaced. Otherwise the columns are memory-mapped, so loading is nearly instant
+        and the pages are shared between processes reading the same subject.
+
+        Trial tables are only appended to, so the number of rows is enough to tell if the cache is out of date.
+        The file's modification time isn't used since every :class:`.Subject` opened for writing changes it.
+        If rows are edited in place, call :meth:`~.Subject.clear_cache`.
+
+        The cache is written even if the subject is read-only, since it is a separate file.
+        Use :meth:`~.Subject.clear_cache` to remove it.
+
+        Args:
+            table (:class:`tables.Table`): a trial data table
+            h5f (:class:`tables.File`): the open file the table is in
+
+        Returns:
+            dict: column name: :class:`numpy.memmap`
+        """
+        step_dir = os.path.join(self.cache_dir, *table._v_parent._v_pathname.split('/')[2:])
+        meta_file = os.path.join(step_dir, 'meta.json')
+        meta = {'file': os.path.abspath(h5f.filename),
+                'path': table._v_pathname,
+                'nrows': int(table.nrows),
+                'columns': list(table.colnames)}
+
+        try:
+            with open(meta_file, 'r') as f:
+                cached_meta = json.load(f)
+        except (IOError, OSError, ValueError):
+            cached_meta = None
+
+        if cached_meta != meta:
+            os.makedirs(step_dir, exist_ok=True)
+            rows = table.read()
+            for col in table.colnames:
+                # write to a temporary file and then move it so other processes never see a partial file
+                col_file = os.path.join(step_dir, col + '.npy')
+                tmp_file = os.path.join(step_dir, '.{}.{}.npy'.format(col, os.getpid()))
+                np.save(tmp_file, np.ascontiguousarray(rows[col]))
+                os.replace(tmp_file, col_file)
+
+            # meta is written last, so it is only valid once all the columns are
+            tmp_file = os.path.join(step_dir, '.meta.{}.json'.format(os.getpid()))
+            with open(tmp_file, 'w') as f:
+                json.dump(meta, f)
+            os.replace(tmp_file, meta_file)
+
+        return {col: np.load(os.path.join(step_dir, col + '.npy'), mmap_mode='r')
+                for col in table.colnames}
+
+    def clear_cache(self):
+        """
+        Remove the trial data cache made by :meth:`~.Subject.cached_trial_table`
+        """
+        if os.path.exists(self.cache_dir):
+            shutil.rmtree(self.cache_dir)
+
     def apply_along(self, along='session', step=-1):
         h5f = self.open_hdf()
         group_name = "/data/{}".format(self.protocol_name)
@@ -1137,38 +2109,28 @@ N Sessions: {}""".format(self.name, path, df.shape[0], len(df.session.unique()))
         else:
             return datetime.datetime.now().isoformat()
 
-    def get_weight(self, which='last', include_baseline=False):
+    def get_weight(self, which='last', include_baseline=False, sessions=None, dates=None):
         """
         Gets start and stop weights.
 
-        TODO:
-            add ability to get weights by session number, dates, and ranges.
+        The weight table is indexed by session and date, so ranges are read without scanning the whole table.
 
         Args:
-            which (str):  if 'last', gets most recent weights. Otherwise returns all weights.
+            which (str):  if 'last', gets the most recent weights (by date) of those selected.
+                Otherwise returns all selected weights.
             include_baseline (bool): if True, includes baseline and minimum mass.
+            sessions (int, tuple): a session number, or an inclusive (first, last) range of sessions.
+                Either end can be None to leave it open.
+            dates (tuple): an inclusive (first, last) range of dates, as :class:`datetime.datetime` or
+                strings in the 'simple' format, %y%m%d-%H%M%S (see :meth:`~.Subject.get_timestamp`).
+                Either end can be None to leave it open.
 
         Returns:
-            dict
+            dict: columns of the weight table (`date`, `session`, `start` and `stop`), with
+            single values if `which` is 'last' (None if no weights were found), or arrays otherwise.
         """
-        # get either the last start/stop weights, optionally including baseline
-        # TODO: Get by session
-        weights = {}
-
         h5f = self.open_hdf()
-        weight_table = h5f.root.history.weights
-        if which == 'last':
-            for column in weight_table.colnames:
-                try:
-                    weights[column] = weight_table.read(-1, field=column)[0]
-                except IndexError:
-                    weights[column] = None
-        else:
-            for column in weight_table.colnames:
-                try:
-                    weights[column] = weight_table.read(field=column)
-                except IndexError:
-                    weights[column] = None
+        weights = read_weights(h5f, which=which, sessions=sessions, dates=dates)
 
         if include_baseline is True:
             try:
@@ -1186,50 +2148,91 @@ N Sessions: {}""".format(self.name, path, df.shape[0], len(df.session.unique()))
         """
         Updates an existing weight in the weight table.
 
-        TODO:
-            Yes, i know this is bad. Merge with update_weights
+        See :meth:`~.Subject.set_weights` to set many weights at once.
 
         Args:
             date (str): date in the 'simple' format, %y%m%d-%H%M%S
             col_name ('start', 'stop'): are we updating a pre-task or post-task weight?
             new_value (float): New mass.
         """
+        self.set_weights([{'date': date, col_name: new_value}], create=False)
 
-        h5f = self.open_hdf()
-        weight_table = h5f.root.history.weights
-        # there should only be one matching row since it includes seconds
-        for row in weight_table.where('date == b"{}"'.format(date)):
-            row[col_name] = new_value
-            row.update()
+    def set_weights(self, weights, create=True):
+        """
+        Set many weights at once, see :func:`.write_weights`
 
-        self.close_hdf(h5f)
+        Args:
+            weights (list): list of dicts with a `date` and any of `start`, `stop`, and `session`.
+            create (bool): if True (default), add rows for dates that aren't in the table yet.
 
+        Returns:
+            int: number of rows updated or added
+        """
+        self._check_writable()
+        h5f = self.open_hdf()
+        try:
+            n_rows = write_weights(h5f, weights, create=create)
+        finally:
+            self.close_hdf(h5f)
+        return n_rows
 
     def update_weights(self, start=None, stop=None):
         """
         Store either a starting or stopping mass.
 
         `start` and `stop` can be passed simultaneously, `start` can be given in one
-        call and `stop` in a later call, but `stop` should not be given before `start`.
+        call and `stop` in a later call. A `stop` weight is stored in the row for the current session,
+        or in a new row if no `start` was given for it.
 
         Args:
             start (float): Mass before running task in grams
             stop (float): Mass after running task in grams.
         """
+        self._check_writable()
         h5f = self.open_hdf()
-        if start is not None:
-            weight_row = h5f.root.history.weights.row
-            weight_row['date'] = self.get_timestamp(simple=True)
-            weight_row['session'] = self.session
-            weight_row['start'] = float(start)
-            weight_row.append()
-        elif stop is not None:
-            # TODO: Make this more robust - don't assume we got a start weight
-            h5f.root.history.weights.cols.stop[-1] = stop
-        else:
-            Warning("Need either a start or a stop weight")
+        try:
+            summary = h5f.root.summary._v_attrs
+            weight_table = h5f.root.history.weights
+            if start is not None:
+                weight_row = weight_table.row
+                date = self.get_timestamp(simple=True)
+                weight_row['date'] = date
+                weight_row['session'] = self.session
+                weight_row['start'] = float(start)
+                weight_row['stop'] = np.nan
+                weight_row.append()
+
+                summary['weight_date'] = date
+                summary['weight_start'] = float(start)
+                summary['weight_stop'] = np.nan
+
+            if stop is not None:
+                weight_table.flush()
+                if self.session is not None:
+                    rows = weight_table.get_where_list('session == this_session',
+                                                       condvars={'this_session': int(self.session)})
+                else:
+                    rows = np.arange(weight_table.nrows)
 
-        _ = self.close_hdf(h5f)
+                if len(rows) > 0:
+                    weight_table.cols.stop[rows[-1]] = float(stop)
+                else:
+                    weight_row = weight_table.row
+                    date = self.get_timestamp(simple=True)
+                    weight_row['date'] = date
+                    weight_row['session'] = self.session
+                    weight_row['start'] = np.nan
+                    weight_row['stop'] = float(stop)
+                    weight_row.append()
+                    summary['weight_date'] = date
+                    summary['weight_start'] = np.nan
+                summary['weight_stop'] = float(stop)
+
+            if start is None and stop is None:
+                Warning("Need either a start or a stop weight")
+
+        finally:
+            _ = self.close_hdf(h5f)
 
     def graduate(self):
         """
@@ -1244,6 +2247,27 @@ N Sessions: {}""".format(self.name, path, df.shape[0], len(df.session.unique()))
         name = self.current[step]['step_name']
         self.update_history('step', name, step)
 
+    class Session_Table(tables.IsDescription):
+        """
+        Class to describe the manifest of session files of a :attr:`~.Subject.sharded` subject
+
+        Attributes:
+            session (int): Session number
+            protocol_name (str): Protocol the session was run with
+            step (int): Step number
+            step_name (str): Step name
+            file (str): Path of the session's file, relative to the subject's file
+            start (str): Timestamp in simple format when the session started
+            n_trials (int): Number of trials stored in the session file, updated when the session ends
+        """
+        session = tables.Int32Col()
+        protocol_name = tables.StringCol(256)
+        step = tables.Int32Col()
+        step_name = tables.StringCol(256)
+        file = tables.StringCol(1024)
+        start = tables.StringCol(256)
+        n_trials = tables.Int32Col()
+
     class History_Table(tables.IsDescription):
         """
         Class to describe parameter and protocol change history
@@ -1286,3 +2310,888 @@ N Sessions: {}""".format(self.name, path, df.shape[0], len(df.session.unique()))
         time = tables.StringCol(256)
         hash = tables.StringCol(40)
 
+
+def _weight_condition(sessions=None, dates=None):
+    """
+    Make a :meth:`tables.Table.where` condition to select weights by session and date ranges
+
+    Args:
+        sessions (int, tuple): see :meth:`.Subject.get_weight`
+        dates (tuple): see :meth:`.Subject.get_weight`
+
+    Returns:
+        tuple: (condition string, or None to select all rows, condvars dict)
+    """
+    conditions = []
+    condvars = {}
+    if sessions is not None:
+        if isinstance(sessions, (int, np.integer)):
+            sessions = (sessions, sessions)
+        if sessions[0] is not None:
+            conditions.append('(session >= first_session)')
+            condvars['first_session'] = int(sessions[0])
+        if sessions[1] is not None:
+            conditions.append('(session <= last_session)')
+            condvars['last_session'] = int(sessions[1])
+
+    if dates is not None:
+        # dates in the simple format sort the same as strings as they do in time
+        dates = [d.strftime('%y%m%d-%H%M%S') if isinstance(d, datetime.datetime) else d for d in dates]
+        if dates[0] is not None:
+            conditions.append('(date >= first_date)')
+            condvars['first_date'] = str(dates[0]).encode('utf-8')
+        if dates[1] is not None:
+            conditions.append('(date <= last_date)')
+            condvars['last_date'] = str(dates[1]).encode('utf-8')
+
+    if len(conditions) == 0:
+        return None, condvars
+    return ' & '.join(conditions), condvars
+
+
+def read_weights(h5f, which='last', sessions=None, dates=None):
+    """
+    Read weights from an open subject file, see :meth:`.Subject.get_weight`
+
+    Args:
+        h5f (:class:`tables.File`): an open subject file
+        which (str): 'last' for the most recent weights of those selected, otherwise all of them.
+        sessions (int, tuple): see :meth:`.Subject.get_weight`
+        dates (tuple): see :meth:`.Subject.get_weight`
+
+    Returns:
+        dict: see :meth:`.Subject.get_weight`
+    """
+    weight_table = h5f.root.history.weights
+    condition, condvars = _weight_condition(sessions, dates)
+    if condition is None:
+        rows = weight_table.read()
+    else:
+        rows = weight_table.read_where(condition, condvars=condvars)
+
+    # dates might have been added out of order
+    rows = rows[np.argsort(rows['date'], kind='stable')]
+
+    weights = {}
+    for column in weight_table.colnames:
+        values = rows[column]
+        if column == 'date':
+            values = values.astype(str)
+        if which == 'last':
+            weights[column] = values[-1] if len(values) > 0 else None
+        else:
+            weights[column] = values
+    return weights
+
+
+def write_weights(h5f, weights, create=True):
+    """
+    Write many weights to an open subject file.
+
+    Each weight is matched to an existing row by its `date` using the table's index.
+    Values in matched rows are updated, and, if `create` is True, weights with new dates are appended.
+
+    The summary node is updated if the most recent weight changed.
+
+    Args:
+        h5f (:class:`tables.File`): a subject file opened for writing
+        weights (list): list of dicts with a `date` (str in the 'simple' format or :class:`datetime.datetime`)
+            and any of `start`, `stop`, and `session`.
+        create (bool): add rows for dates that aren't in the table.
+
+    Returns:
+        int: number of rows updated or added
+    """
+    weight_table = h5f.root.history.weights
+    columns = [col for col in weight_table.colnames if col != 'date']
+
+    n_rows = 0
+    new_rows = []
+    for weight in weights:
+        date = weight['date']
+        if isinstance(date, datetime.datetime):
+            date = date.strftime('%y%m%d-%H%M%S')
+
+        coords = weight_table.get_where_list('date == this_date',
+                                             condvars={'this_date': str(date).encode('utf-8')})
+        if len(coords) > 0:
+            for col in columns:
+                if col in weight.keys():
+                    weight_table.cols._f_col(col)[coords[-1]] = weight[col]
+            n_rows += 1
+        elif create:
+            new_row = {'date': date, 'start': np.nan, 'stop': np.nan, 'session': 0}
+            new_row.update({col: weight[col] for col in columns if col in weight.keys()})
+            new_rows.append(tuple(new_row[col] for col in weight_table.colnames))
+
+    if len(new_rows) > 0:
+        weight_table.append(new_rows)
+        n_rows += len(new_rows)
+
+    weight_table.flush()
+    _update_weight_summary(h5f)
+    return n_rows
+
+
+def _update_weight_summary(h5f):
+    """
+    Set the weight attributes of the summary node from the most recent weight.
+
+    Args:
+        h5f (:class:`tables.File`): a subject file opened for writing
+    """
+    weights = read_weights(h5f, which='last')
+    if weights['date'] is None:
+        return
+    summary = h5f.root.summary._v_attrs
+    summary['weight_date'] = str(weights['date'])
+    summary['weight_start'] = float(weights['start'])
+    summary['weight_stop'] = float(weights['stop'])
+
+
+def _bulk_weight_worker(args):
+    """
+    Read or write one subject's weights for :func:`.get_weights` and :func:`.set_weights`
+
+    Args:
+        args (tuple): (file, weights to write or None to read, kwargs for :func:`.read_weights` or :func:`.write_weights`)
+
+    Returns:
+        tuple: (file, result or the exception raised)
+    """
+    file, weights, kwargs = args
+    try:
+        # the file may be being written by a running subject, or repacked
+        with File_Lock(file):
+            if weights is None:
+                with tables.open_file(file, mode='r') as h5f:
+                    result = read_weights(h5f, **kwargs)
+                    try:
+                        baseline = float(h5f.root.info._v_attrs['baseline_mass'])
+                    except KeyError:
+                        baseline = 0.0
+                    result['baseline_mass'] = baseline
+                    result['minimum_mass'] = baseline*0.8
+            else:
+                with tables.open_file(file, mode='r+') as h5f:
+                    result = write_weights(h5f, weights, **kwargs)
+        return file, result
+    except Exception as e:
+        return file, e
+
+
+def _bulk_weights(jobs, n_procs):
+    """
+    Run jobs for :func:`._bulk_weight_worker`, in a process pool if there are many of them.
+
+    Args:
+        jobs (dict): subject ID: args for :func:`._bulk_weight_worker`
+        n_procs (int): number of processes, if None, the number of cpus. Processes are started
+            with the ``spawn`` method so they don't copy the Terminal's GUI or threads.
+
+    Returns:
+        dict: subject ID: result or the exception raised
+    """
+    names = {job[0]: name for name, job in jobs.items()}
+    if n_procs is None:
+        n_procs = mp.cpu_count()
+    n_procs = max(min(n_procs, len(jobs)), 1)
+
+    results = {}
+    if n_procs == 1:
+        for job in jobs.values():
+            file, result = _bulk_weight_worker(job)
+            results[names[file]] = result
+    else:
+        with mp.get_context('spawn').Pool(n_procs) as pool:
+            for file, result in pool.imap_unordered(_bulk_weight_worker, jobs.values()):
+                results[names[file]] = result
+    return results
+
+
+def get_weights(subjects, dir=None, which='last', sessions=None, dates=None, n_procs=None):
+    """
+    Get the weights of many subjects at once, opening each file once, read-only.
+
+    Args:
+        subjects (list): subject IDs
+        dir (str): directory of subject files, if None, `prefs.DATADIR`
+        which (str): see :meth:`.Subject.get_weight`
+        sessions (int, tuple): see :meth:`.Subject.get_weight`
+        dates (tuple): see :meth:`.Subject.get_weight`
+        n_procs (int): number of processes to read with, if None, the number of cpus.
+
+    Returns:
+        dict: subject ID: weights as returned by :meth:`.Subject.get_weight` with ``include_baseline=True``,
+        or the exception raised if they couldn't be read.
+    """
+    if dir is None:
+        dir = prefs.DATADIR
+    kwargs = {'which': which, 'sessions': sessions, 'dates': dates}
+    jobs = {name: (os.path.join(dir, name + '.h5'), None, kwargs) for name in subjects}
+    return _bulk_weights(jobs, n_procs)
+
+
+def set_weights(weights, dir=None, create=True, n_procs=None):
+    """
+    Set the weights of many subjects at once, opening each file once, see :func:`.write_weights`
+
+    Subjects must not be running.
+
+    Args:
+        weights (dict): subject ID: list of dicts with a `date` and any of `start`, `stop`, and `session`.
+        dir (str): directory of subject files, if None, `prefs.DATADIR`
+        create (bool): add rows for dates that aren't in the table.
+        n_procs (int): number of processes to write with, if None, the number of cpus.
+
+    Returns:
+        dict: subject ID: number of rows updated or added, or the exception raised if they couldn't be written.
+    """
+    if dir is None:
+        dir = prefs.DATADIR
+    jobs = {name: (os.path.join(dir, name + '.h5'), subject_weights, {'create': create})
+            for name, subject_weights in weights.items()}
+    return _bulk_weights(jobs, n_procs)
+
+
+def continuous_time(timestamp):
+    """
+    Convert a timestamp to float seconds since the epoch for the continuous data time index.
+
+    Args:
+        timestamp (float, int, str, bytes, :class:`datetime.datetime`, :class:`numpy.datetime64`):
+            numeric timestamps are assumed to already be seconds since the epoch,
+            strings are parsed as isoformatted timestamps.
+
+    Returns:
+        float
+    """
+    if isinstance(timestamp, bytes):
+        timestamp = timestamp.decode('utf-8')
+    if isinstance(timestamp, str):
+        timestamp = datetime.datetime.fromisoformat(timestamp)
+    if isinstance(timestamp, np.datetime64):
+        return float(timestamp.astype('datetime64[ns]').astype(np.int64)) / 1e9
+    if isinstance(timestamp, datetime.datetime):
+        return timestamp.timestamp()
+    return float(timestamp)
+
+
+def shard_files(h5f, protocol_name=None, step=None, session=None):
+    """
+    Get the session files of a :attr:`~.Subject.sharded` subject listed in its manifest, in session order.
+
+    Args:
+        h5f (:class:`tables.File`): an open subject file
+        protocol_name (str): only sessions from this protocol. if None, all protocols.
+        step (int): only sessions from this step. if None, all steps.
+        session (int): only this session.
+
+    Returns:
+        list: of (session, absolute path) tuples
+    """
+    try:
+        manifest = h5f.root.history.sessions
+    except tables.NoSuchNodeError:
+        # files made before sharding existed won't have a manifest
+        return []
+
+    condition = []
+    condvars = {}
+    if protocol_name is not None:
+        condition.append('(protocol_name == this_protocol)')
+        condvars['this_protocol'] = str(protocol_name).encode('utf-8')
+    if step is not None:
+        condition.append('(step == this_step)')
+        condvars['this_step'] = int(step)
+    if session is not None:
+        condition.append('(session == this_session)')
+        condvars['this_session'] = int(session)
+
+    if condition:
+        rows = manifest.read_where(' & '.join(condition), condvars=condvars)
+    else:
+        rows = manifest.read()
+
+    base_dir = os.path.dirname(os.path.abspath(h5f.filename))
+    return sorted((int(row['session']), os.path.join(base_dir, row['file'].decode('utf-8'))) for row in rows)
+
+
+def read_shards(h5f, step_tab, n_rows=None, lock=None):
+    """
+    Read the trial data of a step from its session files.
+
+    Session files that are missing (eg. because they have been archived) are skipped with a warning.
+
+    Args:
+        h5f (:class:`tables.File`): the open subject file
+        step_tab (:class:`tables.Table`): the step's trial data table in the subject's file
+        n_rows (int): only read the most recent n rows. if None, read all of them.
+        lock (:class:`threading.Lock`): held while each session file is open
+
+    Returns:
+        list: of :class:`numpy.ndarray` s of trial rows, in session order
+    """
+    if lock is None:
+        lock = contextlib.nullcontext()
+
+    step_group = step_tab._v_parent
+    protocol_name = step_group._v_parent._v_name
+    step_n = int(step_group._v_name[1:3])
+
+    # read from the most recent session back, so only as many files as needed are opened
+    rows = []
+    n_read = 0
+    for _, shard in reversed(shard_files(h5f, protocol_name=protocol_name, step=step_n)):
+        if n_rows is not None and n_read >= n_rows:
+            break
+        if not os.path.exists(shard):
+            warnings.warn('Session file {} is missing, it may have been archived'.format(shard))
+            continue
+        with lock:
+            with tables.open_file(shard, mode='r') as shard_h5f:
+                shard_tab = shard_h5f.get_node(step_tab._v_pathname)
+                start = 0 if n_rows is None else max(shard_tab.nrows - (n_rows - n_read), 0)
+                rows.append(shard_tab.read(start=start))
+        n_read += len(rows[-1])
+
+    return rows[::-1]
+
+
+def read_trials(h5f, step_tab, n_rows=None, lock=None):
+    """
+    Read the trial data of a step: the rows in the subject's file followed by those in its session files,
+    see :func:`.read_shards`
+
+    Args:
+        h5f (:class:`tables.File`): the open subject file
+        step_tab (:class:`tables.Table`): the step's trial data table in the subject's file
+        n_rows (int): only read the most recent n rows. if None, read all of them.
+        lock (:class:`threading.Lock`): held while each session file is open
+
+    Returns:
+        :class:`numpy.ndarray`: trial rows
+    """
+    shard_rows = read_shards(h5f, step_tab, n_rows=n_rows, lock=lock)
+    n_shard = sum(len(rows) for rows in shard_rows)
+
+    if n_rows is None:
+        start = 0
+    else:
+        start = max(step_tab.nrows - max(n_rows - n_shard, 0), 0)
+
+    return np.concatenate([step_tab.read(start=start)] + shard_rows)
+
+
+class File_Lock(object):
+    """
+    Advisory lock on a subject or session file, held on a ``.lock`` file next to it with :func:`fcntl.flock`
+
+    :class:`.Subject` holds a shared lock for as long as it has a file open (see :meth:`.Subject.open_hdf`),
+    and :func:`.repack.repack` holds an exclusive lock from when it copies a file until it replaces it,
+    so a file is never replaced while it is being written, and isn't written while it is being repacked.
+
+    If :mod:`fcntl` isn't available, the file doesn't exist yet, or a shared lock's ``.lock`` file
+    can't be made (eg. a read-only data directory), a shared lock does nothing.
+
+    Attributes:
+        path (str): path of the locked file
+        file (str): path to the ``.lock`` file
+        exclusive (bool): whether the lock is exclusive or shared
+        blocking (bool): whether :meth:`~.File_Lock.acquire` waits for the lock
+    """
+
+    def __init__(self, file, exclusive=False, blocking=True):
+        """
+        Args:
+            file (str): path of the .h5 file to lock
+            exclusive (bool): if True, an exclusive lock. if False (default), a shared lock.
+            blocking (bool): if True (default), wait for the lock. if False, raise :class:`BlockingIOError`
+                if it is held by someone else.
+        """
+        self.path = file
+        self.file = os.path.splitext(file)[0] + '.lock'
+        self.exclusive = exclusive
+        self.blocking = blocking
+        self._f = None
+
+    def acquire(self):
+        """
+        Acquire the lock
+
+        Raises:
+            BlockingIOError: if not :attr:`~.File_Lock.blocking` and the lock is held
+        """
+        if not FCNTL or self._f is not None:
+            return
+        if not self.exclusive and not os.path.exists(self.path):
+            return
+
+        try:
+            self._f = open(self.file, 'a')
+        except OSError:
+            if self.exclusive:
+                raise
+            return
+
+        operation = fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH
+        if not self.blocking:
+            operation |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(self._f.fileno(), operation)
+        except OSError:
+            self._f.close()
+            self._f = None
+            raise
+
+    def release(self):
+        """
+        Release the lock, if it's held
+        """
+        if self._f is None:
+            return
+        try:
+            fcntl.flock(self._f.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._f.close()
+            self._f = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class Journal(object):
+    """
+    Append-only binary journal of data dictionaries, written before they are stored in the hdf5 file.
+
+    Each record is a little-endian uint32 length followed by a pickled dict. Every record is flushed
+    to the operating system as soon as it is appended, so it survives the Terminal crashing, and
+    :func:`os.fsync` 'd to disk in batches, whenever :attr:`~.Journal.fsync_every` records
+    have been written or :attr:`~.Journal.fsync_interval` seconds have passed,
+    whichever comes first.
+
+    A record that was only partially written when a crash happened is ignored by :meth:`.Journal.read`.
+
+    Attributes:
+        file (str): path to the journal
+        offset (int): byte offset of the end of the last record written
+        n_fsyncs (int): number of times the journal has been synced to disk
+        fsync_every (int): sync after this many records...
+        fsync_interval (float): ... or after this many seconds
+    """
+    HEADER = struct.Struct('<I')
+
+    def __init__(self, file, fsync_every=50, fsync_interval=1.0):
+        """
+        Args:
+            file (str): path to the journal. created if it doesn't exist, appended to if it does.
+            fsync_every (int): sync after this many records
+            fsync_interval (float): sync after this many seconds
+        """
+        self.file = file
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+
+        self.lock = threading.Lock()
+        self._f = open(self.file, 'ab')
+        self.offset = self._f.tell()
+        self.n_fsyncs = 0
+        self._unsynced = 0
+        self._last_sync = time.time()
+
+    def append(self, data):
+        """
+        Append a record to the journal.
+
+        Args:
+            data (dict): data to journal
+
+        Returns:
+            int: byte offset of the end of this record, or None if the journal has been closed
+        """
+        record = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            if self._f.closed:
+                return None
+            self._f.write(self.HEADER.pack(len(record)))
+            self._f.write(record)
+            # out of python's buffer before the data can be stored, only the fsync is batched
+            self._f.flush()
+            self.offset += self.HEADER.size + len(record)
+            offset = self.offset
+
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every or \
+                    (time.time() - self._last_sync) >= self.fsync_interval:
+                self._sync()
+        return offset
+
+    def _sync(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self.n_fsyncs += 1
+        self._unsynced = 0
+        self._last_sync = time.time()
+
+    def close(self):
+        """
+        Sync and close the journal file.
+        """
+        with self.lock:
+            if not self._f.closed:
+                self._sync()
+                self._f.close()
+
+    def truncate(self):
+        """
+        Discard all records in the journal, closing it if it is still open.
+        """
+        self.close()
+        with self.lock:
+            with open(self.file, 'wb'):
+                pass
+            self.offset = 0
+
+    @classmethod
+    def read(cls, file, start=0):
+        """
+        Iterate over the records in a journal.
+
+        Args:
+            file (str): path to the journal
+            start (int): byte offset to start reading from
+
+        Yields:
+            tuple: (data, offset) - the journaled dict, and the byte offset of the end of its record
+        """
+        with open(file, 'rb') as f:
+            f.seek(start)
+            offset = start
+            while True:
+                header = f.read(cls.HEADER.size)
+                if len(header) < cls.HEADER.size:
+                    break
+                length = cls.HEADER.unpack(header)[0]
+                record = f.read(length)
+                if len(record) < length:
+                    # incomplete record from a crash
+                    break
+                offset += cls.HEADER.size + length
+                yield pickle.loads(record), offset
+
+
+class Subject_Writer(mp.get_context('spawn').Process):
+    """
+    A single process that owns every open :class:`.Subject` and stores their data,
+    so hdf5 writes don't compete with the Terminal's GUI and networking for the GIL
+    or the hdf5 library's lock.
+
+    The process is started with the ``spawn`` method rather than forked, since forking the Terminal
+    would copy its Qt state and running threads. The parent's prefs are copied to it.
+
+    The Terminal gets a :class:`.Subject_Proxy` for each subject with :meth:`.Subject_Writer.subject`
+    and uses it as if it were a :class:`.Subject`. Data is sent to the process with
+    :meth:`.Subject_Writer.save_data` without waiting for a reply, and every other method or attribute
+    is a blocking call with :meth:`.Subject_Writer.call` or :meth:`.Subject_Writer.get`.
+
+    Both go through the same :attr:`~.Subject_Writer.cmd_q` so data and calls like
+    :meth:`.Subject.stop_run` are handled in the order they were sent. The process
+    takes up to :attr:`~.Subject_Writer.batch_size` messages from the queue at a time,
+    which only batches reading the queue: each running subject still stores its data in its own
+    :meth:`~.Subject.data_thread`, now in the writer process, and commits its trials on its own.
+
+    Must call :meth:`~.Subject_Writer.start` after initialization, and :meth:`~.Subject_Writer.stop`
+    to stop any running subjects and end the process.
+
+    Attributes:
+        cmd_q (:class:`multiprocessing.Queue`): data and method calls for the writer process
+        reply_q (:class:`multiprocessing.Queue`): results of method calls
+        event_q (:class:`multiprocessing.Queue`): events from the writer process, currently just graduation.
+        batch_size (int): maximum number of messages handled per batch
+        proxies (dict): :class:`.Subject_Proxy` objects made by :meth:`~.Subject_Writer.subject`
+        prefs (dict): prefs to set in the writer process, the parent's prefs that can be pickled
+    """
+
+    def __init__(self, batch_size=256):
+        """
+        Args:
+            batch_size (int): maximum number of messages to take from the queue at a time.
+        """
+        super(Subject_Writer, self).__init__()
+        self.daemon = True
+
+        ctx = mp.get_context('spawn')
+        self.cmd_q = ctx.Queue()
+        self.reply_q = ctx.Queue()
+        self.event_q = ctx.Queue()
+        self.batch_size = batch_size
+
+        # a spawned process starts with fresh prefs
+        self.prefs = {}
+        for key, value in prefs.prefdict.items():
+            try:
+                pickle.dumps(value)
+            except Exception:
+                continue
+            self.prefs[key] = value
+
+        self.proxies = {}
+        self.call_lock = threading.Lock()
+        self.call_id = itertools.count()
+        self.event_thread = None
+
+    def __getstate__(self):
+        # proxies, locks, and threads only live in the Terminal's process
+        state = self.__dict__.copy()
+        for key in ('proxies', 'call_lock', 'call_id', 'event_thread'):
+            state[key] = None
+        return state
+
+    def start(self):
+        """
+        Start the writer process, and a thread in this process to listen for events from it.
+        """
+        super(Subject_Writer, self).start()
+        self.event_thread = threading.Thread(target=self._listen_events)
+        self.event_thread.daemon = True
+        self.event_thread.start()
+
+    def subject(self, name):
+        """
+        Get a :class:`.Subject_Proxy` for a subject, which is opened in the writer process.
+
+        Args:
+            name (str): subject ID
+
+        Returns:
+            :class:`.Subject_Proxy`
+        """
+        if name not in self.proxies.keys():
+            self.proxies[name] = Subject_Proxy(name, self)
+        return self.proxies[name]
+
+    def save_data(self, name, data):
+        """
+        Send data to a running subject without waiting for it to be stored.
+
+        Args:
+            name (str): subject ID
+            data (dict): data, as in :meth:`.Subject.save_data`
+        """
+        self.cmd_q.put(('DATA', name, data))
+
+    def call(self, name, method, *args, **kwargs):
+        """
+        Call a method of a subject in the writer process and wait for its result.
+
+        Args:
+            name (str): subject ID
+            method (str): name of method
+            *args: the method's args
+            **kwargs: the method's kwargs
+
+        Returns:
+            The method's return value.
+
+        Raises:
+            Whatever exception was raised in the writer process
+        """
+        return self._request('CALL', name, method, args, kwargs)
+
+    def get(self, name, attr):
+        """
+        Get an attribute of a subject in the writer process.
+
+        Args:
+            name (str): subject ID
+            attr (str): name of attribute
+
+        Returns:
+            The attribute's value, or :data:`.Subject_Writer.METHOD` if the attribute is a method.
+        """
+        return self._request('GET', name, attr, (), {})
+
+    METHOD = '__method__'
+    """
+    Returned by :meth:`.Subject_Writer.get` in place of methods, which can't be sent between processes.
+    """
+
+    def _request(self, kind, name, attr, args, kwargs):
+        with self.call_lock:
+            call_id = next(self.call_id)
+            self.cmd_q.put((kind, call_id, name, attr, args, kwargs))
+            while True:
+                try:
+                    reply_id, ok, result = self.reply_q.get(timeout=1)
+                except queue.Empty:
+                    # don't wait forever for a process that has died
+                    if not self.is_alive():
+                        raise RuntimeError('Subject writer process has stopped, could not get {} of subject {}'.format(
+                            attr, name))
+                    continue
+                if reply_id == call_id:
+                    break
+
+        if not ok:
+            raise result
+        return result
+
+    def reload(self, name):
+        """
+        Close a subject in the writer process so it is opened again the next time it is used,
+        eg. after its file was changed by :func:`~.reassign.reassign`. Running subjects are left open.
+
+        Args:
+            name (str): subject ID
+        """
+        self.cmd_q.put(('RELOAD', name))
+
+    def stop(self, timeout=5):
+        """
+        Stop any running subjects and end the writer process.
+
+        Args:
+            timeout (float): seconds to wait for the process to end.
+        """
+        self.cmd_q.put(('END',))
+        self.join(timeout)
+
+    def _listen_events(self):
+        for event, name in iter(self.event_q.get, 'END'):
+            if event == 'GRADUATED' and name in self.proxies.keys():
+                self.proxies[name].did_graduate.set()
+
+    def run(self):
+        """
+        Take batches of messages from :attr:`~.Subject_Writer.cmd_q` and handle them until ``'END'`` is received.
+
+        Should not be called by itself, overwrites the :meth:`multiprocessing.Process.run` method,
+        so should call :meth:`Subject_Writer.start`
+        """
+        for key, value in self.prefs.items():
+            prefs.add(key, value)
+
+        subjects = {}
+        graduated = set()
+        running = True
+
+        while running:
+            try:
+                batch = [self.cmd_q.get(timeout=0.1)]
+            except queue.Empty:
+                batch = []
+
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.cmd_q.get_nowait())
+                except queue.Empty:
+                    break
+
+            for msg in batch:
+                if msg[0] == 'DATA':
+                    _, name, data = msg
+                    try:
+                        subjects[name].save_data(data)
+                    except (KeyError, AttributeError) as e:
+                        warnings.warn('Got data for subject {}, but it is not running: {}'.format(name, e))
+
+                elif msg[0] in ('CALL', 'GET'):
+                    kind, call_id, name, attr, args, kwargs = msg
+                    try:
+                        if name not in subjects.keys():
+                            subjects[name] = Subject(name)
+                        result = getattr(subjects[name], attr)
+                        if kind == 'CALL':
+                            result = result(*args, **kwargs)
+                        elif callable(result):
+                            result = self.METHOD
+                        # make sure we can send it back before we try
+                        pickle.dumps(result)
+                        self.reply_q.put((call_id, True, result))
+                    except Exception as e:
+                        # the exception has to be sent back too
+                        try:
+                            pickle.dumps(e)
+                        except Exception:
+                            e = RuntimeError(repr(e))
+                        self.reply_q.put((call_id, False, e))
+
+                elif msg[0] == 'RELOAD':
+                    _, name = msg
+                    if name in subjects.keys() and not subjects[name].running:
+                        del subjects[name]
+
+                elif msg[0] == 'END':
+                    running = False
+
+            # let the Terminal know when anyone graduates
+            for name, subject in subjects.items():
+                if subject.running and subject.did_graduate.is_set():
+                    if name not in graduated:
+                        self.event_q.put(('GRADUATED', name))
+                        graduated.add(name)
+                else:
+                    graduated.discard(name)
+
+        for subject in subjects.values():
+            if subject.running:
+                subject.stop_run()
+        self.event_q.put('END')
+
+
+class Subject_Proxy(object):
+    """
+    Stands in for a :class:`.Subject` that is open in a :class:`.Subject_Writer` process.
+
+    :meth:`~.Subject_Proxy.save_data` doesn't wait for a reply, and :attr:`~.Subject_Proxy.did_graduate`
+    is set by the writer when the subject graduates. Every other attribute and method
+    is forwarded to the subject in the writer process.
+
+    Note:
+        Attributes are copies sent from the writer process, so changing them (eg. appending to
+        ``proxy.current``) does not change the subject. Use the subject's methods instead,
+        eg. :meth:`~.Subject.update_history` or :meth:`~.Subject.assign_protocol`.
+
+    Attributes:
+        name (str): subject ID
+        writer (:class:`.Subject_Writer`): the process that the subject is open in
+        did_graduate (:class:`threading.Event`): set when the subject graduates the current step
+    """
+    def __init__(self, name, writer):
+        """
+        Args:
+            name (str): subject ID
+            writer (:class:`.Subject_Writer`): the process that the subject is open in
+        """
+        self.name = name
+        self.writer = writer
+        self.did_graduate = threading.Event()
+
+    def save_data(self, data):
+        """
+        See :meth:`.Subject.save_data`
+        """
+        self.writer.save_data(self.name, data)
+
+    def prepare_run(self):
+        """
+        See :meth:`.Subject.prepare_run`
+        """
+        self.did_graduate.clear()
+        return self.writer.call(self.name, 'prepare_run')
+
+    def __getattr__(self, item):
+        if item.startswith('_'):
+            raise AttributeError(item)
+
+        value = self.writer.get(self.name, item)
+        if isinstance(value, str) and value == Subject_Writer.METHOD:
+            def method(*args, **kwargs):
+                return self.writer.call(self.name, item, *args, **kwargs)
+            method.__name__ = item
+            return method
+        return value
@@ -40,7 +40,8 @@ if __name__ == '__main__':
 
 
 
-from autopilot.core.subject import Subject
+from autopilot.core.subject import Subject, Subject_Writer, get_weights
+from autopilot.core.reassign import reassign, format_results
 from autopilot.core.plots import Plot_Widget
 from autopilot.core.networking import Terminal_Station, Net_Node
 from autopilot.core.utils import InvokeEvent, Invoker
@@ -79,17 +80,19 @@ class Terminal(QtWidgets.QMainWindow):
 
     **Listens used by the internal :class:`.Net_Node` **
 
-    +---------------+--------------------------------+--------------------------------------------------------+
-    | Key           | Method                         | Description                                            |
-    +===============+================================+========================================================+
-    | `'STATE'`     | :meth:`~.Terminal.l_state`     | A Pi has changed state                                 |
-    +---------------+--------------------------------+--------------------------------------------------------+
-    | `'PING'`      | :meth:`~.Terminal.l_ping`      |  Someone wants to know if we're alive                  |
-    +---------------+--------------------------------+--------------------------------------------------------+
-    | `'DATA'`      | :meth:`~.Terminal.l_data`      | Receiving data to store                                |
-    +---------------+--------------------------------+--------------------------------------------------------+
-    | `'HANDSHAKE'` | :meth:`~.Terminal.l_handshake` | Pilot first contact, telling us it's alive and its IP  |
-    +---------------+--------------------------------+--------------------------------------------------------+
+    +-----------------+----------------------------------+--------------------------------------------------------+
+    | Key             | Method                           | Description                                            |
+    +=================+==================================+========================================================+
+    | `'STATE'`       | :meth:`~.Terminal.l_state`       | A Pi has changed state                                 |
+    +-----------------+----------------------------------+--------------------------------------------------------+
+    | `'PING'`        | :meth:`~.Terminal.l_ping`        |  Someone wants to know if we're alive                  |
+    +-----------------+----------------------------------+--------------------------------------------------------+
+    | `'DATA'`        | :meth:`~.Terminal.l_data`        | Receiving data to store                                |
+    +-----------------+----------------------------------+--------------------------------------------------------+
+    | `'HANDSHAKE'`   | :meth:`~.Terminal.l_handshake`   | Pilot first contact, telling us it's alive and its IP  |
+    +-----------------+----------------------------------+--------------------------------------------------------+
+    | `'COHERE_DATA'` | :meth:`~.Terminal.l_cohere_data` | Trials a Pilot had that we didn't receive              |
+    +-----------------+----------------------------------+--------------------------------------------------------+
 
     ** Prefs needed by Terminal **
     Typically set by :mod:`.setup.setup_terminal`
@@ -102,11 +105,14 @@ class Terminal(QtWidgets.QMainWindow):
     * **LOGDIR** - `os.path.join(params['BASEDIR'], 'logs')`
     * **REPODIR** - Path to autopilot git repo
     * **PILOT_DB** - Location of `pilot_db.json` used to populate :attr:`~.Terminal.pilots`
+    * **WRITER_PROCESS** - (optional) if True, subject files are opened and written in a :class:`~.subject.Subject_Writer` process
 
     Attributes:
         node (:class:`~.networking.Net_Node`): Our Net_Node we use to communicate with our main networking object
         networking (:class:`~.networking.Terminal_Station`): Our networking object to communicate with the outside world
         subjects (dict): A dictionary mapping subject ID to :class:`~.subject.Subject` object.
+        writer (:class:`~.subject.Subject_Writer`): if ``prefs.WRITER_PROCESS`` is True, process that
+            all subject files are opened and written in.
         pilots (dict): A dictionary mapping pilot ID to a list of its subjects, its IP, and any other pilot attributes.
         layout (:class:`QtWidgets.QGridLayout`): Layout used to organize widgets
         control_panel (:class:`~.gui.Control_Panel`): Control Panel to manage pilots and subjects
@@ -132,6 +138,7 @@ class Terminal(QtWidgets.QMainWindow):
         # data
         self.subjects = {}  # Dict of our open subject objects
         self.pilots = None
+        self.writer = None # Subject_Writer process, if prefs.WRITER_PROCESS
 
         # gui
         self.layout = None
@@ -163,9 +170,16 @@ class Terminal(QtWidgets.QMainWindow):
             'DATA' : self.l_data,
             'CONTINUOUS': self.l_data, # handle continuous data same way as other data
             'STREAM': self.l_data,
-            'HANDSHAKE': self.l_handshake # a pi is making first contact, telling us its IP
+            'HANDSHAKE': self.l_handshake, # a pi is making first contact, telling us its IP
+            'COHERE_DATA': self.l_cohere_data # a pi is sending trials we missed during a run
         }
 
+        # Store subject data in its own process so big writes don't block the GUI
+        if getattr(prefs, 'WRITER_PROCESS', False):
+            self.writer = Subject_Writer()
+            self.writer.start()
+            self.logger.info('Subject writer process started')
+
         # Make invoker object to send GUI events back to the main thread
         self.invoker = Invoker()
         prefs.add('INVOKER', self.invoker)
@@ -442,7 +456,7 @@ class Terminal(QtWidgets.QMainWindow):
             if ok:
                 # Ope'nr up if she aint
                 if subject not in self.subjects.keys():
-                    self.subjects[subject] = Subject(subject)
+                    self.subjects[subject] = self.open_subject(subject)
 
                 task = self.subjects[subject].prepare_run()
                 task['pilot'] = pilot
@@ -474,6 +488,14 @@ class Terminal(QtWidgets.QMainWindow):
 
                 self.subjects[subject].stop_run()
                 self.subjects[subject].update_weights(stop=float(stop_weight))
+                self.logger.info('{} data storage stats: {}'.format(subject, self.subjects[subject].get_journal_stats()))
+
+                # tell the pilot which trials we got so it can send any we're missing
+                self.node.send(to=pilot, key="COHERE", value={
+                    'subject': subject,
+                    'session': int(self.subjects[subject].session),
+                    'ranges': self.subjects[subject].get_trial_ranges()
+                })
 
             else:
                 # pressed cancel
@@ -509,6 +531,24 @@ class Terminal(QtWidgets.QMainWindow):
 
             self.node.send(to=value['pilot'], key="START", value=task)
 
+    def l_cohere_data(self, value):
+        """
+        A Pilot has sent the trials that we didn't receive while it was running,
+        in response to the ``COHERE`` message sent when it was stopped.
+
+        Args:
+            value (dict): 'subject', 'session', 'step' - the step the trials were run on,
+                and 'trials' - a structured array of trial rows
+        """
+        subject_name = value['subject']
+        if subject_name not in self.subjects.keys():
+            self.subjects[subject_name] = self.open_subject(subject_name)
+
+        n_stored = self.subjects[subject_name].save_missing_trials(
+            value['trials'], session=value['session'], step=value.get('step'))
+        self.logger.info('Recovered {} trials for {} session {} from {}'.format(
+            n_stored, subject_name, value['session'], value['pilot']))
+
     def l_ping(self, value):
         """
         TODO:
@@ -646,6 +686,22 @@ class Terminal(QtWidgets.QMainWindow):
                 with open(protocol_file, 'w') as pfile_open:
                     json.dump(save_steps, pfile_open, indent=4, separators=(',', ': '), sort_keys=True)
 
+    def open_subject(self, subject):
+        """
+        Open a subject, either directly as a :class:`.Subject` or, if
+        ``prefs.WRITER_PROCESS`` is True, as a :class:`.Subject_Proxy` in the :attr:`.Terminal.writer` process.
+
+        Args:
+            subject (str): subject ID
+
+        Returns:
+            :class:`.Subject` or :class:`.Subject_Proxy`
+        """
+        if self.writer is not None:
+            return self.writer.subject(subject)
+        else:
+            return Subject(subject)
+
     @property
     def subject_list(self):
         """
@@ -670,15 +726,19 @@ class Terminal(QtWidgets.QMainWindow):
         """
         subjects = self.subject_list
 
-        # open objects if not already
-        for subject in subjects:
-            if subject not in self.subjects.keys():
-                self.subjects[subject] = Subject(subject)
+        # read every subject's file once, except running subjects, whose files are already open.
+        # in this process, since there are only a few small reads and forking the GUI isn't safe
+        running = [subject for subject in subjects if self.subject_running(subject)]
+        subject_weights = get_weights([subject for subject in subjects if subject not in running], n_procs=1)
+        for subject in running:
+            subject_weights[subject] = self.subjects[subject].get_weight(include_baseline=True)
 
-        # for each subject, get weight
         weights = []
         for subject in subjects:
-            weight = self.subjects[subject].get_weight(include_baseline=True)
+            weight = subject_weights[subject]
+            if isinstance(weight, Exception):
+                self.logger.warning('Could not get weights for {}: {}'.format(subject, weight))
+                continue
             weight['subject'] = subject
             weights.append(weight)
 
@@ -688,30 +748,50 @@ class Terminal(QtWidgets.QMainWindow):
     def update_protocols(self):
         """
         If we change the protocol file, update the stored version in subject files
+
+        Subjects are updated with :func:`~.reassign.reassign` in this process (forking the GUI isn't safe), skipping any that are running.
         """
-        #
-        # get list of protocol files
-        protocols = os.listdir(prefs.PROTOCOLDIR)
-        protocols = [p for p in protocols if p.endswith('.json')]
+        subjects = [subject for subject in self.subject_list if not self.subject_running(subject)]
+        results = reassign({subject: (None, None) for subject in subjects}, n_procs=1)
 
         updated_subjects = []
-        subjects = self.subject_list
-        for subject in subjects:
-            if subject not in self.subjects.keys():
-                self.subjects[subject] = Subject(subject)
-
-            protocol_bool = [self.subjects[subject].protocol_name == os.path.splitext(p)[0] for p in protocols]
-            if any(protocol_bool):
-                which_prot = np.where(protocol_bool)[0][0]
-                protocol = protocols[which_prot]
-                self.subjects[subject].assign_protocol(os.path.join(prefs.PROTOCOLDIR, protocol), step_n=self.subjects[subject].step)
+        for subject, changes in results.items():
+            if isinstance(changes, Exception):
+                self.logger.warning('Could not update protocol for {}: {}'.format(subject, changes))
+            elif changes:
                 updated_subjects.append(subject)
+                self.reload_subject(subject)
+        self.logger.info('Updated protocols:\n{}'.format(format_results(results)))
 
         msgbox = QtWidgets.QMessageBox()
         msgbox.setText("Subject Protocols Updated for:")
         msgbox.setDetailedText("\n".join(sorted(updated_subjects)))
         msgbox.exec_()
 
+    def subject_running(self, subject):
+        """
+        Check if a subject is open and running
+
+        Args:
+            subject (str): subject ID
+
+        Returns:
+            bool
+        """
+        return subject in self.subjects.keys() and self.subjects[subject].running
+
+    def reload_subject(self, subject):
+        """
+        Drop a subject's open :class:`.Subject` object so it is reopened from its file
+        the next time it is used, eg. after its protocol is changed with :func:`~.reassign.reassign`
+
+        Args:
+            subject (str): subject ID
+        """
+        self.subjects.pop(subject, None)
+        if self.writer is not None:
+            self.writer.reload(subject)
+
     @property
     def protocols(self):
         """
@@ -735,7 +815,7 @@ class Terminal(QtWidgets.QMainWindow):
         subjects_protocols = {}
         for subject in subjects:
             if subject not in self.subjects.keys():
-                self.subjects[subject] = Subject(subject)
+                self.subjects[subject] = self.open_subject(subject)
 
             subjects_protocols[subject] = [self.subjects[subject].protocol_name, self.subjects[subject].step]
 
@@ -747,7 +827,8 @@ class Terminal(QtWidgets.QMainWindow):
         Batch reassign protocols and steps.
 
         Opens a :class:`.gui.Reassign` window after getting protocol data,
-        and applies any changes made in the window.
+        and applies any changes made in the window to every subject at once with :func:`~.reassign.reassign`.
+        Subjects whose protocol file has been edited are also updated from it.
         """
 
 
@@ -757,25 +838,20 @@ class Terminal(QtWidgets.QMainWindow):
         if reassign_window.result() == 1:
             subject_protocols = reassign_window.subjects
 
+            assignments = {}
             for subject, protocol in subject_protocols.items():
-                step = protocol[1]
-                protocol = protocol[0]
-
-                # since assign_protocol also changes the step, stash the step number here to tell if it's changed
-                subject_orig_step = self.subjects[subject].step
-
-
-
-                if self.subjects[subject].protocol_name != protocol:
-                    self.logger.info('Setting {} protocol from {} to {}'.format(subject, self.subjects[subject].protocol_name, protocol))
-                    protocol_file = os.path.join(prefs.PROTOCOLDIR, protocol + '.json')
-                    self.subjects[subject].assign_protocol(protocol_file, step)
-
-                if subject_orig_step != step:
-                    self.logger.info('Setting {} step from {} to {}'.format(subject, subject_orig_step, step))
-                    step_name = self.subjects[subject].current[step]['step_name']
-                    #update history also flushes current - aka it also actually changes the step number
-                    self.subjects[subject].update_history('step', step_name, step)
+                if self.subject_running(subject):
+                    self.logger.warning('{} is running, not reassigning protocol'.format(subject))
+                    continue
+                assignments[subject] = (protocol[0], protocol[1])
+
+            results = reassign(assignments, n_procs=1)
+            for subject, changes in results.items():
+                if isinstance(changes, Exception):
+                    self.logger.warning('Could not reassign {}: {}'.format(subject, changes))
+                elif changes:
+                    self.reload_subject(subject)
+            self.logger.info('Reassigned protocols:\n{}'.format(format_results(results)))
 
     def calibrate_ports(self):
         """
@@ -890,9 +966,12 @@ class Terminal(QtWidgets.QMainWindow):
         # TODO: Check if any subjects are currently running, pop dialog asking if we want to stop
 
         # Close all subjects files
-        for m in self.subjects.values():
-            if m.running is True:
-                m.stop_run()
+        if self.writer is not None:
+            self.writer.stop()
+        else:
+            for m in self.subjects.values():
+                if m.running is True:
+                    m.stop_run()
 
         # Stop networking
         # send message to kill networking process
@@ -14,6 +14,7 @@ from scipy.stats import linregress
 # from subprocess import call
 from threading import Thread
 import os
+import warnings
 import numpy as np
 
 class Param(object):
@@ -214,6 +215,215 @@ def coerce_discrete(df, col, mapping={'L':0, 'R':1}):
     return df
 
 
+def to_ranges(values):
+    """
+    Compress a collection of integers (eg. trial numbers) into a list of inclusive ranges.
+
+    Examples:
+        to_ranges([0, 1, 2, 5, 6, 9]) == [[0, 2], [5, 6], [9, 9]]
+
+    Args:
+        values (iterable): integers, in any order, duplicates are ignored.
+
+    Returns:
+        list: list of [start, stop] lists, inclusive.
+    """
+    values = np.unique(np.asarray(values, dtype=np.int64))
+    if len(values) == 0:
+        return []
+
+    # split wherever consecutive values aren't adjacent
+    breaks = np.where(np.diff(values) > 1)[0]
+    starts = np.concatenate(([values[0]], values[breaks + 1]))
+    stops = np.concatenate((values[breaks], [values[-1]]))
+    return [[int(start), int(stop)] for start, stop in zip(starts, stops)]
+
+
+def in_ranges(values, ranges):
+    """
+    Check which values fall within a list of inclusive ranges, as made by :func:`.to_ranges`
+
+    Args:
+        values (:class:`numpy.ndarray`): integers to check
+        ranges (list): list of [start, stop] lists, inclusive.
+
+    Returns:
+        :class:`numpy.ndarray`: boolean array, True where a value is in any of the ranges.
+    """
+    values = np.asarray(values)
+    mask = np.zeros(values.shape, dtype=bool)
+    for start, stop in ranges:
+        mask |= (values >= start) & (values <= stop)
+    return mask
+
+
+class Row_Writer(object):
+    """
+    Fills rows of a :class:`tables.Table` from data dictionaries, buffering them in a
+    numpy structured array that is appended to the table in bulk.
+
+    The table's description is compiled once into a mapping from data keys to columns,
+    each with a function that coerces incoming values to the column's type, so
+    storing a dictionary doesn't need to check each key against the table's columns.
+    Keys that aren't columns are warned about once, the first time they are seen.
+
+    Attributes:
+        table (:class:`tables.Table`): the table rows are written to
+        buffer (:class:`numpy.ndarray`): structured array of rows that haven't been appended to the table yet,
+            the row being filled is ``buffer[n]``
+        n (int): number of complete rows in the buffer
+        setters (dict): key: (column name, coercion function)
+        unknown (set): keys that have been received that aren't columns
+        ignore (set): keys that aren't columns, but shouldn't be warned about
+    """
+
+    IGNORE = ('TRIAL_END', 'pilot', 'subject', 'continuous')
+    """
+    tuple: keys that are sent along with trial data but are never stored
+    """
+
+    def __init__(self, table, buffer_size=256, ignore=None):
+        """
+        Args:
+            table (:class:`tables.Table`): the table to write to
+            buffer_size (int): number of rows to buffer before appending them to the table
+            ignore (iterable): keys that aren't columns and shouldn't be warned about,
+                in addition to :attr:`.Row_Writer.IGNORE`
+        """
+        self.table = table
+        self.buffer_size = int(buffer_size)
+        self.ignore = set(self.IGNORE)
+        if ignore is not None:
+            self.ignore.update(ignore)
+        self.unknown = set()
+
+        # a row of the table's default values, used to clear each new row
+        self.defaults = np.array([tuple(table.description._v_dflts[name] for name in table.dtype.names)],
+                                 dtype=table.dtype)[0]
+        self.buffer = np.zeros(self.buffer_size + 1, dtype=table.dtype)
+        self.buffer[0] = self.defaults
+        self.n = 0
+        self.filled = False
+
+        self.setters = {name: (name, self._coercer(table.coldtypes[name])) for name in table.colnames}
+
+    @staticmethod
+    def _coercer(dtype):
+        """
+        Make a function to coerce values to a column's type.
+
+        Args:
+            dtype (:class:`numpy.dtype`): column type
+
+        Returns:
+            callable
+        """
+        if dtype.shape != ():
+            return lambda value: np.asarray(value, dtype=dtype.base)
+        if dtype.kind == 'S':
+            def coerce(value):
+                if isinstance(value, str):
+                    return value.encode('utf-8')
+                return value
+            return coerce
+        if dtype.kind == 'b':
+            return bool
+        if dtype.kind in 'iu':
+            return int
+        if dtype.kind == 'f':
+            return float
+        return lambda value: value
+
+    def update(self, data):
+        """
+        Store values from a data dictionary in the current row.
+
+        Args:
+            data (dict): data, only keys that are columns of the table are stored.
+
+        Returns:
+            bool: True if any values were stored.
+        """
+        row = self.buffer[self.n]
+        stored = False
+        for key, value in data.items():
+            try:
+                name, coerce = self.setters[key]
+            except KeyError:
+                if key not in self.unknown and key not in self.ignore:
+                    self.unknown.add(key)
+                    warnings.warn('Got data with key {}, which is not a column of {}, not storing it'.format(
+                        key, self.table._v_pathname))
+                continue
+
+            try:
+                row[name] = coerce(value)
+                stored = True
+            except (ValueError, TypeError) as e:
+                warnings.warn('Data dropped: key: {}, value: {}, {}'.format(key, value, e))
+
+        self.filled = self.filled or stored
+        return stored
+
+    def __getitem__(self, key):
+        """
+        Get a value from the current row.
+
+        Args:
+            key (str): column name
+        """
+        return self.buffer[self.n][key]
+
+    def __setitem__(self, key, value):
+        """
+        Set a value in the current row, without coercion.
+
+        Args:
+            key (str): column name
+            value: value
+        """
+        self.buffer[self.n][key] = value
+        self.filled = True
+
+    def __contains__(self, key):
+        return key in self.setters
+
+    def as_dict(self):
+        """
+        Returns:
+            dict: the current row as a dictionary
+        """
+        return dict(zip(self.buffer.dtype.names, self.buffer[self.n].item()))
+
+    def append(self):
+        """
+        Finish the current row and start a new one.
+        Rows are appended to the table when the buffer is full.
+        """
+        self.n += 1
+        self.buffer[self.n] = self.defaults
+        self.filled = False
+        if self.n >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Append buffered rows to the table and flush it.
+        The row being filled is kept.
+
+        Returns:
+            int: number of rows appended.
+        """
+        n = self.n
+        if n > 0:
+            self.table.append(self.buffer[:n])
+            self.buffer[0] = self.buffer[n]
+            self.buffer[1:n+1] = self.defaults
+            self.n = 0
+        self.table.flush()
+        return n
+
+
 def find_recursive(key, dictionary):
     """
     Find all instances of a key in a dictionary, recursively.
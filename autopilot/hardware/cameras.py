@@ -2,9 +2,7 @@ import threading
 from subprocess import Popen, PIPE
 import sys
 import os
-import csv
-from skvideo import io
-from skvideo.utils import vshape
+import json
 import numpy as np
 import base64
 from datetime import datetime
@@ -19,6 +17,7 @@ import warnings
 import subprocess
 import logging
 from ctypes import c_char_p
+from collections import deque
 
 
 
@@ -44,6 +43,13 @@ try:
 except:
     OPENCV = False
 
+try:
+    # python >= 3.8
+    from multiprocessing import shared_memory
+    SHARED_MEMORY = True
+except ImportError:
+    SHARED_MEMORY = False
+
 from autopilot import prefs
 from autopilot.hardware import Hardware
 
@@ -59,6 +65,23 @@ The workaround seems to be relatively simple, we just wait ~2 seconds if another
 """
 LAST_INIT_LOCK = mp.Lock()
 
+GRAY_WEIGHTS = (29, 150, 77)
+"""
+Integer weights (out of 256) of the blue, green, and red channels used to convert frames to grayscale
+when OpenCV isn't available, see :func:`.to_grayscale`
+"""
+
+INTERVAL_BINS = (0, 1, 2, 5, 10, 20, 33, 50, 100, 200, 500, 1000, np.inf)
+"""
+Edges (ms) of the histogram of inter-frame intervals kept by :class:`.Frame_Metrics`
+"""
+
+GRAB_BACKOFF = (0.005, 0.5)
+"""
+(min, max) seconds that :meth:`.Camera_CV._grab_frames` waits after ``cam.grab()`` fails before trying again,
+doubling with each consecutive failure
+"""
+
 class Camera(Hardware):
     """
     Metaclass for Camera objects. Should not be instantiated on its own.
@@ -85,6 +108,7 @@ class Camera(Hardware):
 
     The other methods are optional and depend on the particular camera:
 
+        * :meth:`~.Camera._apply_roi` - *optional* - crop and decimate frames on the camera rather than in software
         * :meth:`~.Camera.capture_init` - *optional* - any required routine to prepare the camera after it is instantiated but before it begins to capture
         * :meth:`~.Camera._process` - *optional* - the wrapper around a full acquisition cycle, including streaming, writing, and queueing frames
         * :meth:`~.Camera._write_frame` - *optional* - how to write an individual frame to disk
@@ -93,13 +117,23 @@ class Camera(Hardware):
 
     Attributes:
         frame (tuple): The current captured frame as a tuple (timestamp, frame).
+        frame_time (float): :func:`time.monotonic` time that the current frame was grabbed, a clock
+            that is shared by all cameras on the same computer, see :class:`.Camera_Group`
+        frame_seq (int): the camera's sequence number for the current frame, if it has them, used to count dropped frames
+        crop (tuple): region of interest, (x, y of top left corner, width, height) in full resolution pixels
+        decimate (int): keep every nth row and column of each frame
+        grayscale (bool): convert color frames to grayscale
+        metrics (:class:`.Frame_Metrics`): acquisition metrics for the current capture
         shape (tuple): Shape of captured frames (height, width, channels)
         blosc (bool): If True (default), use blosc compression when
         cam: The object used to interact with the camera
         fps (int): Framerate of video capture
         timed (bool, int, float): If False (default), camera captures indefinitely. If int or float, captures for this many seconds
-        q (Queue): Queue that allows frames to be pulled by other objects
+        q (:class:`.Frame_Queue`): Queue that allows frames to be pulled by other objects
         queue_size (int): How many frames should be buffered in the queue.
+        buffer_size (int): Number of frames in the :class:`.Frame_Buffer` shared by the stream, queue, and writer
+        write_backpressure (int): Number of frames that couldn't be handed to the :class:`.Video_Writer` through
+            the :class:`.Frame_Buffer` because it was full, and were sent through :attr:`._write_q` instead
         initialized (threading.Event): Called in :meth:`~.init_cam` to indicate the camera has been initialized
         stopping (threading.Event): Called to signal that capturing should stop. when set, ends the threaded capture loop
         capturing (threading.Event): Set when camera is actively capturing
@@ -114,13 +148,20 @@ class Camera(Hardware):
     type = "CAMERA" #: (str): what are we anyway?
     trigger = False
 
-    def __init__(self, fps=None, timed=False, crop=None, **kwargs):
+    def __init__(self, fps=None, timed=False, crop=None, buffer_size=64, decimate=1, grayscale=False, **kwargs):
         """
 
+        Crop and decimation are done by the camera if it supports it (see :meth:`~.Camera._apply_roi`),
+        otherwise by taking views of each frame, which are then copied once into the :class:`.Frame_Buffer`.
+
         Args:
             fps:
             timed:
             crop (tuple): (x, y of top left corner, width, height)
+            decimate (int): keep every nth row and column of each frame (default 1, full resolution)
+            grayscale (bool): if True, convert color frames to grayscale
+            buffer_size (int): Number of frames in the :class:`.Frame_Buffer` that the stream, queue, and writer
+                read frames from. Should be larger than the number of frames they can fall behind by.
             **kwargs:
         """
         super(Camera, self).__init__(**kwargs)
@@ -131,21 +172,38 @@ class Camera(Hardware):
         self._capture_thread = None
         self._writer = None
         self._write_q = None
+        self._write_kwargs = None
+        self._frame_slot = None
         self._stream_q = None
+        self._stream_min_size = None
+        self._stream_held = deque()
+        self._frame_buffer = None
+        self._sync = None
         self._indicator = None
 
         self.frame = None
+        self.frame_time = None
+        self.frame_seq = None
+        self.metrics = Frame_Metrics()
         self.shape = None
         self.frame_n = 0
         self.crop = crop
+        self.decimate = int(decimate) if decimate else 1
+        self.grayscale = grayscale
+        self._software_crop = crop
+        self._software_decimate = self.decimate
+        self._stream_decimate = 1
 
         self.blosc = True
+        self.writer = None
+        self.write_backpressure = 0
 
         #self.fps = fps
         self.timed = timed
 
         self.q = None
         self.queue_size = None
+        self.buffer_size = buffer_size
 
         self.initialized = threading.Event()
         self.initialized.clear()
@@ -197,6 +255,7 @@ class Camera(Hardware):
             self.timed = timed
 
         self.frame_n = 0
+        self.metrics = Frame_Metrics(fps=getattr(self, 'fps', None))
 
         self._capture_thread = threading.Thread(target=self._capture)
         self._capture_thread.setDaemon(True)
@@ -210,6 +269,7 @@ class Camera(Hardware):
 
         Calls capture methods, in order:
 
+        * :meth:`~.Camera._apply_roi` - crop and decimate on the camera if it can
         * :meth:`~.Camera.capture_init` - any required routine to prepare the camera after it is instantiated but before it begins to capture
         * :meth:`~.Camera._process`  - the wrapper around a full acquisition cycle, including streaming, writing, and queueing frames
         * :meth:`~.Camera._grab`  - grab a frame from the :attr:`~.Camera.cam`
@@ -227,6 +287,11 @@ class Camera(Hardware):
         self.capturing.set()
         self.stopping.clear()
 
+        # do what the camera can't in software
+        self._software_crop = self.crop
+        self._software_decimate = self.decimate
+        self._apply_roi()
+
         self.capture_init()
 
         if self.streaming.is_set():
@@ -250,9 +315,11 @@ class Camera(Hardware):
 
         finally:
             self.logger.info('Capture Ending')
+            self.logger.info('Capture metrics: {}'.format(self.metrics.summary(self)))
 
             try:
                 if self.streaming.is_set():
+                    self.node.send(key='METRICS', value=self.metrics.summary(self))
                     self.node.send(key='STATE', value='STOPPING')
                     self._stream_q.put('END')
             except Exception as e:
@@ -261,6 +328,7 @@ class Camera(Hardware):
             try:
                 if self.writing.is_set():
                     self._write_deinit()
+                    self.metrics.save(os.path.splitext(self._output_filename)[0] + '_metrics.json', self)
 
             except Exception as e:
                 self.logger.exception('Failed to end writer, error message: {}'.format(e))
@@ -283,29 +351,203 @@ class Camera(Hardware):
         :meth:`~Camera._grab`s the :attr:`.frame`, then handles streaming, writing, queueing, and indicating
         according to :meth:`~Camera.stream`, :meth:`~Camera.write`, :meth:`~Camera.queue`, and :attr:`~Camera.indicating`, respectively.
 
+        If the frame is being streamed, written, or queued, it is copied once into the :class:`.Frame_Buffer`
+        with :meth:`~Camera._buffer_frame`, and the stream, writer, and queue all read that copy.
+
+        The time spent in each stage is recorded in :attr:`.metrics`.
+
         """
 
+        start = time.perf_counter()
         try:
             self.frame = self._grab()
+            self.frame_time = self._grab_time()
         except Exception as e:
             self.logger.exception(e)
+        grabbed = self.metrics.stage('grab', start)
+        self.metrics.frame(self.frame_time, self.frame_seq)
+
+        frame, slot = self._buffer_frame(self._reduce(self.frame[1]))
+        self.frame = (self.frame[0], frame)
+        self._frame_slot = slot
+        stage_start = self.metrics.stage('buffer', grabbed)
+
+        if self._sync is not None:
+            self._sync.add(self.name, self.frame_time, self.frame[0], frame, slot)
+            stage_start = self.metrics.stage('sync', stage_start)
 
         if self.streaming.is_set():
-            self._stream_q.put_nowait({'timestamp': self.frame[0],
-                                       self.name  : self.frame[1]})
+            self._stream_frame(self.frame[0], frame, slot)
+            stage_start = self.metrics.stage('stream', stage_start)
 
         if self.writing.is_set():
             self._write_frame()
+            stage_start = self.metrics.stage('write', stage_start)
 
         if self.queueing.is_set():
-            self.q.put_nowait(self.frame)
+            self._queue_frame(self.frame[0], frame, slot)
+            stage_start = self.metrics.stage('queue', stage_start)
+
+        self.metrics.stage('process', grabbed)
 
         if self.indicating.is_set():
             if not self._indicator:
                 self._indicator = tqdm()
             self._indicator.update()
 
-    def stream(self, to='T', ip=None, port=None, min_size=5, **kwargs):
+    def _grab_time(self):
+        """
+        :func:`time.monotonic` time that the frame returned by the last call to :meth:`~.Camera._grab` was grabbed,
+        for :attr:`.frame_time`
+
+        Cameras that grab frames ahead of :meth:`~.Camera._process` should override this
+        to return when the frame was actually grabbed.
+
+        Returns:
+            float
+        """
+        return time.monotonic()
+
+    def _apply_roi(self):
+        """
+        Optional: crop and decimate frames on the camera, called before :meth:`~.Camera.capture_init`
+
+        Subclasses that can should configure the camera from :attr:`.crop` and :attr:`.decimate`, and
+        update :attr:`._software_crop` and :attr:`._software_decimate` to whatever is left for
+        :meth:`~.Camera._reduce` to do (eg. None and 1 if the camera does everything).
+        """
+        pass
+
+    def _reduce(self, frame):
+        """
+        Crop, decimate, and convert a frame to grayscale, as far as the camera hasn't already.
+
+        Crop and decimation are views of the frame, so they don't copy it. Grayscale conversion
+        makes a new, smaller frame.
+
+        Args:
+            frame (:class:`numpy.ndarray`): captured frame
+
+        Returns:
+            :class:`numpy.ndarray`
+        """
+        if not isinstance(frame, np.ndarray):
+            return frame
+
+        if self._software_crop:
+            x, y, width, height = self._software_crop
+            frame = frame[y:y+height, x:x+width]
+
+        if self._software_decimate > 1:
+            frame = frame[::self._software_decimate, ::self._software_decimate]
+
+        if self.grayscale and frame.ndim == 3 and frame.shape[2] >= 3:
+            frame = to_grayscale(frame)
+
+        return frame
+
+    def _buffer_frame(self, frame):
+        """
+        Copy a frame into the :class:`.Frame_Buffer`, holding one reference for each of the stream, writer,
+        queue, and :class:`.Camera_Group` that will read it.
+
+        The buffer is made for the shape and dtype of the first frame. Frames aren't buffered if
+        nothing is streaming, writing, queueing, or synchronizing, if :mod:`multiprocessing.shared_memory` isn't available,
+        or if the frame doesn't match the buffer.
+
+        Args:
+            frame (:class:`numpy.ndarray`): captured frame
+
+        Returns:
+            tuple: (frame, slot) - a read-only view of the frame in the buffer and its slot, or the
+            frame as it was passed and None if it wasn't buffered.
+        """
+        n_refs = int(self.streaming.is_set()) + int(self.queueing.is_set()) + \
+                 int(self.writing.is_set() and self._write_kwargs is not None) + int(self._sync is not None)
+        if n_refs == 0 or not SHARED_MEMORY or not isinstance(frame, np.ndarray):
+            return frame, None
+
+        if self._frame_buffer is None:
+            self._frame_buffer = Frame_Buffer(frame.shape, frame.dtype, n_frames=self.buffer_size)
+        elif frame.shape != self._frame_buffer.shape or frame.dtype != self._frame_buffer.dtype:
+            self.logger.warning('Frame {} has shape {}, but buffer has shape {}, not buffering'.format(
+                self.frame_n, frame.shape, self._frame_buffer.shape))
+            return frame, None
+
+        try:
+            slot = self._frame_buffer.put(frame, n_refs)
+        except Full:
+            self.logger.warning('Frame buffer full, consumers are {} frames behind'.format(self.buffer_size))
+            if self.writing.is_set():
+                self.write_backpressure += 1
+            return frame, None
+
+        return self._frame_buffer.get(slot), slot
+
+    def _release_slot(self, slot):
+        """
+        Release a reference to a slot in the :class:`.Frame_Buffer`
+
+        Args:
+            slot (int, None): slot to release. if None, the frame wasn't buffered and nothing is done.
+        """
+        if slot is not None and self._frame_buffer is not None:
+            self._frame_buffer.release(slot)
+
+    def _stream_frame(self, timestamp, frame, slot):
+        """
+        Put a frame in the :attr:`._stream_q`
+
+        The stream's reference to the frame's slot is released when the stream thread acknowledges
+        that it has serialized or dropped the frame, see :meth:`~Camera._stream_ack`.
+
+        Args:
+            timestamp: timestamp of the frame
+            frame (:class:`numpy.ndarray`): frame, or view of the frame in the :class:`.Frame_Buffer`
+            slot (int, None): the frame's slot in the :class:`.Frame_Buffer`, or None if it isn't buffered
+        """
+        if self._stream_decimate > 1:
+            # a view, so the stream still reads from the buffer
+            frame = frame[::self._stream_decimate, ::self._stream_decimate]
+
+        # held before it's put in the queue, so it can't be acknowledged first
+        self._stream_held.append(slot)
+        self._stream_q.put_nowait({'timestamp': timestamp,
+                                   self.name  : frame})
+
+    def _stream_ack(self, n):
+        """
+        Release the slots of the ``n`` oldest frames in the stream.
+
+        Passed as ``ack`` to :meth:`.Net_Node.get_stream`, and called by the stream thread once it is done with them.
+
+        Args:
+            n (int): number of frames the stream is done with
+        """
+        for _ in range(n):
+            try:
+                slot = self._stream_held.popleft()
+            except IndexError:
+                return
+            self._release_slot(slot)
+
+    def _queue_frame(self, timestamp, frame, slot):
+        """
+        Put a frame in :attr:`.q`, releasing the queue's reference to the frame's slot if the queue is full.
+
+        Args:
+            timestamp: timestamp of the frame
+            frame (:class:`numpy.ndarray`): frame, or view of the frame in the :class:`.Frame_Buffer`
+            slot (int, None): the frame's slot in the :class:`.Frame_Buffer`, or None if it isn't buffered
+        """
+        try:
+            self.q.put_nowait((timestamp, frame, slot))
+        except Full:
+            if slot is not None:
+                self._frame_buffer.release(slot)
+            self.logger.warning('Frame {} could not be queued, queue full'.format(self.frame_n))
+
+    def stream(self, to='T', ip=None, port=None, min_size=5, decimate=1, **kwargs):
         """
         Enable streaming frames on capture.
 
@@ -318,9 +560,12 @@ class Camera(Hardware):
             to (str): ID of the recipient. Default 'T' for Terminal.
             ip (str): IP of recipient. If None (default), 'localhost'. If None and ``to`` is 'T', ``prefs.TERMINALIP``
             port (int, str): Port of recipient socket. If None (default), ``prefs.MSGPORT``. If None and ``to`` is 'T', ``prefs.TERMINALPORT``.
+            decimate (int): further decimate streamed frames, on top of :attr:`.decimate`,
+                eg. so a preview costs less bandwidth than the frames that are written to disk.
             **kwargs: passed to :meth:`.Hardware.init_networking` and thus to :class:`.Net_Node`
 
         """
+        self._stream_decimate = int(decimate) if decimate else 1
 
 
         if to=='T':
@@ -341,7 +586,8 @@ class Camera(Hardware):
 
         self.listens = {
             'START': self.l_start,
-            'STOP': self.l_stop
+            'STOP': self.l_stop,
+            'METRICS': self.l_metrics
         }
 
         self.init_networking(listens=self.listens, **kwargs)
@@ -355,8 +601,9 @@ class Camera(Hardware):
         self._stream_q = self.node.get_stream(
             'stream', 'CONTINUOUS', upstream=to,
             ip=ip, port=port, subject=subject,
-            min_size=min_size
+            min_size=min_size, ack=self._stream_ack
         )
+        self._stream_min_size = min_size
 
         self.streaming.set()
 
@@ -378,20 +625,37 @@ class Camera(Hardware):
         """
         self.release()
 
+    def l_metrics(self, val):
+        """
+        Send :meth:`.Frame_Metrics.summary` of the current capture upstream with the key ``'METRICS'``
+
+        Args:
+            val: unused
+        """
+        self.node.send(key='METRICS', value=self.metrics.summary(self))
+
 
 
-    def write(self, output_filename = None, timestamps=True, blosc=True):
+    def write(self, output_filename = None, timestamps=True, blosc=True, **kwargs):
         """
         Enable writing frames locally on capture
 
         Spawns a :class:`.Video_Writer` to encode video, sets :attr:`.writing`
 
+        Frames are handed to the writer through the :class:`.Frame_Buffer`, so only their slot and
+        timestamp are put in the :attr:`._write_q`. Since the buffer is made for the shape of the first frame,
+        the writer is started when the first frame is captured. If :mod:`multiprocessing.shared_memory`
+        isn't available, the writer is started immediately and frames are put in the queue.
+
         Args:
             output_filename (str): path and filename of the output video. extension should be ``.mp4``,
                 as videos are encoded with libx264 by default.
             timestamps (bool): if True, (timestamp, frame) tuples will be put in the :attr:`._write_q`.
                 if False, timestamps will be generated by :class:`.Video_Writer` (not recommended at all).
-            blosc (bool): if true, compress frames with :func:`blosc.pack_array` before putting in :attr:`._write_q`.
+            blosc (bool): if true, compress frames that are put in the :attr:`._write_q` with :func:`blosc.pack_array`,
+                when the :class:`.Frame_Buffer` is full or unavailable.
+            **kwargs: encoder options passed to :class:`.Video_Writer`, eg. ``codec``, ``preset``, ``crf``, and ``threads``,
+                or ``flush_every`` for its frame index
         """
         if not output_filename:
             output_filename = self.output_filename
@@ -399,32 +663,78 @@ class Camera(Hardware):
             self._output_filename = output_filename
 
         self.blosc = blosc
+        self.write_backpressure = 0
         self._write_q = mp.Queue()
-        self.writer = Video_Writer(self._write_q, output_filename, self.fps, timestamps=timestamps, blosc=blosc)
-        self.writer.start()
+        if SHARED_MEMORY:
+            self._write_kwargs = dict(kwargs, path=output_filename, timestamps=timestamps, blosc=blosc)
+            self.writer = None
+        else:
+            self.writer = Video_Writer(self._write_q, output_filename, self.fps, timestamps=timestamps, blosc=blosc, **kwargs)
+            self.writer.start()
         self.writing.set()
         self.logger.info('Writing initialized, writing to {}'.format(output_filename))
 
     def _write_frame(self):
         """
-        Put :attr:`.frame` into the :attr:`._write_q`, optionally compressing it with :func:`blosc.pack_array`
+        Put :attr:`.frame` 's timestamp and slot in the :class:`.Frame_Buffer` into the :attr:`._write_q`,
+        starting the :class:`.Video_Writer` once the buffer has been made.
+
+        If the frame isn't in the buffer, the frame itself is put in the queue instead,
+        optionally compressing it with :func:`blosc.pack_array`, and counted in :attr:`.write_backpressure`
         """
+        slot = self._frame_slot
+        if self.writer is None:
+            if self._frame_buffer is None and isinstance(self.frame[1], np.ndarray):
+                # writing began after this frame was captured, so it wasn't buffered.
+                # it waits in the queue, and the writer is started with the buffer made for the next frame
+                pass
+            else:
+                self._start_writer()
+
+        if slot is not None and self.writer.frame_buffer is None:
+            # the writer was started before there was a buffer
+            self._frame_buffer.release(slot)
+            slot = None
+
         try:
-            if self.blosc:
-                self._write_q.put_nowait((self.frame[0], blosc.pack_array(self.frame[1])))
+            if slot is not None:
+                self._write_q.put_nowait((self.frame[0], slot))
+            elif self.blosc:
+                self._write_q.put_nowait((self.frame[0], blosc.pack_array(np.asarray(self.frame[1]))))
             else:
                 self._write_q.put_nowait(self.frame)
         except Full:
+            if slot is not None:
+                self._frame_buffer.release(slot)
             self.logger.exception('Frame {} could not be written, queue full'.format(self.frame_n))
 
 
 
+    def _start_writer(self):
+        """
+        Start the :class:`.Video_Writer` with the :class:`.Frame_Buffer`, logging if there isn't one
+        and every frame has to be sent through the :attr:`._write_q`
+        """
+        if self._frame_buffer is None:
+            self.logger.warning('Frames are not being buffered, sending them to the writer through its queue')
+        self.writer = Video_Writer(self._write_q, fps=self.fps, frame_buffer=self._frame_buffer,
+                                   **self._write_kwargs)
+        self.writer.start()
+
     def _write_deinit(self):
         """
         End the :class:`.Video_Writer`.
 
-        Blocks until the :attr:`._write_q` is empty, holding the release of the object.
+        Blocks until the :attr:`._write_q` is empty and the writer has finished indexing the video,
+        holding the release of the object, then logs the writer's counts.
         """
+        if self.writer is None:
+            if self._write_q.empty():
+                self.logger.info('No frames were written')
+                return
+            # frames were queued before there was a buffer to start the writer with
+            self._start_writer()
+
         self._write_q.put_nowait('END')
         checked_empty = False
         while not self._write_q.empty():
@@ -433,19 +743,56 @@ class Camera(Hardware):
                     'Writer still has ~{} frames, waiting on it to finish'.format(self._write_q.qsize()))
                 checked_empty = True
             time.sleep(0.1)
+        if self.write_backpressure > 0:
+            self.logger.warning('{} frames were sent to the writer outside the frame buffer because it was full, increase buffer_size'.format(
+                self.write_backpressure))
+        if isinstance(self.writer, Video_Writer):
+            self.writer.join()
+            self.logger.info('Writer encoded {} frames to {} at {:.1f} fps, dropped {}'.format(
+                self.writer.n_frames.value, self.writer.path, self.writer.encode_fps, self.writer.n_dropped.value))
+            if self.writer.n_indexed.value < 0:
+                self.logger.warning('Couldnt run ffprobe, frame index for {} has no byte offsets'.format(
+                    self.writer.path))
+            elif self.writer.n_indexed.value < self.writer.n_frames.value:
+                self.logger.warning('Only the first {} of {} frames in the index of {} have byte offsets'.format(
+                    self.writer.n_indexed.value, self.writer.n_frames.value, self.writer.path))
         self.logger.info('Writer finished, closing')
 
-    def queue(self, queue_size = 128):
+    @property
+    def write_queue_depth(self):
+        """
+        Number of frames waiting to be written
+
+        Returns:
+            int: size of :attr:`._write_q`, or 0 if not writing
+        """
+        if self._write_q is None:
+            return 0
+        try:
+            return self._write_q.qsize()
+        except NotImplementedError:
+            # multiprocessing queues can't report their size on macOS
+            return -1
+
+    def queue(self, queue_size = 128, copy=True):
         """
         Enable stashing frames in a queue for a local consumer.
 
-        Other objects can get frames as they are acquired from :attr:`.q`
+        Other objects can get (timestamp, frame) tuples as they are acquired from :attr:`.q`.
+        Frames are copied out of the :class:`.Frame_Buffer` as they are taken, unless ``copy=False``,
+        in which case they are read-only views of the buffer that are valid until the
+        next frame is taken from the queue, see :class:`.Frame_Queue`
 
         Args:
-            queue_size (int): max number of frames that can be held in :attr:`~Camera.q`
+            queue_size (int): max number of frames that can be held in :attr:`~Camera.q`.
+                should be smaller than :attr:`.buffer_size`
+            copy (bool): if True (default), consumers get copies of frames. if False, views.
         """
+        if queue_size >= self.buffer_size:
+            self.logger.warning('queue_size ({}) should be smaller than buffer_size ({}), or frames will be copied when the buffer fills'.format(
+                queue_size, self.buffer_size))
         self.queue_size = queue_size
-        self.q = Queue(maxsize=self.queue_size)
+        self.q = Frame_Queue(maxsize=self.queue_size, release=self._release_slot, copy=copy)
         self.queueing.set()
         self.logger.info('Queueing initialized, queue size {}'.format(queue_size))
 
@@ -561,16 +908,48 @@ class Camera(Hardware):
         """
         self.stopping.set()
 
+    def _stop_capture(self, timeout=None):
+        """
+        Stop capture and wait for the capture thread to finish, then for the :class:`.Video_Writer`
+        that it ended with :meth:`~.Camera._write_deinit`.
+
+        Args:
+            timeout (float): seconds to wait for the capture thread. if None (default), wait until it finishes.
+
+        Returns:
+            bool: True if the capture thread has finished, False if it's still running after ``timeout``
+        """
+        self.stopping.set()
+
+        capture_thread = self._capture_thread
+        if capture_thread is not None and capture_thread is not threading.current_thread():
+            capture_thread.join(timeout)
+            if capture_thread.is_alive():
+                return False
+
+        if isinstance(self.writer, Video_Writer):
+            self.writer.join()
+        return True
+
     def release(self):
         """
         Release resources held by Camera.
 
-        Must be overridden by subclass.
-
-        Does not raise exception in case some general camera release logic should be put here...
+        Stops capture with :meth:`~.Camera._stop_capture` before closing the :class:`.Frame_Buffer`
+        that the capture thread and writer use. Subclasses should stop capture the same way before releasing
+        their camera, and call this at the end of their own ``release``.
         """
 
-        pass
+        # may be called by __del__ before __init__ has finished
+        if getattr(self, 'stopping', None) is None:
+            return
+
+        self._stop_capture()
+
+        if self._frame_buffer is not None:
+            self._stream_held.clear()
+            self._frame_buffer.close()
+            self._frame_buffer = None
         # raise Exception('release must be overwritten by camera subclass!!')
 
 
@@ -579,7 +958,7 @@ class Camera(Hardware):
 
 
 class Camera_CV(Camera):
-    def __init__(self, camera_idx = 0, **kwargs):
+    def __init__(self, camera_idx = 0, pipeline=True, pipeline_depth=4, **kwargs):
         """
         Capture Video from a webcam with OpenCV
 
@@ -587,8 +966,15 @@ class Camera_CV(Camera):
         operating multiple cameras at once, so the performance of this class will be variable depending on camera
         type.
 
+        If ``pipeline`` is True (default), frames are grabbed and decoded in a separate thread
+        (:meth:`~.Camera_CV._grab_frames`) while the capture thread streams, writes, and queues the previous ones,
+        so the camera can be read at its own framerate. If processing falls behind by more than ``pipeline_depth``
+        frames, the oldest grabbed frames are dropped, which is counted as dropped frames in :attr:`.metrics`.
+
         Args:
             camera_idx (int): The index of the desired camera
+            pipeline (bool): Grab frames in a separate thread from processing them (default True)
+            pipeline_depth (int): Number of grabbed frames that can wait to be processed (default 4)
             **kwargs: Passed to the :class:`.Camera` metaclass.
 
         Attributes:
@@ -625,6 +1011,13 @@ class Camera_CV(Camera):
 
         self.camera_idx = camera_idx
 
+        self.pipeline = pipeline
+        self.pipeline_depth = pipeline_depth
+        self._grab_q = None
+        self._grab_thread = None
+        self._grab_stop = threading.Event()
+        self._grabbed_at = None
+
     @property
     def fps(self):
         """
@@ -647,10 +1040,10 @@ class Camera_CV(Camera):
             tuple: (width, height)
         """
         if self.crop:
-            return (self.crop[2], self.crop[3])
+            return (self.crop[2] // self.decimate, self.crop[3] // self.decimate)
         else:
-            return (self.cam.get(cv2.CAP_PROP_FRAME_WIDTH),
-                    self.cam.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            return (self.cam.get(cv2.CAP_PROP_FRAME_WIDTH) // self._software_decimate,
+                    self.cam.get(cv2.CAP_PROP_FRAME_HEIGHT) // self._software_decimate)
 
     @shape.setter
     def shape(self, shape):
@@ -659,21 +1052,133 @@ class Camera_CV(Camera):
         """
         pass
 
+    def capture_init(self):
+        """
+        If :attr:`.pipeline`, start :meth:`~.Camera_CV._grab_frames` in a thread
+        """
+        if not self.pipeline:
+            return
+
+        self._grab_q = Queue(maxsize=self.pipeline_depth)
+        self._grab_stop.clear()
+        self._grab_thread = threading.Thread(target=self._grab_frames)
+        self._grab_thread.setDaemon(True)
+        self._grab_thread.start()
+
+    def capture_deinit(self):
+        """
+        Stop the :meth:`~.Camera_CV._grab_frames` thread
+        """
+        if self._grab_thread is None:
+            return
+
+        self._grab_stop.set()
+        self._grab_thread.join(timeout=1)
+        self._grab_thread = None
+        self._grab_q = None
+
+    def _grab_frames(self):
+        """
+        Grab frames into :attr:`._grab_q` until :attr:`._grab_stop` is set.
+
+        Frames are timestamped as soon as ``cam.grab()`` returns, then decoded with ``cam.retrieve()``.
+        If the queue is full, the oldest frame is dropped so the camera's own buffer doesn't fill and go stale.
+        If ``cam.grab()`` fails, waits according to :data:`.GRAB_BACKOFF` before trying again.
+
+        The camera is read through a reference taken when the thread starts, so :attr:`.cam` isn't
+        reopened if the camera is released.
+        """
+        grab_q = self._grab_q
+        cam = self.cam
+        seq = 0
+        backoff = GRAB_BACKOFF[0]
+        while not self._grab_stop.is_set():
+            if cam.grab():
+                grabbed_at = time.monotonic()
+                ts = cam.get(cv2.CAP_PROP_POS_MSEC)
+                ret, frame = cam.retrieve()
+                if not ret:
+                    ts, frame = False, False
+                backoff = GRAB_BACKOFF[0]
+            else:
+                grabbed_at = time.monotonic()
+                ts, frame = False, False
+                if self._grab_stop.wait(backoff):
+                    break
+                backoff = min(backoff * 2, GRAB_BACKOFF[1])
+
+            item = (ts, frame, grabbed_at, seq)
+            seq += 1
+            try:
+                grab_q.put_nowait(item)
+            except Full:
+                # only this thread puts, so after taking one there's room
+                try:
+                    grab_q.get_nowait()
+                except Empty:
+                    pass
+                grab_q.put_nowait(item)
+
     def _grab(self):
         """
-        Reads a frame with :meth:`.cam.read`
+        Reads a frame with :meth:`.cam.read`, or if :attr:`.pipeline`, takes the next frame grabbed by
+        :meth:`~.Camera_CV._grab_frames`
 
         Returns:
             tuple: (timestamp, frame)
         """
+        if self._grab_thread is not None:
+            while True:
+                try:
+                    ts, frame, self._grabbed_at, self.frame_seq = self._grab_q.get(timeout=1)
+                    return ts, frame
+                except Empty:
+                    if self.stopping.is_set():
+                        return False, False
+
         ret, frame = self.cam.read()
         if not ret:
             return False, False
         ts = self._timestamp()
-        if self.crop:
-            frame = frame[self.crop[1]:self.crop[1]+self.crop[3], self.crop[0]:self.crop[0]+self.crop[2]]
         return (ts, frame)
 
+    def _grab_time(self):
+        """
+        When the frame was grabbed, if :attr:`.pipeline`, otherwise now.
+
+        Returns:
+            float: :func:`time.monotonic` time
+        """
+        if self._grab_thread is not None:
+            return self._grabbed_at
+        return time.monotonic()
+
+    def _apply_roi(self):
+        """
+        Decimate by asking the camera for a lower resolution with ``cv2.CAP_PROP_FRAME_WIDTH`` and ``HEIGHT``,
+        if it has one that matches exactly.
+
+        Most webcams don't support cropping through OpenCV, so :attr:`.crop` is always done by :meth:`~.Camera._reduce`
+        """
+        if self.decimate <= 1:
+            return
+
+        width = self.cam.get(cv2.CAP_PROP_FRAME_WIDTH)
+        height = self.cam.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        self.cam.set(cv2.CAP_PROP_FRAME_WIDTH, width // self.decimate)
+        self.cam.set(cv2.CAP_PROP_FRAME_HEIGHT, height // self.decimate)
+
+        if (self.cam.get(cv2.CAP_PROP_FRAME_WIDTH) == width // self.decimate and
+                self.cam.get(cv2.CAP_PROP_FRAME_HEIGHT) == height // self.decimate):
+            self._software_decimate = 1
+            if self.crop:
+                self._software_crop = tuple(int(val) // self.decimate for val in self.crop)
+        else:
+            self.logger.warning('Camera has no {}x{} mode, decimating in software'.format(
+                width // self.decimate, height // self.decimate))
+            self.cam.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            self.cam.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+
     def _timestamp(self, frame=None):
         """
         Attempts to get timestamp with ``cv2.CAP_PROP_POS_MSEC``.
@@ -724,9 +1229,27 @@ class Camera_CV(Camera):
         return vid
 
     def release(self):
-        self.stop()
-        self.cam.release()
-        self._cam = None
+        """
+        Stop the :meth:`~.Camera_CV._grab_frames` thread and the capture thread, then release the
+        :class:`cv2.VideoCapture` once nothing is using it.
+
+        If the grab thread is stuck in ``cam.grab()`` the camera is left open rather than
+        released from under it.
+        """
+        self._grab_stop.set()
+        grab_thread = self._grab_thread
+        grab_stuck = False
+        if grab_thread is not None:
+            grab_thread.join(timeout=1)
+            grab_stuck = grab_thread.is_alive()
+            if grab_stuck:
+                self.logger.warning('Grab thread is still running after 1s, not releasing the camera')
+        self._stop_capture()
+
+        # not self.cam, which would open the camera again if it's already released
+        if self._cam is not None and not grab_stuck:
+            self._cam.release()
+            self._cam = None
         self.initialized.clear()
         super(Camera_CV, self).release()
 
@@ -851,7 +1374,8 @@ class Camera_Spinnaker(Camera):
                 base_path = '/home/user/capture_directory/capture_'
                 image_path = base_path + 'image1.png'
 
-            img_opts (:class:`PySpin.PNGOption`): Options for saving .png images, made by :meth:`~Camera_Spinnaker.write`
+            img_opts (:class:`PySpin.PNGOption`): Options for saving .png images, made by :meth:`~Camera_Spinnaker.write`,
+                None if writing video directly.
         """
 
         if not PYSPIN:
@@ -865,6 +1389,8 @@ class Camera_Spinnaker(Camera):
 
         self.base_path = None
         self.img_opts = None
+        self._png_threads = []
+        self._png_pixel_format = None
 
         # internal variables
         self._bin = None
@@ -965,6 +1491,69 @@ class Camera_Spinnaker(Camera):
 
         return cam
 
+    def _apply_roi(self):
+        """
+        Decimate and crop on the camera with its ``DecimationHorizontal``/``Vertical``, ``Width``/``Height``,
+        and ``OffsetX``/``Y`` nodes.
+
+        The camera is first reset to its full sensor, so a crop or decimation from a previous capture
+        doesn't persist. The camera's region is rounded outwards to the increments it allows, and the rest of the crop
+        is done by :meth:`~.Camera._reduce`. Anything the camera doesn't support is done in software.
+        """
+        attrs = self._camera_attributes
+        # the camera's nodemap is only populated once it's initialized
+        _ = self.cam
+
+        # decimation first, since it changes the maximum width and height
+        for name in ('DecimationHorizontal', 'DecimationVertical'):
+            try:
+                attrs[name].SetValue(1)
+            except (KeyError, PySpin.SpinnakerException):
+                pass
+        try:
+            attrs['OffsetX'].SetValue(0)
+            attrs['OffsetY'].SetValue(0)
+            attrs['Width'].SetValue(attrs['Width'].GetMax())
+            attrs['Height'].SetValue(attrs['Height'].GetMax())
+        except (KeyError, PySpin.SpinnakerException) as e:
+            self.logger.warning('Couldnt reset camera to its full sensor: {}'.format(e))
+
+        if self.decimate > 1:
+            try:
+                attrs['DecimationHorizontal'].SetValue(self.decimate)
+                attrs['DecimationVertical'].SetValue(self.decimate)
+                self._software_decimate = 1
+            except (KeyError, PySpin.SpinnakerException) as e:
+                self.logger.warning('Camera cant decimate, decimating in software: {}'.format(e))
+
+        if not self.crop:
+            return
+
+        scale = self.decimate if self._software_decimate == 1 else 1
+        x, y, width, height = [int(val) // scale for val in self.crop]
+        try:
+            x_inc, y_inc = attrs['OffsetX'].GetInc(), attrs['OffsetY'].GetInc()
+            w_inc, h_inc = attrs['Width'].GetInc(), attrs['Height'].GetInc()
+            hw_x, hw_y = x - x % x_inc, y - y % y_inc
+            hw_width = int(np.ceil((x + width - hw_x) / w_inc) * w_inc)
+            hw_height = int(np.ceil((y + height - hw_y) / h_inc) * h_inc)
+
+            attrs['Width'].SetValue(hw_width)
+            attrs['Height'].SetValue(hw_height)
+            attrs['OffsetX'].SetValue(hw_x)
+            attrs['OffsetY'].SetValue(hw_y)
+
+            if (hw_x, hw_y, hw_width, hw_height) == (x, y, width, height):
+                self._software_crop = None
+            else:
+                # if decimating in software, scale is 1 and the crop is already in undecimated pixels
+                self._software_crop = (x - hw_x, y - hw_y, width, height)
+
+        except (KeyError, PySpin.SpinnakerException) as e:
+            self.logger.warning('Camera cant crop, cropping in software: {}'.format(e))
+            # in the units of the frames the camera gives
+            self._software_crop = (x, y, width, height)
+
     def capture_init(self):
         """
         Prepare the camera for acquisition
@@ -976,7 +1565,7 @@ class Camera_Spinnaker(Camera):
         self.cam.BeginAcquisition()
         self.frame = self._grab()
         # FIXME: I think this will break single-shot or multishot modes.
-        self.shape = self.frame[1].GetNDArray().shape
+        self.shape = self._reduce(self.frame[1].GetNDArray()).shape
 
 
     def capture_deinit(self):
@@ -990,31 +1579,46 @@ class Camera_Spinnaker(Camera):
         Modification of the :meth:`.Camera._process` method for Spinnaker cameras
 
         Because the objects returned from the :meth:`~Camera_Spinnaker._grab` method are image *pointers*
-        rather than :class:`numpy.ndarray`s, they need to be handled differently.
+        rather than :class:`numpy.ndarray`s, they need to be handled differently. Images are released at the
+        end of each cycle, so frames that are written, streamed, or queued are copied into the :class:`.Frame_Buffer`
+        and :attr:`.frame` is replaced by (timestamp, copied frame).
 
         More details on the differences are given in the :meth:`_write_frame`,
         """
-        frame_array = None
+        start = time.perf_counter()
         try:
             self.frame = self._grab()
+            self.frame_time = time.monotonic()
+            self.frame_seq = self.frame[1].GetFrameID()
         except Exception as e:
             self.logger.exception(e)
+        grabbed = self.metrics.stage('grab', start)
+        self.metrics.frame(self.frame_time, self.frame_seq)
 
-        #self._frame[:] = self.frame[1].GetNDArray()
+        image = self.frame[1]
 
-        if self.writing.is_set():
-            self._write_frame()
+        if self.writing.is_set() or self.streaming.is_set() or self.queueing.is_set() or self._sync is not None:
+            # copy out of the image before it's released
+            frame_array, slot = self._buffer_frame(self._reduce(image.GetNDArray()))
+            self.frame = (self.frame[0], frame_array)
+            self._frame_slot = slot
+            stage_start = self.metrics.stage('buffer', grabbed)
 
-        if self.streaming.is_set():
-            if not frame_array:
-                frame_array = self.frame[1].GetNDArray()
-            self._stream_q.put_nowait({'timestamp': self.frame[0],
-                                       self.name  : frame_array})
+            if self.writing.is_set():
+                self._write_frame()
+                stage_start = self.metrics.stage('write', stage_start)
 
-        if self.queueing.is_set():
-            if not frame_array:
-                frame_array = self.frame[1].GetNDArray()
-            self.q.put_nowait((self.frame[0], frame_array))
+            if self._sync is not None:
+                self._sync.add(self.name, self.frame_time, self.frame[0], frame_array, slot)
+                stage_start = self.metrics.stage('sync', stage_start)
+
+            if self.streaming.is_set():
+                self._stream_frame(self.frame[0], frame_array, slot)
+                stage_start = self.metrics.stage('stream', stage_start)
+
+            if self.queueing.is_set():
+                self._queue_frame(self.frame[0], frame_array, slot)
+                stage_start = self.metrics.stage('queue', stage_start)
 
         if self.indicating.is_set():
             if self._indicator is None:
@@ -1022,7 +1626,8 @@ class Camera_Spinnaker(Camera):
             self._indicator.update()
 
 
-        self.frame[1].Release()
+        image.Release()
+        self.metrics.stage('process', grabbed)
 
     def _grab(self):
         """
@@ -1047,21 +1652,32 @@ class Camera_Spinnaker(Camera):
         return frame.GetTimeStamp()
 
 
-    def write(self, output_filename = None, timestamps=True, blosc=True):
+    def write(self, output_filename = None, timestamps=True, blosc=True, png=False, n_workers=4, **kwargs):
         """
-        Sets camera to save acquired images to a directory for later encoding.
+        Sets camera to write acquired images without encoding them in the capture thread.
 
-        For performance, rather than encoding during acquisition, save each image as
-        a (lossless) .png image in a directory generated by :attr:`.output_filename`.
+        By default, frames are copied out of each image into the :class:`.Frame_Buffer` and piped to ffmpeg
+        by a :class:`.Video_Writer` process, as with :meth:`.Camera.write`. Pass ``codec='ffv1'`` for lossless video.
 
-        After capturing is complete, a :class:`.Directory_Writer` encodes the images to an
-        x264 encoded .mp4 video.
+        If ``png`` is True, each image is instead saved as a (lossless) .png image in a directory generated by
+        :attr:`.output_filename` by a pool of ``n_workers`` threads, and after capturing is complete a
+        :class:`.Directory_Writer` encodes the images to an x264 encoded .mp4 video.
+
+        Either way, :attr:`.write_queue_depth` is the number of frames waiting to be written.
 
         Args:
-            output_filename (str): Directory to write images to. If None (default), generated by :attr:`.output_filename`
-            timestamps (bool): Not used, timestamps are always appended to filenames.
-            blosc (bool): Not used, images are directly saved.
-        """
+            output_filename (str): Video file, or directory to write images to if ``png``.
+                If None (default), generated by :attr:`.output_filename`
+            timestamps (bool): passed to :meth:`.Camera.write`. If ``png``, timestamps are always appended to filenames.
+            blosc (bool): passed to :meth:`.Camera.write`. Not used if ``png``
+            png (bool): if True, save .png images rather than writing video directly
+            n_workers (int): number of threads saving .png images
+            **kwargs: encoder options passed to :class:`.Video_Writer`
+        """
+        if not png:
+            self.img_opts = None
+            return super(Camera_Spinnaker, self).write(output_filename, timestamps=timestamps, blosc=blosc, **kwargs)
+
         if not output_filename:
             output_filename = self.output_filename
         else:
@@ -1079,22 +1695,94 @@ class Camera_Spinnaker(Camera):
         # create base_path for output images
         self.base_path = os.path.join(output_dir, "capture_{}__".format(self.name))
 
+        # frames are held in the frame buffer until they're saved
+        self._write_kwargs = {'png': True}
+        self._write_q = Queue()
+        self._png_threads = []
+        for _ in range(n_workers):
+            png_thread = threading.Thread(target=self._save_pngs)
+            png_thread.setDaemon(True)
+            png_thread.start()
+            self._png_threads.append(png_thread)
+
         self.writing.set()
 
 
     def _write_frame(self):
         """
-        Write frame to :attr:`.base_path` + timestamp + '.png' with :meth:`PySpin.Image.Save`
+        Put the frame in the :attr:`._write_q` to be saved as .png by :meth:`._save_pngs`, or
+        if not writing .png images, hand it to the :class:`.Video_Writer` with :meth:`.Camera._write_frame`
+        """
+        if self.img_opts is None:
+            return super(Camera_Spinnaker, self)._write_frame()
+
+        frame = self.frame[1]
+        if self._png_pixel_format is None:
+            self._png_pixel_format = self._png_format(frame)
+
+        if self._frame_slot is None:
+            # not in the frame buffer, so copy it before the image is released
+            frame = np.array(frame)
+        self._write_q.put_nowait((self.frame[0], frame, self._frame_slot))
+
+    def _png_format(self, frame):
+        """
+        Get the pixel format to save .png images of frames like this one with.
+
+        The camera's pixel format describes the frames it captures, which may not match the frames
+        after :meth:`~.Camera._reduce`: grayscale frames from a color camera are 2-D, and
+        cropping or decimating a Bayer frame in software scrambles its color filter pattern.
+        2-D frames from a camera that isn't capturing in a mono format are saved as Mono8 or Mono16.
+
+        Args:
+            frame (:class:`numpy.ndarray`): a reduced frame
+
+        Returns:
+            int: a ``PySpin.PixelFormat_*`` value
+        """
+        pixel_format = self.cam.PixelFormat.GetValue()
+        if frame.ndim == 2:
+            symbolic = self.cam.PixelFormat.GetCurrentEntry().GetSymbolic()
+            if not symbolic.startswith('Mono'):
+                if frame.dtype.itemsize > 1:
+                    pixel_format = PySpin.PixelFormat_Mono16
+                else:
+                    pixel_format = PySpin.PixelFormat_Mono8
+        return pixel_format
+
+    def _save_pngs(self):
+        """
+        Save frames from the :attr:`._write_q` to :attr:`.base_path` + timestamp + '.png' with :meth:`PySpin.Image.Save`,
+        releasing their slot in the :class:`.Frame_Buffer`. Run in :attr:`._png_threads` until 'END' is put in the queue.
         """
-        self.frame[1].Save(self.base_path+str(self.frame[0])+'.png', self.img_opts)
+        for timestamp, frame, slot in iter(self._write_q.get, 'END'):
+            try:
+                image = PySpin.Image.Create(frame.shape[1], frame.shape[0], 0, 0, self._png_pixel_format, frame)
+                image.Save(self.base_path+str(timestamp)+'.png', self.img_opts)
+            except Exception as e:
+                self.logger.exception('Couldnt save frame {}: {}'.format(timestamp, e))
+            finally:
+                self._release_slot(slot)
 
 
     def _write_deinit(self):
         """
-        After capture, write images in :attr:`.base_path` to video with :class:`.Directory_Writer`
+        After capture, wait for .png images to be saved and write images in :attr:`.base_path` to video with :class:`.Directory_Writer`,
+        or if not writing .png images, end the :class:`.Video_Writer` with :meth:`.Camera._write_deinit`
 
         Camera object will remain open until writer has finished.
         """
+        if self.img_opts is None:
+            return super(Camera_Spinnaker, self)._write_deinit()
+
+        if self.write_queue_depth > 0:
+            self.logger.warning('Still saving ~{} images, waiting on them to finish'.format(self.write_queue_depth))
+        for _ in self._png_threads:
+            self._write_q.put('END')
+        for png_thread in self._png_threads:
+            png_thread.join()
+        self._png_threads = []
+
         self.logger.info('Writing images in {} to {}'.format(self.base_path, self.base_path + '.mp4'))
         self.writer = Directory_Writer(self.base_path, fps=self.fps)
         self.writer.encode()
@@ -1430,11 +2118,18 @@ class Camera_Spinnaker(Camera):
     def release(self):
         """
         Release all PySpin objects and wait on writer, if still active.
-        """
-
-        super(Camera_Spinnaker, self).release()
 
-        self.stopping.set()
+        Capture is stopped and the writer finished before the camera is released and the
+        :class:`.Frame_Buffer` is closed by :meth:`.Camera.release`
+        """
+        if not self._stop_capture(timeout=1):
+            # the capture thread may be waiting on an image that isn't coming, eg. a trigger,
+            # ending acquisition wakes it up
+            try:
+                self.cam.EndAcquisition()
+            except Exception as e:
+                self.logger.exception(e)
+            self._stop_capture()
 
         self._camera_attributes = {}
         self._camera_methods = {}
@@ -1483,9 +2178,11 @@ class Camera_Spinnaker(Camera):
         except Exception as e:
             self.logger.exception(e)
 
-        if self.writing.is_set():
+        if isinstance(self.writer, Directory_Writer):
             self.writer.wait()
 
+        super(Camera_Spinnaker, self).release()
+
 
 
 
@@ -1523,62 +2220,685 @@ class Camera_Spinnaker(Camera):
 #             raise IOError(msg)
 
 
-class Directory_Writer(object):
-    IMG_EXTS = ('.png', '.jpg')
-    def __init__(self, dir, fps, ext='.png', ffmpeg_bin='ffmpeg'):
-        """
-        Encode a directory of images to video with ffmpeg
+def to_grayscale(frame):
+    """
+    Convert a BGR(A) frame to grayscale, with OpenCV if it is available, otherwise with :data:`.GRAY_WEIGHTS`
 
-        Images should be named such that they are machine-orderable, eg.::
+    Args:
+        frame (:class:`numpy.ndarray`): frame of shape (height, width, 3 or 4) in BGR order, as OpenCV captures them
 
-            # this
-            img-001.png, img-002.png, ... img-010.png
+    Returns:
+        :class:`numpy.ndarray`: frame of shape (height, width) and the same dtype
+    """
+    if OPENCV and frame.dtype == np.uint8:
+        return cv2.cvtColor(np.ascontiguousarray(frame[..., :3]), cv2.COLOR_BGR2GRAY)
 
-            # not this
-            img-1.png, img-2.png, ... img-10.png
+    gray = frame[..., 0].astype(np.uint32) * GRAY_WEIGHTS[0]
+    gray += frame[..., 1].astype(np.uint32) * GRAY_WEIGHTS[1]
+    gray += frame[..., 2].astype(np.uint32) * GRAY_WEIGHTS[2]
+    return (gray >> 8).astype(frame.dtype)
 
-        Encoding settings are:
 
-        * ``pix_fmt``: ``yuv420p``
-        * ``vcodec`` : ``libx264``
-        * ``preset``: ``veryfast``
+class Frame_Metrics(object):
+    def __init__(self, fps=None, window=120):
+        """
+        Acquisition metrics for a :class:`.Camera`, recorded by :meth:`.Camera._process` for every frame.
 
-        .. note::
+        Keeps
 
-            ffmpeg must be installed to use this object
+        * the inter-frame intervals of the last ``window`` frames, for a rolling framerate,
+        * a histogram of all inter-frame intervals, with edges :data:`.INTERVAL_BINS`,
+        * a count of dropped frames, from gaps in the camera's sequence numbers if it has them,
+          otherwise from intervals longer than 1.5 frame periods,
+        * the total and longest time spent in each stage of :meth:`.Camera._process`.
 
         Args:
-            dir (str): directory of images to encode
-            fps (int): framerate of output video
-            ext (str): extension of input images
-            ffmpeg_bin (str): ffmpeg binary to use, default is to use ffmpeg in ``$PATH``,
-                otherwise specific binary can be specified.
+            fps (float): the camera's nominal framerate. if None, the median interval is used as the frame period
+            window (int): number of frames used for the rolling framerate
         """
-        self.dir = dir
         self.fps = fps
-        self.ext = ext
-        self.ffmpeg_bin = ffmpeg_bin
+        self.window = window
 
-        self.encode_thread = None
+        self.n_frames = 0
+        self.n_dropped = 0
+        self.intervals = np.zeros(window)
+        self.histogram = np.zeros(len(INTERVAL_BINS) - 1, dtype=int)
+        self.stages = {}
 
-    def encode(self):
+        self._bins = np.array(INTERVAL_BINS[1:-1]) / 1000.
+        self._last_time = None
+        self._last_seq = None
+
+    def frame(self, frame_time, seq=None):
         """
-        Begin encoding.
+        Record a frame
 
-        calls :meth:`._encode` in a thread.
+        Args:
+            frame_time (float): :func:`time.monotonic` time the frame was grabbed
+            seq (int): the camera's sequence number for the frame, if it has them
+        """
+        if seq is not None and self._last_seq is not None and seq > self._last_seq + 1:
+            self.n_dropped += seq - self._last_seq - 1
 
-        Encoding calls ffmpeg with a glob string like::
+        if self._last_time is not None and frame_time is not None:
+            interval = frame_time - self._last_time
+            self.intervals[self.n_frames % self.window] = interval
+            self.histogram[np.searchsorted(self._bins, interval, side='right')] += 1
 
-            self.dir + '*' + self.ext
-        """
-        self.encode_thread = threading.Thread(target=self._encode)
-        self.encode_thread.start()
+            if seq is None:
+                period = self.period
+                if period and interval > 1.5 * period:
+                    self.n_dropped += int(round(interval / period)) - 1
 
-    def _encode(self):
+        self.n_frames += 1
+        self._last_time = frame_time
+        self._last_seq = seq
 
-        glob_str = os.path.join(self.dir.rstrip(os.sep)+ '*'+self.ext)
+    def stage(self, name, start):
+        """
+        Record the time spent in a stage of processing a frame
 
-        ffmpeg_cmd = [self.ffmpeg_bin, "-y", '-r', str(self.fps),
+        Args:
+            name (str): name of the stage, eg. ``'grab'``
+            start (float): :func:`time.perf_counter` time the stage started
+
+        Returns:
+            float: :func:`time.perf_counter` time now, to start the next stage from
+        """
+        now = time.perf_counter()
+        elapsed = now - start
+        try:
+            stage = self.stages[name]
+        except KeyError:
+            stage = self.stages[name] = [0, 0.0, 0.0]
+        stage[0] += 1
+        stage[1] += elapsed
+        if elapsed > stage[2]:
+            stage[2] = elapsed
+        return now
+
+    @property
+    def period(self):
+        """
+        Expected time between frames: ``1/fps`` if given, otherwise the median recent interval
+
+        Returns:
+            float: seconds, or None if not known yet
+        """
+        if self.fps:
+            return 1. / self.fps
+        n = min(self.n_frames - 1, self.window)
+        if n < 10:
+            return None
+        return float(np.median(self.intervals[:n]))
+
+    @property
+    def rolling_fps(self):
+        """
+        Framerate over the last :attr:`~Frame_Metrics.window` frames
+
+        Returns:
+            float
+        """
+        n = min(self.n_frames - 1, self.window)
+        if n < 1:
+            return 0.0
+        mean_interval = np.mean(self.intervals[:n])
+        return float(1. / mean_interval) if mean_interval > 0 else 0.0
+
+    def summary(self, camera=None):
+        """
+        Summarize the metrics
+
+        Args:
+            camera (:class:`.Camera`): if given, include the current depth of its stream, write, and local queues
+
+        Returns:
+            dict: with keys ``frames``, ``dropped``, ``fps``, ``interval_histogram`` (``edges_ms``, with None for
+            the infinite last edge, and ``counts``),
+            ``stages`` (stage: ``{'n', 'mean_ms', 'max_ms'}``), and ``queues``
+        """
+        summary = {
+            'frames': self.n_frames,
+            'dropped': self.n_dropped,
+            'fps': self.rolling_fps,
+            'interval_histogram': {
+                'edges_ms': [float(edge) if np.isfinite(edge) else None for edge in INTERVAL_BINS],
+                'counts': self.histogram.tolist()
+            },
+            'stages': {name: {'n': n, 'mean_ms': total * 1000. / n, 'max_ms': longest * 1000.}
+                       for name, (n, total, longest) in self.stages.items()}
+        }
+
+        if camera is not None:
+            queues = {'write': camera.write_queue_depth}
+            if camera._stream_q is not None:
+                queues['stream'] = camera._stream_q.qsize()
+            if camera.q is not None:
+                queues['queue'] = camera.q.qsize()
+            summary['queues'] = queues
+
+        return summary
+
+    def save(self, path, camera=None):
+        """
+        Write :meth:`~Frame_Metrics.summary` to a .json file
+
+        Args:
+            path (str): path of the .json file
+            camera (:class:`.Camera`): passed to :meth:`~Frame_Metrics.summary`
+        """
+        with open(path, 'w') as metrics_file:
+            json.dump(self.summary(camera), metrics_file, indent=2)
+
+
+class Camera_Group(Hardware):
+    """
+    Capture from several cameras at once and align their frames into synchronized sets.
+
+    Every frame is timestamped with :func:`time.monotonic` as soon as it is grabbed (:attr:`.Camera.frame_time`),
+    so frames from cameras with different native timestamps (eg. milliseconds since capture began for OpenCV,
+    the device clock for Spinnaker, or isoformatted strings) can be compared on one clock.
+
+    Frames are matched as they arrive: when every camera has a frame waiting, frames more than
+    :attr:`~Camera_Group.tolerance` older than the newest waiting frame are dropped as unmatched,
+    and once all the waiting frames are within tolerance of each other they are emitted as a set.
+    While any camera has no frame waiting, the others' frames more than tolerance older than
+    the current time are dropped as unmatched too, so a stalled camera doesn't pin their :class:`.Frame_Buffer` slots.
+    Sets can be streamed as single messages and/or taken from :attr:`~Camera_Group.q`, so downstream
+    consumers get frames from every camera at once without matching frames themselves.
+
+    Frames stay in each camera's :class:`.Frame_Buffer` until the set has been consumed.
+
+    Attributes:
+        cams (dict): camera name: :class:`.Camera`
+        tolerance (float): maximum difference (s) between the frame times within a set
+        frame_n (int): number of sets emitted
+        n_unmatched (dict): camera name: number of frames dropped because they had no match
+        q (:class:`.Frame_Queue`): if :meth:`~Camera_Group.queue` was called, a queue of
+            (timestamp, {camera name: frame}) sets
+    """
+    type = "CAMERA_GROUP"
+    input = True
+
+    def __init__(self, cams, tolerance=None, trigger=None, **kwargs):
+        """
+        Args:
+            cams (dict, list): :class:`.Camera` objects, either as a dict of name: camera, or a list
+                of cameras to be referred to by their :attr:`~.Hardware.name`
+            tolerance (float): maximum difference in seconds between the frame times within a set.
+                if None (default), half the frame period of the slowest camera.
+            trigger (str): name of a camera with a ``frame_trigger`` (eg. :class:`.Camera_Spinnaker`) to lead
+                hardware triggers that the other cameras that have one follow. if None (default), cameras run freely.
+            **kwargs: passed to :class:`.Hardware`. ``stream`` and ``queue`` can be passed as
+                dictionaries of arguments to :meth:`~Camera_Group.stream` and :meth:`~Camera_Group.queue`,
+                as with :class:`.Camera`
+        """
+        super(Camera_Group, self).__init__(name=kwargs.get('name', 'cameras'))
+
+        if isinstance(cams, dict):
+            self.cams = cams
+        else:
+            self.cams = {cam.name: cam for cam in cams}
+
+        if tolerance is None:
+            fps = [cam.fps for cam in self.cams.values() if getattr(cam, 'fps', None)]
+            tolerance = 0.5 / min(fps) if fps else 1 / 60.
+        self.tolerance = tolerance
+        self.trigger = trigger
+
+        self.frame_n = 0
+        self.n_unmatched = {name: 0 for name in self.cams.keys()}
+
+        self.q = None
+        self._stream_q = None
+        self._stream_min_size = None
+        self._stream_held = deque()
+        self._pending = {name: deque() for name in self.cams.keys()}
+        self._lock = threading.Lock()
+
+        self.streaming = threading.Event()
+        self.queueing = threading.Event()
+
+        if 'stream' in kwargs.keys():
+            self.stream(**kwargs['stream'])
+
+        if 'queue' in kwargs.keys():
+            self.queue(**kwargs['queue'])
+
+    def capture(self, timed=None):
+        """
+        Set up hardware triggers if :attr:`~Camera_Group.trigger` is set, and start every camera capturing.
+
+        Args:
+            timed (None, int, float): passed to :meth:`.Camera.capture`
+        """
+        if self.trigger is not None:
+            for name, cam in self.cams.items():
+                if not hasattr(cam, 'frame_trigger'):
+                    self.logger.warning('Camera {} cant be triggered, it will run freely'.format(name))
+                    continue
+                cam.frame_trigger = 'lead' if name == self.trigger else 'follow'
+
+        # start followers first so they don't miss the leader's first trigger
+        for name, cam in sorted(self.cams.items(), key=lambda item: item[0] == self.trigger):
+            cam._sync = self
+            cam.capture(timed)
+
+    def add(self, name, frame_time, timestamp, frame, slot):
+        """
+        Add a frame from one camera, and emit any sets that can be matched.
+
+        Called by :meth:`.Camera._process` in each camera's capture thread.
+
+        Args:
+            name (str): camera name
+            frame_time (float): :func:`time.monotonic` time the frame was grabbed
+            timestamp: the camera's native timestamp
+            frame (:class:`numpy.ndarray`): frame, or a view of it in the camera's :class:`.Frame_Buffer`
+            slot (int, None): the frame's slot in the camera's buffer, or None if it isn't buffered
+        """
+        with self._lock:
+            self._pending[name].append((frame_time, timestamp, frame, slot))
+
+            while all(len(pending) > 0 for pending in self._pending.values()):
+                newest = max(pending[0][0] for pending in self._pending.values())
+                unmatched = [cam_name for cam_name, pending in self._pending.items()
+                             if newest - pending[0][0] > self.tolerance]
+                if len(unmatched) > 0:
+                    for cam_name in unmatched:
+                        self.cams[cam_name]._release_slot(self._pending[cam_name].popleft()[3])
+                        self.n_unmatched[cam_name] += 1
+                    continue
+
+                self._emit({cam_name: pending.popleft() for cam_name, pending in self._pending.items()})
+
+            # frames can't be matched by a frame the waiting camera hasn't grabbed yet
+            if any(len(pending) == 0 for pending in self._pending.values()):
+                oldest = time.monotonic() - self.tolerance
+                for cam_name, pending in self._pending.items():
+                    while len(pending) > 0 and pending[0][0] < oldest:
+                        self.cams[cam_name]._release_slot(pending.popleft()[3])
+                        self.n_unmatched[cam_name] += 1
+
+    def _emit(self, frame_set):
+        """
+        Send a matched set of frames to the stream and queue.
+
+        The set's timestamp is the mean frame time, converted to an isoformatted wall clock time.
+
+        Args:
+            frame_set (dict): camera name: (frame_time, timestamp, frame, slot)
+        """
+        frame_time = np.mean([frame[0] for frame in frame_set.values()])
+        timestamp = datetime.fromtimestamp(frame_time + time.time() - time.monotonic()).isoformat()
+        slots = [(name, frame[3]) for name, frame in frame_set.items()]
+        self.frame_n += 1
+
+        # each camera held one reference for us, get one for each consumer
+        n_consumers = int(self.streaming.is_set()) + int(self.queueing.is_set())
+        if n_consumers != 1:
+            for name, slot in slots:
+                if n_consumers == 0:
+                    self.cams[name]._release_slot(slot)
+                elif slot is not None:
+                    self.cams[name]._frame_buffer.acquire(slot, n_consumers - 1)
+
+        if self.streaming.is_set():
+            message = {'timestamp': timestamp, 'frame_n': self.frame_n}
+            for name, frame in frame_set.items():
+                message[name] = frame[2]
+                message[name + '_timestamp'] = frame[1]
+            # held before it's put in the queue, so it can't be acknowledged first
+            self._stream_held.append(slots)
+            self._stream_q.put_nowait(message)
+
+        if self.queueing.is_set():
+            try:
+                self.q.put_nowait((timestamp, {name: frame[2] for name, frame in frame_set.items()}, slots))
+            except Full:
+                self._release_set(slots)
+                self.logger.warning('Frame set {} could not be queued, queue full'.format(self.frame_n))
+
+    def _release_set(self, slots):
+        """
+        Release the slots of a set of frames in their cameras' :class:`.Frame_Buffer` s
+
+        Args:
+            slots (list): (camera name, slot) tuples
+        """
+        for name, slot in slots:
+            self.cams[name]._release_slot(slot)
+
+    def _stream_ack(self, n):
+        """
+        Release the slots of the ``n`` oldest sets in the stream, like :meth:`.Camera._stream_ack`
+
+        Args:
+            n (int): number of sets the stream is done with
+        """
+        for _ in range(n):
+            try:
+                slots = self._stream_held.popleft()
+            except IndexError:
+                return
+            self._release_set(slots)
+
+    def stream(self, to='T', ip=None, port=None, min_size=5, **kwargs):
+        """
+        Stream matched sets of frames as ``{'timestamp', 'frame_n', camera_name: frame, camera_name_timestamp: native timestamp}``
+
+        Args:
+            to (str): ID of the recipient. Default 'T' for Terminal.
+            ip (str): IP of recipient. If None (default), 'localhost'. If None and ``to`` is 'T', ``prefs.TERMINALIP``
+            port (int, str): Port of recipient socket. If None (default), ``prefs.MSGPORT``. If None and ``to`` is 'T', ``prefs.TERMINALPORT``.
+            min_size (int): number of sets to send in each message
+            **kwargs: passed to :meth:`.Hardware.init_networking` and thus to :class:`.Net_Node`
+        """
+        if to == 'T':
+            if not ip:
+                ip = prefs.TERMINALIP
+            if not port:
+                port = prefs.TERMINALPORT
+        else:
+            if not ip:
+                ip = 'localhost'
+            if not port:
+                port = prefs.MSGPORT
+
+        self.init_networking(listens={}, **kwargs)
+
+        self._stream_q = self.node.get_stream(
+            'stream', 'CONTINUOUS', upstream=to,
+            ip=ip, port=port, subject=getattr(prefs, 'SUBJECT', None),
+            min_size=min_size, ack=self._stream_ack
+        )
+        self._stream_min_size = min_size
+        self.streaming.set()
+
+    def queue(self, queue_size=128, copy=True):
+        """
+        Put matched sets of frames in :attr:`~Camera_Group.q` for a local consumer, as
+        (timestamp, {camera name: frame}) tuples.
+
+        Like :meth:`.Camera.queue`, frames are copies unless ``copy=False``, in which case they are
+        valid until the next set is taken from the queue.
+
+        Args:
+            queue_size (int): max number of sets that can be held in :attr:`~Camera_Group.q`
+            copy (bool): if True (default), consumers get copies of frames. if False, views.
+        """
+        self.q = Frame_Queue(maxsize=queue_size, release=self._release_set, copy=copy)
+        self.queueing.set()
+
+    def stop(self):
+        """
+        Stop every camera capturing
+        """
+        for cam in self.cams.values():
+            cam.stop()
+
+    def release(self):
+        """
+        Stop synchronizing, end the stream, and release every camera.
+        """
+        # may be called by __del__ before __init__ has finished
+        for name, cam in getattr(self, 'cams', {}).items():
+            cam._sync = None
+            try:
+                cam.release()
+            except Exception as e:
+                self.logger.exception('Couldnt release camera {}: {}'.format(name, e))
+
+        if getattr(self, '_stream_q', None) is not None:
+            self._stream_q.put('END')
+            self._stream_q = None
+
+
+class Frame_Buffer(object):
+    def __init__(self, shape, dtype, n_frames=64):
+        """
+        A ring of preallocated frames in shared memory, with a reference count for each frame.
+
+        A :class:`.Camera` copies each frame into the buffer once with :meth:`~Frame_Buffer.put`,
+        and its consumers read views of it with :meth:`~Frame_Buffer.get` rather than getting their own copies.
+        A slot isn't reused until every consumer that holds a reference to it has called
+        :meth:`~Frame_Buffer.release`. If all slots are still referenced, :meth:`~Frame_Buffer.put` raises
+        :class:`queue.Full`, so slow consumers are back-pressure on the camera rather than
+        having their frames overwritten.
+
+        The buffer can be passed to a :class:`multiprocessing.Process` when it is created, and
+        the process will attach to the same shared memory.
+
+        Args:
+            shape (tuple): shape of each frame
+            dtype (:class:`numpy.dtype`): dtype of each frame
+            n_frames (int): number of frames in the ring
+
+        Attributes:
+            frames (:class:`numpy.ndarray`): the ring of frames, shape ``(n_frames, *shape)``
+            refs (:class:`multiprocessing.Array`): number of references held to each frame
+        """
+        if not SHARED_MEMORY:
+            raise ImportError('multiprocessing.shared_memory (python >= 3.8) is required for Frame_Buffer')
+
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.n_frames = n_frames
+
+        nbytes = int(np.prod(self.shape)) * self.dtype.itemsize * n_frames
+        self._shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        # forked processes inherit the object as-is, so only free the memory from the process that made it
+        self._owner = os.getpid()
+        self.refs = mp.Array('i', n_frames)
+        self.frames = np.ndarray((n_frames,) + self.shape, dtype=self.dtype, buffer=self._shm.buf)
+        self._next = 0
+
+    def __getstate__(self):
+        return {'name': self._shm.name, 'shape': self.shape, 'dtype': self.dtype.str,
+                'n_frames': self.n_frames, 'refs': self.refs}
+
+    def __setstate__(self, state):
+        self.shape = state['shape']
+        self.dtype = np.dtype(state['dtype'])
+        self.n_frames = state['n_frames']
+        self.refs = state['refs']
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._owner = None
+        self.frames = np.ndarray((self.n_frames,) + self.shape, dtype=self.dtype, buffer=self._shm.buf)
+        self._next = 0
+
+    def put(self, frame, n_refs=1):
+        """
+        Copy a frame into the next free slot
+
+        Args:
+            frame (:class:`numpy.ndarray`): frame with the buffer's shape and dtype
+            n_refs (int): number of consumers that will :meth:`~Frame_Buffer.release` the frame
+
+        Returns:
+            int: slot the frame was copied into
+
+        Raises:
+            :class:`queue.Full`: if every slot is still referenced
+        """
+        with self.refs.get_lock():
+            for i in range(self.n_frames):
+                slot = (self._next + i) % self.n_frames
+                if self.refs[slot] == 0:
+                    self.refs[slot] = n_refs
+                    break
+            else:
+                raise Full('All {} frames are in use'.format(self.n_frames))
+
+        self.frames[slot] = frame
+        self._next = (slot + 1) % self.n_frames
+        return slot
+
+    def get(self, slot):
+        """
+        Get a read-only view of the frame in a slot
+
+        Args:
+            slot (int): slot returned by :meth:`~Frame_Buffer.put`
+
+        Returns:
+            :class:`numpy.ndarray`
+        """
+        frame = self.frames[slot]
+        frame.flags.writeable = False
+        return frame
+
+    def acquire(self, slot, n=1):
+        """
+        Add references to a slot
+
+        Args:
+            slot (int): slot returned by :meth:`~Frame_Buffer.put`
+            n (int): number of references to add
+        """
+        with self.refs.get_lock():
+            self.refs[slot] += n
+
+    def release(self, slot, n=1):
+        """
+        Release references to a slot, once all are released it can be reused
+
+        Args:
+            slot (int): slot returned by :meth:`~Frame_Buffer.put`
+            n (int): number of references to release
+        """
+        with self.refs.get_lock():
+            self.refs[slot] = max(self.refs[slot] - n, 0)
+
+    @property
+    def n_used(self):
+        """
+        Number of slots that are still referenced
+
+        Returns:
+            int
+        """
+        with self.refs.get_lock():
+            return sum(1 for ref in self.refs if ref > 0)
+
+    def close(self):
+        """
+        Close the shared memory, and free it if this is the process that made it.
+
+        Views returned by :meth:`~Frame_Buffer.get` are invalid afterwards.
+        """
+        self.frames = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # views are still held by a consumer, the memory is freed when they're garbage collected
+            pass
+        if self._owner == os.getpid():
+            self._shm.unlink()
+
+
+class Frame_Queue(Queue):
+    def __init__(self, maxsize=0, release=None, copy=True):
+        """
+        Queue of (timestamp, frame) tuples from a :class:`.Camera`'s :class:`.Frame_Buffer`
+
+        Items are put as (timestamp, frame, slot) tuples, and taken as (timestamp, frame) tuples.
+        By default, frames are copied out of the buffer as they are taken and their slot is released, so
+        consumers can keep them as long as they like. With ``copy=False``, the queue instead holds a reference
+        to the slot of the last frame that was taken, and releases it when the next frame is taken,
+        so a consumer can use a read-only view of a frame without copying it until it gets the next one.
+
+        Args:
+            maxsize (int): max number of frames in the queue
+            release (callable): called with the slot of a frame to release it, eg. :meth:`.Camera._release_slot`
+            copy (bool): if True (default), give consumers copies of frames. if False, give them views
+                that are invalid after their next :meth:`~queue.Queue.get`
+        """
+        super(Frame_Queue, self).__init__(maxsize=maxsize)
+        self.release = release
+        self.copy = copy
+        self._held = None
+
+    def _get(self):
+        item = super(Frame_Queue, self)._get()
+        if len(item) == 2:
+            # put by something other than the camera
+            return item
+        timestamp, frame, slot = item
+
+        if self.copy:
+            if isinstance(frame, dict):
+                # a set of frames from a Camera_Group
+                frame = {name: np.array(cam_frame) for name, cam_frame in frame.items()}
+            elif slot is not None:
+                frame = np.array(frame)
+            if slot is not None:
+                self.release(slot)
+            return (timestamp, frame)
+
+        if self._held is not None:
+            self.release(self._held)
+        self._held = slot
+        return (timestamp, frame)
+
+
+class Directory_Writer(object):
+    IMG_EXTS = ('.png', '.jpg')
+    def __init__(self, dir, fps, ext='.png', ffmpeg_bin='ffmpeg'):
+        """
+        Encode a directory of images to video with ffmpeg
+
+        Images should be named such that they are machine-orderable, eg.::
+
+            # this
+            img-001.png, img-002.png, ... img-010.png
+
+            # not this
+            img-1.png, img-2.png, ... img-10.png
+
+        Encoding settings are:
+
+        * ``pix_fmt``: ``yuv420p``
+        * ``vcodec`` : ``libx264``
+        * ``preset``: ``veryfast``
+
+        .. note::
+
+            ffmpeg must be installed to use this object
+
+        Args:
+            dir (str): directory of images to encode
+            fps (int): framerate of output video
+            ext (str): extension of input images
+            ffmpeg_bin (str): ffmpeg binary to use, default is to use ffmpeg in ``$PATH``,
+                otherwise specific binary can be specified.
+        """
+        self.dir = dir
+        self.fps = fps
+        self.ext = ext
+        self.ffmpeg_bin = ffmpeg_bin
+
+        self.encode_thread = None
+
+    def encode(self):
+        """
+        Begin encoding.
+
+        calls :meth:`._encode` in a thread.
+
+        Encoding calls ffmpeg with a glob string like::
+
+            self.dir + '*' + self.ext
+        """
+        self.encode_thread = threading.Thread(target=self._encode)
+        self.encode_thread.start()
+
+    def _encode(self):
+
+        glob_str = os.path.join(self.dir.rstrip(os.sep)+ '*'+self.ext)
+
+        ffmpeg_cmd = [self.ffmpeg_bin, "-y", '-r', str(self.fps),
                       '-pattern_type', 'glob', '-i', glob_str,
                       '-pix_fmt', 'yuv420p', '-r', str(self.fps),
                       '-vcodec', 'libx264', '-preset', 'veryfast',
@@ -1596,8 +2916,208 @@ class Directory_Writer(object):
 
 
 
+HARDWARE_ENCODERS = ('h264_nvenc', 'h264_v4l2m2m', 'h264_omx')
+"""
+Hardware h264 encoders, in order of preference, that :func:`.select_encoder` uses if ffmpeg was built with them
+and the hardware is present.
+
+* ``h264_nvenc`` - NVIDIA GPUs
+* ``h264_v4l2m2m`` - the Raspberry Pi 4's encoder through video4linux
+* ``h264_omx`` - the Raspberry Pi 3's encoder through OpenMAX
+"""
+
+ENCODER_OPTIONS = {
+    'libx264': {'preset': '-preset', 'crf': '-crf', 'pix_fmt': 'yuv420p'},
+    'h264_nvenc': {'preset': '-preset', 'crf': '-cq', 'pix_fmt': 'yuv420p'},
+    'h264_v4l2m2m': {'pix_fmt': 'yuv420p'},
+    'h264_omx': {'pix_fmt': 'yuv420p'},
+    'ffv1': {'pix_fmt': None}
+}
+"""
+How :class:`.Video_Writer` passes its ``preset`` and ``crf`` to each encoder, and the output ``pix_fmt`` to use.
+Options that an encoder doesn't support are left out of its command.
+A ``pix_fmt`` of None keeps the input's pixel format, eg. so ``ffv1`` is lossless.
+Encoders not listed here are given ``-preset`` and ``-crf`` and ``yuv420p``.
+"""
+
+_ENCODERS = {}
+_WORKING_ENCODERS = {}
+
+
+def available_encoders(ffmpeg_bin='ffmpeg'):
+    """
+    List the video encoders an ffmpeg binary was built with, with ``ffmpeg -encoders``
+
+    Args:
+        ffmpeg_bin (str): ffmpeg binary to query
+
+    Returns:
+        set: encoder names, empty if ffmpeg couldn't be run.
+    """
+    if ffmpeg_bin not in _ENCODERS:
+        try:
+            out = subprocess.run([ffmpeg_bin, '-hide_banner', '-encoders'],
+                                 stdout=PIPE, stderr=PIPE, check=True).stdout.decode('utf-8')
+        except (OSError, subprocess.CalledProcessError):
+            return set()
+
+        encoders = set()
+        for line in out.splitlines():
+            fields = line.split()
+            # encoder lines look like ' V..... libx264  description'
+            if len(fields) >= 2 and fields[0].startswith('V') and len(fields[0]) == 6 and fields[1] != '=':
+                encoders.add(fields[1])
+        _ENCODERS[ffmpeg_bin] = encoders
+    return _ENCODERS[ffmpeg_bin]
+
+
+def encoder_works(encoder, ffmpeg_bin='ffmpeg'):
+    """
+    Check that an encoder can be used by encoding a single blank frame with it.
+
+    ffmpeg lists hardware encoders it was built with even if the hardware isn't there,
+    so this is how :func:`.select_encoder` checks for the hardware.
+
+    Args:
+        encoder (str): encoder name
+        ffmpeg_bin (str): ffmpeg binary to use
+
+    Returns:
+        bool
+    """
+    key = (ffmpeg_bin, encoder)
+    if key not in _WORKING_ENCODERS:
+        cmd = [ffmpeg_bin, '-hide_banner', '-loglevel', 'error',
+               '-f', 'lavfi', '-i', 'color=size=256x256', '-frames:v', '1',
+               '-pix_fmt', 'yuv420p', '-vcodec', encoder, '-f', 'null', '-']
+        try:
+            _WORKING_ENCODERS[key] = subprocess.run(cmd, stdout=PIPE, stderr=PIPE, timeout=10).returncode == 0
+        except (OSError, subprocess.TimeoutExpired):
+            _WORKING_ENCODERS[key] = False
+    return _WORKING_ENCODERS[key]
+
+
+def select_encoder(codec='auto', ffmpeg_bin='ffmpeg'):
+    """
+    Choose the encoder to use for a :class:`.Video_Writer`
+
+    Args:
+        codec (str): if ``'auto'``, the first of :data:`.HARDWARE_ENCODERS` that ffmpeg has and that
+            works (see :func:`.encoder_works`), otherwise ``libx264``. Any other encoder name is returned as it is.
+        ffmpeg_bin (str): ffmpeg binary that will be used
+
+    Returns:
+        str: encoder name
+    """
+    if codec != 'auto':
+        return codec
+
+    encoders = available_encoders(ffmpeg_bin)
+    for encoder in HARDWARE_ENCODERS:
+        if encoder in encoders and encoder_works(encoder, ffmpeg_bin):
+            return encoder
+    return 'libx264'
+
+
+FRAME_INDEX_DTYPE = np.dtype([('frame', '<u4'), ('timestamp', '<f8'), ('offset', '<i8'), ('keyframe', '?')])
+"""
+Records of the binary frame index that :class:`.Video_Writer` writes next to each video, one per encoded frame:
+
+* ``frame`` - frame number in the video
+* ``timestamp`` - the camera's timestamp. Numeric timestamps are stored as they are, in the camera's units,
+  and isoformatted timestamps are stored as seconds since the epoch.
+* ``offset`` - byte offset of the frame's packet in the video file, -1 if it isn't known (yet)
+* ``keyframe`` - whether the frame is a keyframe, so can be decoded without the frames before it
+
+Read with :func:`.read_frame_index`
+"""
+
+
+def frame_index_path(path):
+    """
+    Path of the frame index for a video
+
+    Args:
+        path (str): path of the video
+
+    Returns:
+        str: path of the video without its extension + ``'_frames.bin'``
+    """
+    return os.path.splitext(path)[0] + '_frames.bin'
+
+
+def read_frame_index(path):
+    """
+    Read the frame index written by a :class:`.Video_Writer`
+
+    Can be read while the video is still being written, up to the last time the index was flushed.
+
+    Args:
+        path (str): path of the video, or of its index
+
+    Returns:
+        :class:`numpy.ndarray`: structured array with :data:`.FRAME_INDEX_DTYPE`
+    """
+    if not path.endswith('_frames.bin'):
+        path = frame_index_path(path)
+    n_records = os.path.getsize(path) // FRAME_INDEX_DTYPE.itemsize
+    return np.fromfile(path, dtype=FRAME_INDEX_DTYPE, count=n_records)
+
+
+def packet_offsets(path, ffprobe_bin='ffprobe'):
+    """
+    Get the byte offset of each video frame's packet in a video file, in presentation order, with ``ffprobe``
+
+    Packets are only read, not decoded, so this is fast even for long videos.
+
+    Args:
+        path (str): path of the video
+        ffprobe_bin (str): ffprobe binary to use
+
+    Returns:
+        tuple: (offsets, keyframes) - arrays of the byte offset and whether each frame is a keyframe.
+        None if ffprobe couldn't be run.
+    """
+    cmd = [ffprobe_bin, '-v', 'error', '-select_streams', 'v:0',
+           '-show_entries', 'packet=pts,pos,flags', '-of', 'json', path]
+    try:
+        out = subprocess.run(cmd, stdout=PIPE, stderr=PIPE, check=True).stdout.decode('utf-8')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    packets = json.loads(out).get('packets', [])
+    # packets are listed in decoding order, frames in the video are in presentation order
+    packets = sorted(packets, key=lambda packet: int(packet.get('pts', 0)))
+    offsets = np.array([int(packet.get('pos', -1)) for packet in packets], dtype=np.int64)
+    keyframes = np.array(['K' in packet.get('flags', '') for packet in packets], dtype=bool)
+    return offsets, keyframes
+
+
+def _timestamp_seconds(timestamp):
+    """
+    Convert a camera's timestamp to a float for the frame index
+
+    Args:
+        timestamp (int, float, str, :class:`datetime.datetime`): timestamp
+
+    Returns:
+        float: numeric timestamps as they are, isoformatted or datetime timestamps as seconds since the epoch,
+        NaN if the timestamp can't be converted
+    """
+    try:
+        if isinstance(timestamp, str):
+            return datetime.fromisoformat(timestamp).timestamp()
+        elif isinstance(timestamp, datetime):
+            return timestamp.timestamp()
+        return float(timestamp)
+    except (TypeError, ValueError):
+        return np.nan
+
+
 class Video_Writer(mp.Process):
-    def __init__(self, q, path, fps=None, timestamps=True, blosc=True):
+    def __init__(self, q, path, fps=None, timestamps=True, blosc=True, frame_buffer=None,
+                 codec='libx264', preset='ultrafast', crf=None, threads=None, ffmpeg_bin='ffmpeg',
+                 flush_every=None):
         """
         Encode frames as they are acquired in a separate process.
 
@@ -1605,7 +3125,18 @@ class Video_Writer(mp.Process):
 
         Encoding continues until 'END' is put in :attr:`~Video_Writer.q`.
 
-        Timestamps are saved in a .csv file with the same path as the video.
+        Frame numbers and timestamps are written to a binary frame index next to the video
+        (see :func:`.frame_index_path` and :data:`.FRAME_INDEX_DTYPE`) as frames are encoded,
+        and flushed every ``flush_every`` frames, so they survive if the writer crashes. Once encoding
+        is finished, the byte offset of each frame in the video is added to the index with :func:`.packet_offsets`
+        if ``ffprobe`` is next to ``ffmpeg_bin``.
+
+        Frames can be put in the queue either as slots in a :class:`.Frame_Buffer` shared with the
+        camera, which are released once they are encoded, or as arrays.
+
+        Frames are written as raw video to ffmpeg's stdin, straight from the frame's memory.
+        The input pixel format is taken from the first frame: ``gray`` or ``gray16le`` for single channel frames,
+        and ``rgb24`` or ``rgba`` for three or four channel frames.
 
         Args:
             q (:class:`~queue.Queue`): Queue into which frames will be dumped
@@ -1614,9 +3145,24 @@ class Video_Writer(mp.Process):
             timestamps (bool): if True (default), input will be of form (timestamp, frame). if False,
                 input will just be frames and timestamps will be generated as the frame is encoded (**not recommended**)
             blosc (bool): if True, frames in the :attr:`~Video_Writer.q` will be compresed with blosc. if False, uncompressed
+            frame_buffer (:class:`.Frame_Buffer`): buffer that frames given as (int) slots are read from
+            codec (str): ffmpeg encoder, eg. ``'libx264'`` (default), ``'ffv1'`` for lossless video (use a ``.mkv`` or ``.avi`` path),
+                or ``'auto'`` to use a hardware encoder if there is one, see :func:`.select_encoder`
+            preset (str): encoder preset, if the encoder has them (see :data:`.ENCODER_OPTIONS`)
+            crf (int): constant rate factor (quality) if the encoder has one. if None, the encoder's default
+            threads (int): number of encoding threads. if None, ffmpeg's default
+            ffmpeg_bin (str): ffmpeg binary to use, default is to use ffmpeg in ``$PATH``
+            flush_every (int): number of frames between flushes of the frame index. if None (default),
+                once a second at ``fps``
 
         Attributes:
-            timestamps (list): Timestamps for frames, written to .csv on completion of encoding
+            index_path (str): path of the frame index
+            n_frames (:class:`multiprocessing.Value`): number of frames encoded
+            n_dropped (:class:`multiprocessing.Value`): number of frames that couldn't be encoded,
+                eg. because their shape changed or ffmpeg exited
+            encode_time (:class:`multiprocessing.Value`): seconds spent writing frames to ffmpeg
+            n_indexed (:class:`multiprocessing.Value`): number of frames whose byte offsets were added to the
+                frame index by :meth:`~Video_Writer.index_offsets`, or -1 if ffprobe couldn't be run
 
         """
 
@@ -1626,76 +3172,206 @@ class Video_Writer(mp.Process):
         self.path = path
         self.fps = fps
         self.given_timestamps = timestamps
-        self.timestamps = []
+        self.index_path = frame_index_path(path)
+        self.flush_every = flush_every
         self.blosc = blosc
+        self.frame_buffer = frame_buffer
+        self.codec = codec
+        self.preset = preset
+        self.crf = crf
+        self.threads = threads
+        self.ffmpeg_bin = ffmpeg_bin
+
+        self.n_frames = mp.Value('L', 0)
+        self.n_dropped = mp.Value('L', 0)
+        self.encode_time = mp.Value('d', 0.0)
+        self.n_indexed = mp.Value('l', -1)
 
 
         if fps is None:
             warnings.warn('No FPS given, using 30fps by default')
             self.fps = 30
 
+        if self.flush_every is None:
+            self.flush_every = max(int(self.fps), 1)
+
+    @property
+    def encode_fps(self):
+        """
+        Frames encoded per second spent writing to ffmpeg's pipe, which blocks when ffmpeg falls behind,
+        so this is about the fastest framerate the writer could keep up with.
+
+        Returns:
+            float
+        """
+        if self.encode_time.value == 0:
+            return 0.0
+        return self.n_frames.value / self.encode_time.value
+
+    def ffmpeg_cmd(self, shape, dtype):
+        """
+        Make the ffmpeg command to encode raw frames of a given shape
+
+        Args:
+            shape (tuple): shape of frames, (height, width) or (height, width, channels)
+            dtype (:class:`numpy.dtype`): dtype of frames, uint8 or uint16
+
+        Returns:
+            list: command to pass to :class:`subprocess.Popen`
+        """
+        channels = shape[2] if len(shape) > 2 else 1
+        dtype = np.dtype(dtype)
+        if channels == 1:
+            in_pix_fmt = 'gray16le' if dtype.itemsize == 2 else 'gray'
+        elif channels == 3:
+            in_pix_fmt = 'rgb24'
+        elif channels == 4:
+            in_pix_fmt = 'rgba'
+        else:
+            raise ValueError('Cant encode frames with {} channels'.format(channels))
+
+        codec = select_encoder(self.codec, self.ffmpeg_bin)
+        options = ENCODER_OPTIONS.get(codec, {'preset': '-preset', 'crf': '-crf', 'pix_fmt': 'yuv420p'})
+
+        cmd = [self.ffmpeg_bin, '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', in_pix_fmt,
+               '-s', '{}x{}'.format(shape[1], shape[0]),
+               '-r', str(self.fps), '-i', '-',
+               '-vcodec', codec, '-r', str(self.fps)]
+        if options.get('pix_fmt'):
+            cmd.extend(['-pix_fmt', options['pix_fmt']])
+        if self.preset is not None and 'preset' in options:
+            cmd.extend([options['preset'], str(self.preset)])
+        if self.crf is not None and 'crf' in options:
+            cmd.extend([options['crf'], str(self.crf)])
+        if self.threads is not None:
+            cmd.extend(['-threads', str(self.threads)])
+        cmd.append(self.path)
+        return cmd
+
     def run(self):
         """
-        Open a :class:`skvideo.io.FFmpegWriter` and begin processing frames from :attr:`~Video_Writer.q`
+        Open ffmpeg with :meth:`~Video_Writer.ffmpeg_cmd` when the first frame arrives,
+        and pipe frames from :attr:`~Video_Writer.q` to it.
 
         Should not be called by itself, overwrites the :meth:`multiprocessing.Process.run` method,
         so should call :meth:`Video_Writer.start`
 
-        Continue encoding until 'END' put in queue.
-        """
+        Continue encoding until 'END' put in queue. Frames that can't be encoded are counted in
+        :attr:`~Video_Writer.n_dropped`, and the queue keeps being emptied so the camera isn't blocked.
 
-        self.timestamps = []
+        Each encoded frame's record in the frame index is buffered and written every :attr:`~Video_Writer.flush_every`
+        frames, and the byte offsets of frames are filled in by :meth:`~Video_Writer.index_offsets` once ffmpeg exits.
+        """
 
+        proc = None
+        shape = None
 
-        out_vid_fn = self.path
-        vid_out = io.FFmpegWriter(out_vid_fn,
-        #vid_out = FastWriter(out_vid_fn,
-            inputdict={
-                '-r': str(self.fps),
-        },
-            outputdict={
-                '-vcodec': 'libx264',
-                '-pix_fmt': 'yuv420p',
-                '-r': str(self.fps),
-                '-preset': 'ultrafast',
-            },
-            verbosity=1
-        )
+        index_file = open(self.index_path, 'wb')
+        records = np.zeros(self.flush_every, dtype=FRAME_INDEX_DTYPE)
+        records['offset'] = -1
+        n_records = 0
 
         try:
 
             for input in iter(self.q.get, 'END'):
+                if self.given_timestamps:
+                    timestamp = input[0]
+                    frame = input[1]
+                else:
+                    timestamp = datetime.now().isoformat()
+                    frame = input
+
+                slot = None
+                if isinstance(frame, (int, np.integer)):
+                    slot = frame
+                    frame = self.frame_buffer.get(slot)
+                elif self.blosc and isinstance(frame, bytes):
+                    frame = blosc.unpack_array(frame)
+
                 try:
+                    if proc is None:
+                        shape = frame.shape
+                        proc = Popen(self.ffmpeg_cmd(frame.shape, frame.dtype), stdin=PIPE, bufsize=0)
+
+                    if frame.shape != shape or proc.poll() is not None:
+                        with self.n_dropped.get_lock():
+                            self.n_dropped.value += 1
+                        continue
+
+                    start = time.perf_counter()
+                    proc.stdin.write(np.ascontiguousarray(frame).data)
+                    self.encode_time.value += time.perf_counter() - start
 
-                    if self.given_timestamps:
-                        self.timestamps.append(input[0])
-                        if self.blosc:
-                            vid_out.writeFrame(blosc.unpack_array(input[1]))
-                        else:
-                            vid_out.writeFrame(input[1])
-                    else:
-                        self.timestamps.append(datetime.now().isoformat())
-                        if self.blosc:
-                            vid_out.writeFrame(blosc.unpack_array(input))
-                        else:
-                            vid_out.writeFrame(input)
+                    records['frame'][n_records] = self.n_frames.value
+                    records['timestamp'][n_records] = _timestamp_seconds(timestamp)
+                    n_records += 1
+                    if n_records == self.flush_every:
+                        index_file.write(records.tobytes())
+                        index_file.flush()
+                        n_records = 0
+
+                    self.n_frames.value += 1
 
                 except Exception as e:
                     print(e)
-                    traceback.print_tb()
-                    # TODO: Too general
-                    break
+                    traceback.print_exc()
+                    with self.n_dropped.get_lock():
+                        self.n_dropped.value += 1
+
+                finally:
+                    if slot is not None:
+                        # release the slot once it's been piped to ffmpeg
+                        self.frame_buffer.release(slot)
 
         finally:
 
-            # save timestamps as .csv
-            ts_path = os.path.splitext(self.path)[0] + '.csv'
-            with open(ts_path, 'w') as ts_file:
-                csv_writer = csv.writer(ts_file)
-                for ts in self.timestamps:
-                    csv_writer.writerow([ts])
+            index_file.write(records[:n_records].tobytes())
+            index_file.close()
+
+            if proc is not None:
+                try:
+                    proc.stdin.close()
+                except (IOError, OSError):
+                    pass
+                proc.wait()
+                self.index_offsets()
 
-            vid_out.close()
+            if self.frame_buffer is not None:
+                self.frame_buffer.close()
+
+    def index_offsets(self):
+        """
+        Fill in the byte offset and keyframe of each frame in the frame index with :func:`.packet_offsets`,
+        using the ``ffprobe`` next to :attr:`~Video_Writer.ffmpeg_bin`.
+
+        The number of frames that were given offsets is stored in :attr:`~Video_Writer.n_indexed`
+        for the camera to log, if the video and index have a different number of frames,
+        only the first are indexed.
+
+        Returns:
+            bool: True if the offsets were added to the index
+        """
+        ffmpeg_dir, ffmpeg_name = os.path.split(self.ffmpeg_bin)
+        ffprobe_bin = os.path.join(ffmpeg_dir, ffmpeg_name.replace('ffmpeg', 'ffprobe'))
+
+        offsets = packet_offsets(self.path, ffprobe_bin)
+        if offsets is None:
+            return False
+        offsets, keyframes = offsets
+
+        n_records = os.path.getsize(self.index_path) // FRAME_INDEX_DTYPE.itemsize
+        n = min(len(offsets), n_records)
+        self.n_indexed.value = n
+        if n_records == 0:
+            return False
+
+        index = np.memmap(self.index_path, dtype=FRAME_INDEX_DTYPE, mode='r+', shape=(n_records,))
+        index['offset'][:n] = offsets[:n]
+        index['keyframe'][:n] = keyframes[:n]
+        index.flush()
+        del index
+        return True
 
 
 def list_spinnaker_cameras():
@@ -10,8 +10,6 @@ import time
 import struct
 from datetime import datetime
 import numpy as np
-from itertools import product
-from scipy.interpolate import griddata
 
 if sys.version_info >= (3,0):
     from queue import Queue, Empty
@@ -28,6 +26,41 @@ except ImportError:
     MLX90640_LIB = False
 
 
+def cubic_interpolation_matrix(n_in, n_out, a=-0.5):
+    """
+    Matrix that interpolates ``n_in`` evenly spaced samples to ``n_out`` samples spanning the same extent
+    with cubic convolution (Keys, 1981), so a 2D image can be interpolated with two matrix products::
+
+        rows = cubic_interpolation_matrix(image.shape[0], out_shape[0])
+        cols = cubic_interpolation_matrix(image.shape[1], out_shape[1])
+        interpolated = rows @ image @ cols.T
+
+    Samples past the edges are clamped to the edge, and each row of weights sums to 1.
+
+    Args:
+        n_in (int): number of input samples
+        n_out (int): number of output samples
+        a (float): cubic convolution parameter, -0.5 (default) approximates a cubic spline
+
+    Returns:
+        :class:`numpy.ndarray`: array of shape (n_out, n_in)
+    """
+    positions = np.linspace(0, n_in - 1, n_out)
+    base = np.floor(positions).astype(int)
+    weights = np.zeros((n_out, n_in))
+
+    for offset in (-1, 0, 1, 2):
+        dist = np.abs(positions - (base + offset))
+        kernel = np.where(dist <= 1,
+                          (a + 2) * dist ** 3 - (a + 3) * dist ** 2 + 1,
+                          a * dist ** 3 - 5 * a * dist ** 2 + 8 * a * dist - 4 * a)
+        kernel[dist >= 2] = 0
+        # add rather than assign, taps clamped to the same edge sample sum together
+        np.add.at(weights, (np.arange(n_out), np.clip(base + offset, 0, n_in - 1)), kernel)
+
+    return weights
+
+
 
 class I2C_9DOF(Hardware):
     """
@@ -342,8 +375,12 @@ class MLX90640(Camera):
 
     Capture works a bit differently from other Cameras -- the :meth:`~MLX90640.capture_init` method spawns a
     :meth:`~MLX90640._threaded_capture` thread, which continually puts frames in the :attr:`~MLX90640._frames` array
-    which serves as a ring buffer. The :meth:`~MLX90640._grab` method then awaits the :attr:`~MLX90640._grab_event` to
-    be set by the capture thread, and when it is set returns the mean across frames of the ring buffer.
+    which serves as a ring buffer, and keeps a running sum of the frames in it. The :meth:`~MLX90640._grab` method then
+    awaits the :attr:`~MLX90640._grab_event` to be set by the capture thread, and when it is set returns the mean
+    across frames of the ring buffer.
+
+    Frames are interpolated with two matrix products by separable cubic convolution
+    (see :func:`.cubic_interpolation_matrix`), whose weights are computed once when :attr:`~MLX90640.interpolate` is set.
 
     .. note::
         The setup script modifies the systemwide i2c baudrate to 1MHz, which may interfere with other
@@ -374,20 +411,27 @@ class MLX90640(Camera):
 
         self._frame_idx = 0
         self._frames = None
+        self._frame_sum = None
+        self._n_frames = 0
+        self._frames_lock = threading.Lock()
         self._integrate_frames = None
         self._interpolate = None
         self._cap_thread = None
 
+        # index of each pixel of the sensor's flat frame in the oriented frame,
+        # equivalent to np.rot90(frame.reshape(shape_sensor, order='F').T)
+        n_rows = self.shape_sensor[0]
+        rows, cols = np.indices(self.shape_sensor)
+        self._orient_idx = (n_rows - 1 - rows) + n_rows * cols
+
         # capture thread sets every time it gets a frame,
         # _grab waits every time.
         # keeps us from returning same frame twice
         self._grab_event = threading.Event()
 
         # interpolation properties
-        self._grid_x = None
-        self._grid_y = None
-        self._points = list(product(range(self.shape_sensor[0]),
-                                    range(self.shape_sensor[1])))
+        self._interp_rows = None
+        self._interp_cols = None
 
         # set attributes
         self.integrate_frames = integrate_frames
@@ -416,8 +460,13 @@ class MLX90640(Camera):
 
     @integrate_frames.setter
     def integrate_frames(self, integrate_frames):
-        self._frames = np.zeros((self.shape_sensor[0], self.shape_sensor[1], integrate_frames))
-        self._integrate_frames = integrate_frames
+        with self._frames_lock:
+            # frames along the first axis so each one is contiguous
+            self._frames = np.zeros((integrate_frames, self.shape_sensor[0], self.shape_sensor[1]))
+            self._frame_sum = np.zeros(self.shape_sensor)
+            self._n_frames = 0
+            self._frame_idx = 0
+            self._integrate_frames = integrate_frames
 
     @property
     def interpolate(self):
@@ -426,8 +475,8 @@ class MLX90640(Camera):
     @interpolate.setter
     def interpolate(self, interpolate):
         if interpolate is not None:
-            self._grid_y, self._grid_x = np.meshgrid(np.linspace(0, 24, 24 * interpolate),
-                                                   np.linspace(0, 32, 32 * interpolate))
+            self._interp_rows = cubic_interpolation_matrix(self.shape_sensor[0], self.shape_sensor[0] * interpolate)
+            self._interp_cols = cubic_interpolation_matrix(self.shape_sensor[1], self.shape_sensor[1] * interpolate).T
         self._interpolate = interpolate
 
 
@@ -448,32 +497,34 @@ class MLX90640(Camera):
 
     def _threaded_capture(self):
         """
-        Continually capture frames into the :attr:`~MLX90640._frames` ring buffer
+        Continually capture frames into the :attr:`~MLX90640._frames` ring buffer,
+        updating the running sum :attr:`~MLX90640._frame_sum`
 
         Stops when :attr:`~MLX90640.stopping` is set.
         """
         while not self.stopping.is_set():
+            # image comes in all wonky, reorient it with a precomputed index
+            # rather than reshaping, transposing, and rotating it
+            frame = np.asarray(self.cam.get_frame(), dtype=float)[self._orient_idx]
+
+            with self._frames_lock:
+                # swap the oldest frame in the ringbuffer out of the sum
+                self._frame_sum += frame
+                self._frame_sum -= self._frames[self._frame_idx]
+                self._frames[self._frame_idx] = frame
+                self._n_frames = min(self._n_frames + 1, self.integrate_frames)
+                self._frame_idx = (self._frame_idx + 1) % self.integrate_frames
+
+                if self._frame_idx == 0:
+                    # recompute the sum once per lap so rounding errors don't accumulate
+                    np.sum(self._frames, axis=0, out=self._frame_sum)
 
-            # store the frame in the ringbuffer
-            # image comes in all wonky and this is a weird combo of instance and module methods...
-            # in order:
-            # get frame, cast as array
-            # reshape using fortran order and transpose
-            # rotate 90 degrees to get normal orientation.
-            self._frames[:, :, self._frame_idx] = np.rot90(
-                np.array(
-                    self.cam.get_frame()
-                ).reshape(
-                    (self.shape_sensor[0], self.shape_sensor[1]),
-                    order="F").T
-            )
             self._grab_event.set()
-            self._frame_idx = (self._frame_idx + 1) % self.integrate_frames
 
     def _grab(self):
         """
         Await the :attr:`~MLX90640._grab_event` and then average over the frames stored in
-        :attr:`~MLX90640._frames`
+        :attr:`~MLX90640._frames` from their running sum
 
         Returns:
             (:class:`~numpy.ndarray`) Averaged and interpolated frame
@@ -482,7 +533,8 @@ class MLX90640(Camera):
         if not ret:
             return None
 
-        frame = np.mean(self._frames, axis=2)
+        with self._frames_lock:
+            frame = self._frame_sum / max(self._n_frames, 1)
         self._grab_event.clear()
 
         if self.interpolate is not None:
@@ -501,7 +553,8 @@ class MLX90640(Camera):
 
     def interpolate_frame(self, frame):
         """
-        Interpolate frame according to :attr:`~MLX90640.interpolate` using :meth:`scipy.interpolate.griddata`
+        Interpolate frame according to :attr:`~MLX90640.interpolate` with the precomputed
+        cubic interpolation matrices, see :func:`.cubic_interpolation_matrix`
 
         Args:
             frame (:class:`numpy.ndarray`): Frame to interpolate
@@ -509,10 +562,7 @@ class MLX90640(Camera):
         Returns:
             (:class:`numpy.ndarray`): Interpolated Frame
         """
-        return griddata(self._points,
-                        frame.flatten(),
-                        (self._grid_x, self._grid_y),
-                        method='cubic')
+        return self._interp_rows @ frame @ self._interp_cols
 
     def release(self):
         """
@@ -91,7 +91,8 @@ TERMINAL_PREFS = odict({
     'DRAWFPS': {'type': 'int', "text": "FPS to draw videos displayed during acquisition",
                 "default": "20"},
     'PILOT_DB': {'type': 'str', 'text': "filename to use for the .json pilot_db that maps pilots to subjects (relative to BASEDIR)",
-                 "default": "pilot_db.json"}
+                 "default": "pilot_db.json"},
+    'WRITER_PROCESS': {'type': 'bool', 'text': "Store subject data in a separate process? (recommended for many concurrent pilots)"}
 })
 
 DIRECTORY_STRUCTURE = {
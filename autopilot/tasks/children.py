@@ -67,8 +67,10 @@ class Video_Child(object):
     PARAMS = odict()
     PARAMS['cams'] = {'tag': 'Dictionary of camera params, or list of dicts',
                       'type': ('dict', 'list')}
+    PARAMS['sync'] = {'tag': 'Synchronize cameras - True, or dict of Camera_Group params',
+                      'type': ('bool', 'dict')}
 
-    def __init__(self, cams=None, stage_block = None, start_now=True, **kwargs):
+    def __init__(self, cams=None, stage_block = None, start_now=True, sync=False, **kwargs):
         """
         Args:
             cams (dict, list): Should be a dictionary of camera parameters or a list of dicts. Dicts should have, at least::
@@ -78,6 +80,10 @@ class Video_Child(object):
                     'name': 'name_of_camera_in_task',
                     'param1': 'first_param'
                 }
+
+            sync (bool, dict): if truthy, capture from the cameras with a :class:`.cameras.Camera_Group`
+                so their frames are matched into synchronized sets. A dict is passed to the group as
+                arguments, eg. ``{'trigger': 'SIDE', 'stream': {'to': 'T'}}``
         """
 
         if cams is None:
@@ -108,6 +114,10 @@ class Video_Child(object):
                 except AttributeError:
                     AttributeError("Camera type {} not found!".format(cam['type']))
 
+        self.group = None
+        if sync:
+            self.group = cameras.Camera_Group(self.cams, **(sync if isinstance(sync, dict) else {}))
+
         self.stages = cycle([self.noop])
         self.stage_block = stage_block
 
@@ -119,10 +129,18 @@ class Video_Child(object):
         # self.thread.start()
 
     def start(self):
+        if self.group is not None:
+            self.group.capture()
+            return
+
         for cam in self.cams.values():
             cam.capture()
 
     def stop(self):
+        if self.group is not None:
+            self.group.release()
+            return
+
         for cam_name, cam in self.cams.items():
             try:
                 cam.release()
@@ -3,7 +3,6 @@ Object that implement Graduation criteria to move between
 different tasks in a protocol.
 """
 
-from collections import deque
 import numpy as np
 from itertools import count
 
@@ -14,6 +13,11 @@ class Graduation(object):
     All Graduation objects need to populate PARAMS, COLS, and define an
     `update` method.
 
+    Graduation objects can also define an `evaluate` method to check the
+    graduation criterion over a whole history of trials at once (eg. to see when
+    subjects would have graduated with different parameters), and a `seed_rows`
+    classmethod to limit how many past rows of `COLS` are loaded to initialize them.
+
     """
     PARAMS = []
     """
@@ -32,10 +36,59 @@ class Graduation(object):
         """
         Exception('The update method was not redefined by the subclass!')
 
+    def evaluate(self, data):
+        """
+        Evaluate the graduation criterion for every trial in some trial data,
+        as if the object had been created before the first trial.
+
+        Args:
+            data (:class:`pandas.DataFrame`, dict): trial data with this object's `COLS`
+
+        Returns:
+            :class:`numpy.ndarray`: boolean array, whether :meth:`.update` would have returned True after each trial,
+            or None if the subclass doesn't define this method.
+        """
+        return None
+
+    def graduation_trial(self, data):
+        """
+        Find the trial that the criterion would have first been met on, see :meth:`.evaluate`
+
+        Args:
+            data (:class:`pandas.DataFrame`, dict): trial data with this object's `COLS`
+
+        Returns:
+            int: index of the first trial that met the criterion, or None if it was never met
+            or the subclass can't :meth:`.evaluate` trial data.
+        """
+        graduated = self.evaluate(data)
+        if graduated is None:
+            return None
+        graduated = np.flatnonzero(graduated)
+        if len(graduated) == 0:
+            return None
+        return int(graduated[0])
+
+    @classmethod
+    def seed_rows(cls, params):
+        """
+        Number of most recent rows of `COLS` needed to initialize the object.
+
+        Args:
+            params (dict): parameters that the object will be created with
+
+        Returns:
+            int: number of rows, or None (default) if all rows are needed.
+        """
+        return None
+
 
 class Accuracy(Graduation):
     """
     Graduate stage based on percent accuracy over some window of trials.
+
+    Corrects are kept in a ring buffer with a running sum, so each :meth:`.update`
+    is constant-time regardless of the size of the window.
     """
 
     PARAMS = ['threshold', 'window']
@@ -52,15 +105,33 @@ class Accuracy(Graduation):
         self.threshold = float(threshold)
         self.window    = int(window)
 
-        self.corrects = deque(maxlen=self.window)
+        self.corrects = np.zeros(self.window, dtype=np.int8)
+        self.n_corrects = 0
+        self.n_correct = 0
+        self._idx = 0
 
         if 'correct' in kwargs.keys():
-            # don't need to trim, dqs take the last values already
-            self.corrects.extend(kwargs['correct'])
+            # only the last values fit in the window anyway
+            corrects = np.asarray(kwargs['correct'], dtype=np.int8)[-self.window:]
+            self.corrects[:len(corrects)] = corrects
+            self.n_corrects = len(corrects)
+            self.n_correct = int(np.sum(corrects))
+            self._idx = self.n_corrects % self.window
         else:
             Warning("correct column not given")
 
+    @classmethod
+    def seed_rows(cls, params):
+        """
+        Only the last `window` trials are needed.
+
+        Args:
+            params (dict): parameters that the object will be created with
 
+        Returns:
+            int: `window`
+        """
+        return int(params.get('window', 500))
 
     def update(self, row):
         """
@@ -74,19 +145,46 @@ class Accuracy(Graduation):
             bool: Did we graduate this time or not?
         """
         try:
-            self.corrects.append(int(row['correct']))
+            correct = int(row['correct'])
         except KeyError:
             Warning("key 'correct' not found in trial_row")
             return False
 
-        if len(self.corrects)<self.window:
+        # replace the oldest correct in the buffer
+        self.n_correct += correct - int(self.corrects[self._idx])
+        self.corrects[self._idx] = correct
+        self._idx = (self._idx + 1) % self.window
+        self.n_corrects = min(self.n_corrects + 1, self.window)
+
+        if self.n_corrects<self.window:
             return False
 
-        if np.mean(self.corrects)>self.threshold:
+        if self.n_correct / self.window > self.threshold:
             return True
         else:
             return False
 
+    def evaluate(self, data):
+        """
+        Accuracy over a rolling window of trials is above the threshold.
+
+        Args:
+            data (:class:`pandas.DataFrame`, dict): trial data with a 'correct' column
+
+        Returns:
+            :class:`numpy.ndarray`: boolean array, whether :meth:`.update` would have returned True after each trial.
+        """
+        corrects = np.asarray(data['correct'], dtype=np.int64)
+        graduated = np.zeros(len(corrects), dtype=bool)
+        if len(corrects) < self.window:
+            return graduated
+
+        cumsum = np.cumsum(corrects)
+        n_correct = cumsum[self.window-1:].copy()
+        n_correct[1:] -= cumsum[:-self.window]
+        graduated[self.window-1:] = n_correct / self.window > self.threshold
+        return graduated
+
 
 class NTrials(Graduation):
     """
@@ -107,7 +205,8 @@ class NTrials(Graduation):
         #super(NTrials, self).__init__()
 
         self.n_trials = int(n_trials)
-        self.counter = count(start=int(current_trial))
+        self.current_trial = int(current_trial)
+        self.counter = count(start=self.current_trial)
 
     def update(self, row):
         """
@@ -138,6 +237,37 @@ class NTrials(Graduation):
         else:
             return False
 
+    def evaluate(self, data):
+        """
+        The trial number is at least `n_trials`
+
+        Args:
+            data (:class:`pandas.DataFrame`, dict): trial data. if it has a 'trial_num' column,
+                it is used, otherwise trials are counted from `current_trial`
+
+        Returns:
+            :class:`numpy.ndarray`: boolean array, whether :meth:`.update` would have returned True after each trial.
+        """
+        try:
+            trials = np.asarray(data['trial_num'])
+        except KeyError:
+            n = len(data[next(iter(data))])
+            trials = np.arange(self.current_trial, self.current_trial + n)
+        return trials >= self.n_trials
+
+    @classmethod
+    def seed_rows(cls, params):
+        """
+        No past rows are needed.
+
+        Args:
+            params (dict): parameters that the object will be created with
+
+        Returns:
+            int: 0
+        """
+        return 0
+
 
 
 
@@ -60,7 +60,7 @@ def plot_psychometric(subject_protocols):
 
     for subject, step, var, n_trials in subject_protocols:
         # load subject dataframe and subset
-        asub = Subject(subject)
+        asub = Subject(subject, mode='r')
         sub_df = asub.get_trial_data(step)
 
         if n_trials>0:
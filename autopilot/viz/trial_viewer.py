@@ -14,6 +14,9 @@ from autopilot.core import utils
 
 from glob import glob
 import argparse
+import multiprocessing as mp
+import pandas as pd
+import tables
 from bokeh.plotting import figure
 from bokeh.io import show
 from bokeh.models import ColumnDataSource, Legend, LegendItem, Span
@@ -36,7 +39,7 @@ def load_subject_data(data_dir, subject_name, steps=True, grad=True):
     # find pilot for subject
     pilot_name = pilot_db[subject_name]
 
-    amus = subject.Subject(subject_name, dir=data_dir)
+    amus = subject.Subject(subject_name, dir=data_dir, mode='r')
 
     step_data = None
     grad_data = None
@@ -64,41 +67,190 @@ def load_subject_data(data_dir, subject_name, steps=True, grad=True):
 
 
 
-def load_subject_dir(data_dir, steps=True, grad=True, which = None):
+def _read_subject_file(h5_path, steps=True, grad=True):
+    """
+    Read trial and step data from a subject file without ever opening it for writing.
+
+    Unlike :class:`~.core.subject.Subject`, this doesn't check the file's structure or
+    stash a hash row, so it is safe to call from many processes at once.
+
+    Returns the same data as :meth:`.Subject.get_trial_data` (for the most recent step with data)
+    and :meth:`.Subject.get_step_history` .
+
+    Args:
+        h5_path (str): path to a subject's .h5 file
+        steps (bool): whether to read trial data
+        grad (bool): whether to read step history
+
+    Returns:
+        tuple: (step_data, grad_data), either of which may be None
+    """
+    step_data = None
+    grad_data = None
+
+    with tables.open_file(h5_path, mode='r') as h5f:
+        group = None
+        if '/current' in h5f:
+            protocol_name = h5f.get_node_attr('/current', 'protocol_name')
+            group = h5f.get_node('/data/{}'.format(protocol_name))
+
+        if steps and group is not None:
+            # find the last trial step with data, in the subject's file or its session files
+            for step_key in sorted(group._v_children.keys(), reverse=True):
+                step_trials = subject.read_trials(h5f, group._v_children[step_key].trial_data)
+                if len(step_trials) > 0:
+                    step_data = pd.DataFrame(step_trials)
+                    step_data['step'] = int(step_key[1:3])
+                    step_data['step_name'] = step_key
+                    break
+
+        if grad:
+            if '/history/history' in h5f:
+                history = h5f.root.history.history.read()
+                history = history[history['type'] == b'step']
+                if len(history) > 0:
+                    grad_data = pd.DataFrame({
+                        'step_n': history['value'].astype(str),
+                        'timestamp': pd.to_datetime(history['time'].astype(str), format='%y%m%d-%H%M%S'),
+                        'name': history['name'].astype(str)
+                    })
+
+            if grad_data is None and group is not None:
+                # older files didn't stash step changes in the history table
+                grad_data = _step_history_from_data(group)
+
+    return step_data, grad_data
+
+
+def _step_history_from_data(group):
+    """
+    Reconstruct step history from the trial tables of a protocol, like
+    :meth:`.Subject.get_step_history` with ``use_history=False`` , for files whose
+    history table has no step changes.
+
+    Each step with trial data, in the subject's file or its session files, is dated by the
+    first value of its first timestamp column.
+
+    Args:
+        group (:class:`tables.Group`): the ``/data/<protocol_name>`` group of a subject file
+
+    Returns:
+        :class:`pandas.DataFrame`: with columns step_n, timestamp, and name, or None if no step has data
+    """
+    rows = []
+    for step_key in sorted(group._v_children.keys()):
+        step_group = group._v_children[step_key]
+        if 'trial_data' not in step_group:
+            continue
+        step_trials = subject.read_trials(group._v_file, step_group.trial_data)
+        if len(step_trials) == 0:
+            continue
+
+        ts_columns = [col for col in step_trials.dtype.names if 'timestamp' in col]
+        timestamp = None
+        if ts_columns:
+            timestamp = step_trials[ts_columns[0]][0]
+            if isinstance(timestamp, bytes):
+                timestamp = timestamp.decode('utf-8')
+
+        rows.append({'step_n': int(step_key[1:3]),
+                     'timestamp': pd.to_datetime(timestamp, errors='coerce'),
+                     'name': step_key[4:]})
+
+    if not rows:
+        return None
+    return pd.DataFrame(rows)
+
+
+def _load_subject_worker(args):
     """
+    Unpack arguments for :func:`._read_subject_file` in a :class:`multiprocessing.Pool`
+    and label the resulting dataframes with the subject and pilot.
+
+    Args:
+        args (tuple): (h5_path, subject_name, pilot_name, steps, grad)
+
+    Returns:
+        tuple: (subject_name, step_data, grad_data)
+    """
+    h5_path, subject_name, pilot_name, steps, grad = args
+    step_data, grad_data = _read_subject_file(h5_path, steps, grad)
+
+    for df in (step_data, grad_data):
+        if df is not None:
+            df['subject'] = subject_name
+            df['pilot'] = pilot_name
+
+    return subject_name, step_data, grad_data
+
+
+def load_cohort(data_dir, steps=True, grad=True, which=None, n_procs=None, pilot_db=None):
+    """
+    Load trial and step data from every subject file in a directory in parallel.
+
+    Files are opened read-only in a pool of spawned worker processes, and each subject's dataframe
+    is concatenated once at the end rather than appended one by one.
+
+    Since workers are spawned, scripts that call this should do so under ``if __name__ == '__main__':``
+
     Args:
         data_dir (str): A path to a directory with :class:`~.core.subject.Subject` style hdf5 files
         steps (bool): Whether to return full trial-level data for each step
         grad (bool): Whether to return summarized step graduation data.
         which (list): A list of subjects to subset the loaded subjects to
+        n_procs (int): Number of worker processes. if None, uses :func:`multiprocessing.cpu_count`
+        pilot_db (dict): a reversed pilot_db mapping subject to pilot, if None, loaded with
+            :func:`.utils.load_pilotdb`
 
+    Returns:
+        tuple: (all_steps, all_grad) :class:`pandas.DataFrame` s, or None if not requested.
     """
-
     subject_fn = [os.path.splitext(fn)[0] for fn in os.listdir(data_dir) if fn.endswith('.h5')]
 
     if isinstance(which, list):
-        subject_fn = [fn for fn in subject_fn if (fn in which) or (fn.rstrip('.h5') in which)]
+        subject_fn = [fn for fn in subject_fn if fn in which]
+
+    if pilot_db is None:
+        pilot_db = utils.load_pilotdb(reverse=True)
+
+    jobs = [(os.path.join(data_dir, subject_name + '.h5'),
+             subject_name,
+             pilot_db.get(subject_name, None),
+             steps, grad) for subject_name in sorted(subject_fn)]
 
-    all_mice_steps = None
-    all_mice_grad = None
+    if n_procs is None:
+        n_procs = mp.cpu_count()
+    n_procs = max(1, min(n_procs, len(jobs)))
 
-    for subject_name in tqdm(subject_fn):
-        subject_name = os.path.splitext(subject_name)[0]
-        step_data, grad_data = load_subject_data(data_dir, subject_name, steps, grad)
+    results = {}
+    # spawn rather than fork, the caller may have a GUI and threads running
+    with mp.get_context('spawn').Pool(n_procs) as pool:
+        for subject_name, step_data, grad_data in tqdm(pool.imap_unordered(_load_subject_worker, jobs),
+                                                       total=len(jobs)):
+            results[subject_name] = (step_data, grad_data)
 
-        if step_data is not None:
-            if all_mice_steps is not None:
-                all_mice_steps = all_mice_steps.append(step_data)
-            else:
-                all_mice_steps = step_data
+    # concatenate once in a stable order regardless of which worker finished first
+    ordered = [results[name] for name in sorted(results.keys())]
+    step_frames = [r[0] for r in ordered if r[0] is not None]
+    grad_frames = [r[1] for r in ordered if r[1] is not None]
 
-        if grad_data is not None:
-            if all_mice_grad is not None:
-                all_mice_grad = all_mice_grad.append(grad_data)
-            else:
-                all_mice_grad = grad_data
+    all_steps = pd.concat(step_frames, ignore_index=True, sort=False) if step_frames else None
+    all_grad = pd.concat(grad_frames, ignore_index=True, sort=False) if grad_frames else None
 
-    return all_mice_steps, all_mice_grad
+    return all_steps, all_grad
+
+
+def load_subject_dir(data_dir, steps=True, grad=True, which = None):
+    """
+    Args:
+        data_dir (str): A path to a directory with :class:`~.core.subject.Subject` style hdf5 files
+        steps (bool): Whether to return full trial-level data for each step
+        grad (bool): Whether to return summarized step graduation data.
+        which (list): A list of subjects to subset the loaded subjects to
+
+    See :func:`.load_cohort` , which this wraps.
+    """
+    return load_cohort(data_dir, steps=steps, grad=grad, which=which)
 
 
 